@@ -0,0 +1,237 @@
+import os
+import time
+import asyncio
+import threading
+from cache_utils import connect_cache_db, CACHE_DB_PATH
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов (token bucket).
+    rate - запросов в секунду, capacity - допустимый «всплеск» запросов.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Резервирует запрос и возвращает, сколько секунд нужно подождать перед ним"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Резервируем токен заранее: отрицательный баланс - очередь ожидающих
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self):
+        """Блокирует поток до момента, когда запрос разрешён"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """То же для asyncio: ожидание не блокирует цикл событий"""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# Бесплатный план ORS: 2500 запросов в сутки (счётчик общий для всех сессий и процессов)
+ORS_DAILY_LIMIT = int(os.environ.get("ORS_DAILY_LIMIT", 2500))
+# Предохранитель размыкается после стольких ошибок 429/5xx подряд ...
+CIRCUIT_FAILURES = 5
+# ... и на столько секунд запросы к API не выполняются
+CIRCUIT_COOLDOWN = 60
+# Сколько дней хранить суточные счётчики запросов
+USAGE_KEEP_DAYS = 30
+
+
+class ApiUnavailableError(Exception):
+    """Запрос к API не выполнялся: исчерпана суточная квота или разомкнут предохранитель"""
+
+
+def _today():
+    """Текущие сутки (UTC) - ключ суточного счётчика"""
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class DailyQuota:
+    """
+    Суточный счётчик запросов к API в SQLite базе кэша: переживает перезапуски
+    приложения и общий для всех процессов, работающих с одной базой.
+    """
+
+    def __init__(self, name, limit, path=CACHE_DB_PATH):
+        self.name = name
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._conn = connect_cache_db(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS api_usage (
+                api TEXT NOT NULL,
+                day TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (api, day)
+            )
+        """)
+        cutoff = time.strftime("%Y-%m-%d", time.gmtime(time.time() - USAGE_KEEP_DAYS * 24 * 3600))
+        self._conn.execute("DELETE FROM api_usage WHERE day < ?", (cutoff,))
+
+    def consume(self, n=1):
+        """Учитывает n запросов; False, если они не помещаются в суточный лимит"""
+        day = _today()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO api_usage(api, day, requests) VALUES (?, ?, 0)", (self.name, day)
+            )
+            # Проверка и увеличение одним запросом - атомарно и между процессами
+            cursor = self._conn.execute(
+                "UPDATE api_usage SET requests = requests + ? WHERE api = ? AND day = ? AND requests + ? <= ?",
+                (n, self.name, day, n, self.limit)
+            )
+            return cursor.rowcount == 1
+
+    def used(self):
+        """Запросов за текущие сутки"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT requests FROM api_usage WHERE api = ? AND day = ?", (self.name, _today())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def remaining(self):
+        return max(self.limit - self.used(), 0)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failures ошибок подряд размыкается на cooldown секунд,
+    запросы в это время отклоняются сразу. Затем пропускается один пробный запрос:
+    успех замыкает предохранитель, ошибка - размыкает снова.
+    """
+
+    def __init__(self, failures=CIRCUIT_FAILURES, cooldown=CIRCUIT_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._errors = 0
+        self._opened_at = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли выполнить запрос сейчас"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probe or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            # Охлаждение прошло - пропускаем один пробный запрос
+            self._probe = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self._errors += 1
+            if self._probe or self._errors >= self.failures:
+                self._opened_at = time.monotonic()
+                self._probe = False
+
+    def retry_in(self):
+        """Секунд до пробного запроса (0 - предохранитель замкнут)"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(self.cooldown - (time.monotonic() - self._opened_at), 0)
+
+
+def is_api_failure(error):
+    """
+    Ошибка, говорящая о недоступности API (срабатывает предохранитель): 429, 5xx,
+    сетевые ошибки и таймауты. Прочие 4xx - API отвечает, ошибка в самом запросе.
+    """
+    status = getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(error, "status_code", None)
+    if not isinstance(status, int):
+        return True
+    return status == 429 or status >= 500
+
+
+class ApiGuard:
+    """Защита обращений к внешнему API: суточная квота (если задана) и предохранитель"""
+
+    def __init__(self, name, quota=None, breaker=None):
+        self.name = name
+        self.quota = quota
+        self.breaker = breaker or CircuitBreaker()
+
+    def available(self):
+        """Есть ли смысл обращаться к API: предохранитель замкнут и квота не исчерпана"""
+        return self.breaker.retry_in() == 0 and (self.quota is None or self.quota.remaining() > 0)
+
+    def check(self):
+        """Разрешает один запрос или сразу выбрасывает ApiUnavailableError"""
+        if self.quota is not None and self.quota.remaining() == 0:
+            raise self._quota_error()
+        if not self.breaker.allow():
+            raise ApiUnavailableError(
+                f"{self.name} временно недоступен: повтор через {self.breaker.retry_in():.0f} с"
+            )
+        if self.quota is not None and not self.quota.consume():
+            # Квоту исчерпал другой процесс: запрос не выполнен, пробный тоже считаем неудачным
+            self.breaker.record_failure()
+            raise self._quota_error()
+
+    def _quota_error(self):
+        return ApiUnavailableError(f"Суточная квота {self.name} исчерпана ({self.quota.limit} запросов)")
+
+    def record(self, error=None):
+        """Учитывает результат запроса: успешный ответ или исключение"""
+        if error is not None and is_api_failure(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def call(self, func, *args, **kwargs):
+        """Выполняет запрос func(*args, **kwargs) под защитой квоты и предохранителя"""
+        self.check()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record()
+        return result
+
+    def status(self):
+        """Состояние для панели отладки"""
+        status = {"name": self.name, "retry_in": self.breaker.retry_in()}
+        if self.quota is not None:
+            status.update(used=self.quota.used(), limit=self.quota.limit)
+        return status
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_api_guard(name):
+    """Общая для всех сессий защита API: "ors" - с суточной квотой, "nominatim" - только предохранитель"""
+    with _guards_lock:
+        if name not in _guards:
+            if name == "ors":
+                _guards[name] = ApiGuard("ORS", DailyQuota(name, ORS_DAILY_LIMIT))
+            else:
+                _guards[name] = ApiGuard("Nominatim")
+        return _guards[name]
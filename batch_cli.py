@@ -0,0 +1,135 @@
+"""
+Пакетный расчёт ведомости доставки материалов без веб-интерфейса.
+
+Пример:
+    python batch_cli.py suppliers.xlsx --object-address "Калининград, ул. Гагарина, 229" \
+        --output Ведомость_поставщиков.xlsx --map transport_map.html
+
+Файл поставщиков (CSV или XLSX) должен содержать столбцы "Наименование поставщика"
+и "Адрес" и/или "Координаты" ("широта, долгота"); необязательные столбцы -
+"Наименование материала", "Вид работ", "Цвет". Подходит и выгрузка базы поставщиков
+("Название компании", "Адрес компании", "Координаты").
+"""
+import os
+import sys
+import argparse
+from types import SimpleNamespace
+import pandas as pd
+from utils import log_error, log_info, log_warning, geocode_address_cached, init_ors_client
+from import_utils import (
+    iter_supplier_rows, validate_rows, geocode_rows, route_rows, build_records, parse_coords,
+    ORS_DIRECTIONS_PER_MINUTE, ROUTE_WORKERS
+)
+from export_utils import excel_bytes, map_html_file, geojson_bytes, DELIVERY_COLUMNS
+from map_utils import build_delivery_export
+from spatial_utils import tolerance_for_zoom, EXPORT_ROUTE_ZOOM
+from haul_utils import HaulEngine
+from event_log import EventLog
+
+
+def progress(message):
+    """Строка хода выполнения (в stderr, чтобы не смешиваться с выводом данных)"""
+    print(message, file=sys.stderr, flush=True)
+
+
+def resolve_object(session_state, args):
+    """Координаты и адрес объекта из аргументов командной строки"""
+    if args.object_coords:
+        coords = parse_coords(args.object_coords)
+        if coords is None:
+            raise ValueError(f"Некорректные координаты объекта: {args.object_coords}")
+        return coords, args.object_address or f"Координаты: {coords[0]:.5f}, {coords[1]:.5f}"
+    coords, full_addr = geocode_address_cached(session_state, args.object_address)
+    if coords is None:
+        raise ValueError(f"Не удалось определить координаты объекта: {args.object_address}")
+    return coords, full_addr
+
+
+def save_outputs(records, object_coords, excel_path, map_path, routes_path=None):
+    """Записывает ведомость (XLSX), карту (HTML, .gz - со сжатием) и маршруты (GeoJSON)"""
+    if excel_path:
+        with open(excel_path, "wb") as f:
+            f.write(excel_bytes(pd.DataFrame(records), DELIVERY_COLUMNS))
+        progress(f"Ведомость сохранена: {excel_path}")
+    if map_path or routes_path:
+        m, routes = build_delivery_export(
+            records, object_coords, tolerance_for_zoom(EXPORT_ROUTE_ZOOM, object_coords[0])
+        )
+        if map_path:
+            data, _, _ = map_html_file(m, compress=map_path.endswith(".gz"))
+            with open(map_path, "wb") as f:
+                f.write(data)
+            progress(f"Карта сохранена: {map_path}")
+        if routes_path:
+            with open(routes_path, "wb") as f:
+                f.write(geojson_bytes(routes))
+            progress(f"Маршруты сохранены: {routes_path}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный расчёт ведомости доставки материалов")
+    parser.add_argument("suppliers", help="CSV или XLSX со списком поставщиков")
+    parser.add_argument("--object-address", help="Адрес объекта (места размещения)")
+    parser.add_argument("--object-coords", help="Координаты объекта: \"широта, долгота\"")
+    parser.add_argument("--output", default="Ведомость_поставщиков.xlsx", help="Путь к XLSX ведомости")
+    parser.add_argument("--map", default="transport_map.html",
+                        help="Путь к HTML карты (.html.gz - со сжатием, пусто - не сохранять)")
+    parser.add_argument("--routes", help="Путь к GeoJSON с маршрутами")
+    parser.add_argument("--ors-key", default=os.environ.get("ORS_API_KEY", ""),
+                        help="API-ключ OpenRouteService (по умолчанию из ORS_API_KEY)")
+    parser.add_argument("--rate", type=float, default=ORS_DIRECTIONS_PER_MINUTE,
+                        help="Лимит запросов маршрутов ORS в минуту")
+    parser.add_argument("--workers", type=int, default=ROUTE_WORKERS, help="Число параллельных запросов маршрутов")
+    args = parser.parse_args(argv)
+    if not args.object_address and not args.object_coords:
+        parser.error("укажите --object-address или --object-coords")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Те же функции, что и в веб-интерфейсе, работают с лёгкой заменой session_state
+    session_state = SimpleNamespace(error_log=EventLog(), ors_api_key=args.ors_key)
+
+    try:
+        supplier_rows, errors = validate_rows(iter_supplier_rows(args.suppliers, args.suppliers))
+        object_coords, object_addr = resolve_object(session_state, args)
+    except (OSError, ValueError) as e:
+        log_error(session_state, str(e))
+        progress(f"Ошибка: {e}")
+        return 1
+    for line, message in errors:
+        progress(f"Строка {line}: {message} - пропущена")
+    progress(f"Объект: {object_addr} {object_coords}; поставщиков к расчёту: {len(supplier_rows)}")
+
+    ors_client = init_ors_client(session_state)
+    if ors_client is None:
+        log_warning(session_state, "API-ключ ORS не задан, расстояния будут рассчитаны по прямой")
+        progress("API-ключ ORS не задан, расстояния будут рассчитаны по прямой")
+
+    progress("Геокодирование адресов")
+    geocode_rows(session_state, supplier_rows, lambda done, total, address, coords: progress(
+        f"  [{done}/{total}] {address} - {'OK' if coords else 'не найден'}"
+    ))
+    progress("Маршруты")
+    route_rows(session_state, ors_client, supplier_rows, object_coords, args.rate, args.workers,
+               lambda done, total, row: progress(
+                   f"  [{done}/{total}] {row['name']}: {row['distance']} км "
+                   f"({'по дорогам' if row['route_coords'] else 'по прямой'})"
+               ))
+    records = HaulEngine().apply(build_records(supplier_rows, object_coords, object_addr))
+
+    skipped = len(supplier_rows) - len(records)
+    if skipped:
+        progress(f"Пропущено поставщиков без координат: {skipped}")
+    if not records:
+        progress("Ошибка: ни для одного поставщика не удалось определить координаты")
+        return 1
+
+    save_outputs(records, object_coords, args.output, args.map, args.routes)
+    log_info(session_state, f"Пакетный расчёт завершён: {len(records)} поставщиков")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
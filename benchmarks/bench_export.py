@@ -0,0 +1,14 @@
+"""Экспорт ведомости поставщиков в Excel"""
+from export_utils import excel_bytes, DELIVERY_COLUMNS
+from synthetic import make_delivery_rows
+
+_delivery_cache = {}
+
+
+def bench_excel_export(benchmark, rows):
+    """Ведомость из rows строк: выбор столбцов, ширины и запись xlsx (constant_memory для больших)"""
+    if rows not in _delivery_cache:
+        _delivery_cache[rows] = make_delivery_rows(rows)
+    df = _delivery_cache[rows]
+    data = benchmark.pedantic(excel_bytes, args=(df, DELIVERY_COLUMNS), rounds=3)
+    assert data[:2] == b"PK"
@@ -0,0 +1,24 @@
+"""Средняя дальность возки по ведомости доставки"""
+from haul_utils import HaulEngine
+from synthetic import make_delivery_rows
+
+AVERAGE_COLUMN = "Средняя дальность возки, км"
+
+_delivery_cache = {}
+
+
+def _records(rows):
+    """Новые словари строк ведомости - как после очистки и повторной загрузки"""
+    if rows not in _delivery_cache:
+        _delivery_cache[rows] = make_delivery_rows(rows)
+    return _delivery_cache[rows].to_dict("records")
+
+
+def bench_haul_apply_reimport(benchmark, service_rows):
+    """Очистка и повторная загрузка тех же строк: средняя дальность пишется во все новые строки"""
+    engine = HaulEngine()
+    expected = [record[AVERAGE_COLUMN] for record in engine.apply(_records(service_rows))]
+    assert expected != [record[AVERAGE_COLUMN] for record in _records(service_rows)]
+
+    result = benchmark.pedantic(engine.apply, setup=lambda: ((_records(service_rows),), {}), rounds=3)
+    assert [record[AVERAGE_COLUMN] for record in result] == expected
@@ -0,0 +1,39 @@
+"""Построение карты модуля поставщиков и её отрисовка в HTML"""
+import folium
+from map_utils import build_object_map, add_supplier_points
+from export_utils import map_html_file
+from supplier_data import get_okved_list
+from synthetic import REGION_CENTERS
+
+
+def _category(suppliers):
+    """Поставщики одной категории ОКВЭД - то, что модуль выводит на карту"""
+    okved = get_okved_list(suppliers)[0]
+    return suppliers[suppliers['Главный ОКВЭД (название)'] == okved]
+
+
+def _base_map(suppliers):
+    # Как build_supplier_base_map в supplier.py (модуль - скрипт Streamlit, импортировать его нельзя)
+    m = build_object_map(REGION_CENTERS[0], radius=10, popup=folium.Popup("Объект", max_width=200))
+    add_supplier_points(m, suppliers)
+    return m
+
+
+def bench_map_build(benchmark, suppliers_df):
+    """Базовая карта с точками категории: маркеры или кластер в зависимости от числа точек"""
+    suppliers = _category(suppliers_df)
+    m = benchmark(_base_map, suppliers)
+    assert m._children
+
+
+def bench_map_build_all(benchmark, suppliers_df):
+    """Базовая карта со всей базой (худший случай для кластеризации)"""
+    m = benchmark.pedantic(_base_map, args=(suppliers_df,), rounds=3)
+    assert m._children
+
+
+def bench_map_render(benchmark, suppliers_df):
+    """Отрисовка HTML карты категории - основная часть работы st_folium и экспорта карты"""
+    m = _base_map(_category(suppliers_df))
+    data, _, _ = benchmark.pedantic(map_html_file, args=(m,), rounds=3)
+    assert data
@@ -0,0 +1,81 @@
+"""
+Маршруты через удалённый ORS (локальная заглушка geo_stub_server по HTTP): пул асинхронного клиента,
+суточная квота и предохранитель, отрицательный кэш маршрутов. В bench_services клиент-подделка
+не является openrouteservice.Client, поэтому там замеряется последовательная ветка локального графа.
+"""
+import itertools
+import openrouteservice
+from ors_async import ORS_BASE_URL
+from import_utils import route_rows
+from utils import get_distances_to_object_ors
+from synthetic import make_suppliers, REGION_CENTERS
+
+# Без ограничения частоты на стороне клиента: замеряется обработка запросов, а не ожидание лимита
+UNLIMITED_PER_MINUTE = 1e9
+WORKERS = 8
+# Доля точек, до которых заглушка не строит маршрут (ошибка 2010 → отрицательный кэш)
+UNROUTABLE_SHARE = 0.02
+
+_shift = itertools.count(1)
+
+
+def _supplier_rows(rows):
+    suppliers = make_suppliers(rows, invalid_share=0, swapped_share=0)
+    return [{
+        "line": line, "name": row[0], "address": row[2], "coords": tuple(map(float, row[3].split(", "))),
+        "full_addr": row[2], "material": "Песок", "work_type": "Устройство дорожной одежды", "color": "",
+    } for line, row in enumerate(suppliers.itertuples(index=False), 2)]
+
+
+def _object_coords():
+    """Новые координаты объекта - маршрутов до него в кэше ещё нет"""
+    lat, lon = REGION_CENTERS[0]
+    return lat - next(_shift) * 1e-4, lon
+
+
+def _remote_client(session_state):
+    session_state.ors_api_key = "bench"
+    return openrouteservice.Client(key="bench", base_url=ORS_BASE_URL, retry_over_query_limit=False)
+
+
+def bench_route_rows_remote_cold(benchmark, stub_server, session_state, service_rows):
+    """Маршруты пакета до нового объекта через асинхронный пул; часть пар - в отрицательный кэш"""
+    stub_server.config.unroutable_share = UNROUTABLE_SHARE
+    ors_client = _remote_client(session_state)
+    result = benchmark.pedantic(
+        route_rows,
+        setup=lambda: ((session_state, ors_client, _supplier_rows(service_rows), _object_coords()),
+                       {"rate_per_minute": UNLIMITED_PER_MINUTE, "workers": WORKERS}),
+        rounds=3
+    )
+    assert all(row["distance"] is not None for row in result)
+    assert stub_server.stats()["ors_directions"]["max_active"] > 1
+
+
+def bench_route_rows_remote_cached(benchmark, stub_server, session_state, service_rows):
+    """Повторный расчёт: маршруты из кэша, невозможные пары - из отрицательного кэша, без запросов"""
+    stub_server.config.unroutable_share = UNROUTABLE_SHARE
+    ors_client = _remote_client(session_state)
+    object_coords = _object_coords()
+    kwargs = {"rate_per_minute": UNLIMITED_PER_MINUTE, "workers": WORKERS}
+    route_rows(session_state, ors_client, _supplier_rows(service_rows), object_coords, **kwargs)
+    requests_before = stub_server.stats()["ors_directions"]["requests"]
+
+    result = benchmark.pedantic(
+        route_rows, setup=lambda: ((session_state, ors_client, _supplier_rows(service_rows), object_coords), kwargs),
+        rounds=3
+    )
+    assert all(row["distance"] is not None for row in result)
+    assert stub_server.stats()["ors_directions"]["requests"] == requests_before
+
+
+def bench_distance_matrix_remote(benchmark, stub_server, session_state, service_rows):
+    """Matrix API через openrouteservice.Client под защитой квоты и предохранителя"""
+    ors_client = _remote_client(session_state)
+    origins = [row["coords"] for row in _supplier_rows(service_rows)]
+    distances = benchmark.pedantic(
+        get_distances_to_object_ors,
+        setup=lambda: ((session_state, ors_client, origins, _object_coords()), {}),
+        rounds=3
+    )
+    assert all(distance is not None for distance in distances)
@@ -0,0 +1,108 @@
+"""
+Геокодирование и маршруты пакетной загрузки с фиктивными Nominatim и ORS.
+FakeORSClient не является openrouteservice.Client - маршруты идут последовательной веткой
+локального графа; удалённый путь ORS замеряется в bench_remote.
+"""
+import itertools
+import geocode_utils
+from api_limits import ApiGuard
+from cache_utils import GeocodeCache
+from geocode_utils import GeocodingEngine
+from import_utils import geocode_rows, route_rows
+from utils import get_distances_to_object_ors
+from fakes import FakeGeolocator, FakeORSClient
+from synthetic import make_suppliers, REGION_CENTERS
+
+# Без ограничения частоты: замеряется собственная работа приложения, а не ожидание лимита
+UNLIMITED_RATE = 1e9
+
+_shift = itertools.count(1)
+
+
+def _supplier_rows(rows, with_coords):
+    """Строки пакетной загрузки (как после validate_rows); адреса повторяются, как в реальных файлах"""
+    suppliers = make_suppliers(rows, invalid_share=0, swapped_share=0)
+    result = []
+    for line, row in enumerate(suppliers.itertuples(index=False), 2):
+        coords = tuple(map(float, row[3].split(", "))) if with_coords else None
+        result.append({
+            "line": line, "name": row[0], "address": row[2], "coords": coords, "full_addr": row[2],
+            "material": "Песок", "work_type": "Устройство дорожной одежды", "color": "",
+        })
+    return result
+
+
+def _object_coords():
+    """Новые координаты объекта - маршрутов до него в кэше ещё нет"""
+    lat, lon = REGION_CENTERS[0]
+    return lat + next(_shift) * 1e-4, lon
+
+
+def bench_geocode_rows_cold(benchmark, monkeypatch, tmp_path, session_state, service_rows):
+    """Геокодирование пакета с пустым кэшем: пул потоков, запись в кэш, журнал событий"""
+    rounds = itertools.count()
+
+    def setup():
+        engine = GeocodingEngine(geolocator=FakeGeolocator(), rate=UNLIMITED_RATE,
+                                 cache=GeocodeCache(str(tmp_path / f"geocode-{next(rounds)}.db")),
+                                 guard=ApiGuard("nominatim-bench"))
+        monkeypatch.setattr(geocode_utils, "_engine", engine)
+        return (session_state, _supplier_rows(service_rows, with_coords=False)), {}
+
+    result = benchmark.pedantic(geocode_rows, setup=setup, rounds=3)
+    assert all(row["coords"] is not None for row in result)
+
+
+def bench_geocode_rows_cached(benchmark, monkeypatch, tmp_path, session_state, service_rows):
+    """Повторное геокодирование того же пакета: все адреса из кэша"""
+    engine = GeocodingEngine(geolocator=FakeGeolocator(), rate=UNLIMITED_RATE,
+                             cache=GeocodeCache(str(tmp_path / "geocode.db")), guard=ApiGuard("nominatim-bench"))
+    monkeypatch.setattr(geocode_utils, "_engine", engine)
+    geocode_rows(session_state, _supplier_rows(service_rows, with_coords=False))
+    requests_before = engine.geolocator.requests
+
+    result = benchmark.pedantic(
+        geocode_rows, setup=lambda: ((session_state, _supplier_rows(service_rows, with_coords=False)), {}), rounds=3
+    )
+    assert all(row["coords"] is not None for row in result)
+    assert engine.geolocator.requests == requests_before
+
+
+def bench_route_rows_cold(benchmark, session_state, service_rows):
+    """Маршруты пакета до нового объекта: запрос, разбор GeoJSON, запись в кэш маршрутов"""
+    ors_client = FakeORSClient()
+    result = benchmark.pedantic(
+        route_rows,
+        setup=lambda: ((session_state, ors_client, _supplier_rows(service_rows, with_coords=True),
+                        _object_coords()), {}),
+        rounds=3
+    )
+    assert all(row["distance"] is not None for row in result)
+
+
+def bench_route_rows_cached(benchmark, session_state, service_rows):
+    """Повторный расчёт маршрутов пакета: все маршруты из кэша"""
+    ors_client = FakeORSClient()
+    object_coords = _object_coords()
+    route_rows(session_state, ors_client, _supplier_rows(service_rows, with_coords=True), object_coords)
+    requests_before = ors_client.requests
+
+    result = benchmark.pedantic(
+        route_rows,
+        setup=lambda: ((session_state, ors_client, _supplier_rows(service_rows, with_coords=True),
+                        object_coords), {}),
+        rounds=3
+    )
+    assert all(row["distance"] is not None for row in result)
+    assert ors_client.requests == requests_before
+
+
+def bench_distance_matrix(benchmark, session_state, service_rows):
+    """Расстояния по дорогам до всех поставщиков пакета через Matrix API (порции по лимиту ORS)"""
+    origins = [row["coords"] for row in _supplier_rows(service_rows, with_coords=True)]
+    distances = benchmark.pedantic(
+        get_distances_to_object_ors,
+        setup=lambda: ((session_state, FakeORSClient(), origins, _object_coords()), {}),
+        rounds=3
+    )
+    assert all(distance is not None for distance in distances)
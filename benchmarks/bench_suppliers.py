@@ -0,0 +1,90 @@
+"""Загрузка базы поставщиков, фильтр по ОКВЭД и поиск поставщика по клику на карте"""
+import itertools
+import numpy as np
+import supplier_data
+from supplier_data import load_suppliers_snapshot, get_okved_list, category_distance_table
+from spatial_utils import SpatialIndex
+from detour_utils import DetourModel
+from fakes import FakeDrive
+from synthetic import REGION_CENTERS, make_suppliers_csv
+
+# Кликов по карте за один замер поиска
+CLICKS = 200
+
+_urls = itertools.count()
+
+
+def _fresh_url():
+    """Новый адрес источника - снимка для него ещё нет"""
+    return f"https://drive.example/suppliers-{next(_urls)}.csv"
+
+
+def bench_load_suppliers_remote(benchmark, monkeypatch, rows):
+    """Первая загрузка: скачивание, разбор CSV и координат, запись снимка Parquet"""
+    monkeypatch.setattr(supplier_data.requests, "get", FakeDrive(make_suppliers_csv(rows)))
+    df, source = benchmark.pedantic(
+        load_suppliers_snapshot, setup=lambda: ((_fresh_url(),), {}), rounds=5
+    )
+    assert source == "remote" and len(df) == rows
+
+
+def bench_load_suppliers_unchanged(benchmark, monkeypatch, rows):
+    """Повторная загрузка без ETag: содержимое совпало по хэшу, читается снимок"""
+    monkeypatch.setattr(supplier_data.requests, "get", FakeDrive(make_suppliers_csv(rows)))
+    url = _fresh_url()
+    load_suppliers_snapshot(url)
+    df, source = benchmark(load_suppliers_snapshot, url)
+    assert source == "unchanged" and len(df) == rows
+
+
+def bench_load_suppliers_not_modified(benchmark, monkeypatch, rows):
+    """Повторная загрузка с ETag: сервер отвечает 304 без тела"""
+    monkeypatch.setattr(supplier_data.requests, "get", FakeDrive(make_suppliers_csv(rows), etag=True))
+    url = _fresh_url()
+    load_suppliers_snapshot(url)
+    df, source = benchmark(load_suppliers_snapshot, url)
+    assert source == "unchanged" and len(df) == rows
+
+
+def bench_okved_list(benchmark, suppliers_df):
+    okved_list = benchmark(get_okved_list, suppliers_df)
+    assert okved_list
+
+
+def bench_okved_filter(benchmark, suppliers_df):
+    """Выбор категории в списке ОКВЭД: отбор строк, как в модуле поставщиков"""
+    okved = get_okved_list(suppliers_df)[0]
+    filtered = benchmark(lambda: suppliers_df[suppliers_df['Главный ОКВЭД (название)'] == okved])
+    assert len(filtered)
+
+
+def _build_index(suppliers):
+    valid = suppliers['coords_valid'].to_numpy()
+    return SpatialIndex(suppliers['lat'].to_numpy()[valid], suppliers['lon'].to_numpy()[valid],
+                        np.flatnonzero(valid))
+
+
+def bench_click_index(benchmark, suppliers_df):
+    """Построение пространственного индекса (один раз на набор данных и ОКВЭД)"""
+    index = benchmark(_build_index, suppliers_df)
+    assert len(index) == int(suppliers_df['coords_valid'].sum())
+
+
+def bench_click_lookup(benchmark, suppliers_df):
+    """Поиск ближайшего поставщика в радиусе 10 км для CLICKS кликов"""
+    index = _build_index(suppliers_df)
+    rng = np.random.default_rng(1)
+    centers = np.array(REGION_CENTERS)[rng.integers(0, len(REGION_CENTERS), CLICKS)]
+    clicks = centers + rng.uniform(-1, 1, centers.shape)
+
+    def lookup():
+        return [index.nearest(lat, lon, max_km=10) for lat, lon in clicks]
+
+    found = benchmark(lookup)
+    assert any(position is not None for position, _ in found)
+
+
+def bench_category_distances(benchmark, suppliers_df):
+    """Таблица расстояний категории по модели извилистости (без запросов к API)"""
+    table = benchmark(category_distance_table, suppliers_df, REGION_CENTERS[0], DetourModel())
+    assert len(table) == int(suppliers_df['coords_valid'].sum())
@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+# Кэши, снимки и журналы бенчмарков - во временном каталоге, до импорта модулей приложения
+os.environ.setdefault("TRANSPORT_CACHE_DIR", tempfile.mkdtemp(prefix="transport_bench_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo_stub_server import start_stub_server
+
+# Удалённые ORS и Nominatim - локальная заглушка в этом же процессе: без сети и без расхода квоты.
+# Адреса задаются до импорта клиентов (ors_async, geocode_utils читают их при импорте)
+STUB_SERVER = start_stub_server()
+os.environ["ORS_BASE_URL"] = STUB_SERVER.url
+os.environ["NOMINATIM_URL"] = STUB_SERVER.url
+os.environ["ORS_DAILY_LIMIT"] = str(10 ** 9)
+
+import pytest
+import pandas as pd
+from event_log import EventLog
+from timing_utils import StageTimings
+from supplier_data import prepare_suppliers
+from synthetic import make_suppliers_csv
+
+# Размеры синтетической базы; BENCH_SIZES=1000,10000 - быстрый прогон
+SIZES = [int(size) for size in os.environ.get("BENCH_SIZES", "1000,10000,100000").split(",")]
+# Геокодирование и маршруты идут по одному адресу за запрос - для них базы крупнее 10k не берём
+SERVICE_SIZES = [size for size in SIZES if size <= 10000] or SIZES[:1]
+
+_df_cache = {}
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: f"{size}")
+def rows(request):
+    return request.param
+
+
+@pytest.fixture(params=SERVICE_SIZES, ids=lambda size: f"{size}")
+def service_rows(request):
+    return request.param
+
+
+@pytest.fixture
+def suppliers_df(rows):
+    """Подготовленная база (как после load_suppliers); не изменять в бенчмарках"""
+    if rows not in _df_cache:
+        _df_cache[rows] = prepare_suppliers(pd.read_csv(io.BytesIO(make_suppliers_csv(rows))))
+    return _df_cache[rows]
+
+
+@pytest.fixture
+def stub_server():
+    """Заглушка ORS/Nominatim без задержек и отказов; статистика обнуляется для каждого замера"""
+    STUB_SERVER.config.unroutable_share = 0.0
+    STUB_SERVER.reset_stats()
+    return STUB_SERVER
+
+
+@pytest.fixture
+def session_state():
+    """Минимальное состояние сессии для функций utils: журнал событий и длительности этапов"""
+    return SimpleNamespace(error_log=EventLog(), timings=StageTimings(), ors_api_key=None)
@@ -0,0 +1,109 @@
+import time
+import zlib
+from collections import namedtuple
+import numpy as np
+from spatial_utils import haversine_km
+
+# Коэффициент, на который «дорога» фиктивного ORS длиннее прямой
+FAKE_DETOUR_FACTOR = 1.3
+# Точек в геометрии фиктивного маршрута
+FAKE_ROUTE_POINTS = 50
+# Средняя скорость для длительности маршрута, км/ч
+FAKE_SPEED_KMH = 60
+
+FakeLocation = namedtuple("FakeLocation", "latitude longitude address")
+
+
+class FakeResponse:
+    """Ответ requests.get: статус, содержимое и заголовки"""
+
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"HTTP {self.status_code}")
+
+
+class FakeDrive:
+    """
+    Замена requests.get для Google Drive: отдаёт один и тот же CSV.
+    С etag=True поддерживает условные запросы (304), иначе - только полное тело.
+    """
+
+    def __init__(self, content, etag=False):
+        self.content = content
+        self.etag = f'"{zlib.crc32(content):08x}"' if etag else None
+        self.requests = 0
+
+    def __call__(self, url, headers=None, timeout=None):
+        self.requests += 1
+        if self.etag and (headers or {}).get("If-None-Match") == self.etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.content, {"ETag": self.etag} if self.etag else {})
+
+
+class FakeGeolocator:
+    """
+    Замена geopy Nominatim: координаты детерминированно выводятся из текста адреса.
+    latency - задержка ответа в секундах (имитация сети).
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def geocode(self, address):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        h = zlib.crc32(address.encode("utf-8"))
+        lat = 50 + (h % 10000) / 1000
+        lon = 30 + (h // 10000 % 30000) / 1000
+        return FakeLocation(lat, lon, f"{address}, Россия")
+
+
+class FakeORSClient:
+    """
+    Замена клиента openrouteservice: маршрут - отрезок из FAKE_ROUTE_POINTS точек,
+    расстояние - прямая × FAKE_DETOUR_FACTOR. latency - задержка каждого запроса в секундах.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def _wait(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def directions(self, coordinates, profile="driving-car", format="geojson", **kwargs):
+        self._wait()
+        (lon1, lat1), (lon2, lat2) = coordinates
+        distance_m = float(haversine_km(lat1, lon1, lat2, lon2)) * FAKE_DETOUR_FACTOR * 1000
+        t = np.linspace(0, 1, FAKE_ROUTE_POINTS)
+        line = np.column_stack([lon1 + (lon2 - lon1) * t, lat1 + (lat2 - lat1) * t]).tolist()
+        return {"features": [{
+            "geometry": {"type": "LineString", "coordinates": line},
+            "properties": {"segments": [{
+                "distance": distance_m, "duration": distance_m / 1000 / FAKE_SPEED_KMH * 3600
+            }]}
+        }]}
+
+    def distance_matrix(self, locations, profile="driving-car", sources=None, destinations=None,
+                        metrics=("distance",), **kwargs):
+        self._wait()
+        points = np.array(locations, dtype=np.float64)
+        sources = list(range(len(points))) if sources is None else sources
+        destinations = list(range(len(points))) if destinations is None else destinations
+        distances = [
+            (haversine_km(points[s, 1], points[s, 0], points[destinations, 1], points[destinations, 0])
+             * FAKE_DETOUR_FACTOR * 1000).tolist()
+            for s in sources
+        ]
+        durations = [[d / 1000 / FAKE_SPEED_KMH * 3600 for d in row] for row in distances]
+        return {"distances": distances, "durations": durations}
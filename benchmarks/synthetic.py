@@ -0,0 +1,84 @@
+import functools
+import numpy as np
+import pandas as pd
+from utils import make_delivery_record
+
+# Центры регионов, вокруг которых разбросаны синтетические поставщики (lat, lon)
+REGION_CENTERS = [
+    (55.75, 37.62), (59.94, 30.31), (56.84, 60.61), (55.03, 82.92), (56.33, 44.00),
+    (55.79, 49.12), (53.20, 50.15), (54.99, 73.37), (47.23, 39.72), (51.66, 39.20),
+]
+# Разброс координат вокруг центра региона (градусы)
+REGION_SPREAD_DEG = 1.5
+
+OKVED_NAMES = [
+    "Производство бетона и изделий из бетона",
+    "Производство товарного бетона",
+    "Добыча гравия, песка и глины",
+    "Производство цемента",
+    "Производство кирпича, черепицы и прочих строительных изделий из обожженной глины",
+    "Производство строительных металлических конструкций",
+    "Торговля оптовая лесоматериалами, строительными материалами",
+    "Производство асфальта",
+    "Производство изделий из бетона для использования в строительстве",
+    "Разработка гравийных и песчаных карьеров",
+    "Производство листового стекла",
+    "Производство сборных деревянных строений",
+]
+
+STREETS = ["Промышленная", "Заводская", "Складская", "Строителей", "Индустриальная", "Лесная", "Речная"]
+CITIES = ["Москва", "Санкт-Петербург", "Екатеринбург", "Новосибирск", "Нижний Новгород",
+          "Казань", "Самара", "Омск", "Ростов-на-Дону", "Воронеж"]
+
+
+def make_suppliers(rows, seed=0, invalid_share=0.02, swapped_share=0.01):
+    """
+    Синтетическая база поставщиков со столбцами реального CSV.
+    Доля invalid_share строк - без координат или с мусором, swapped_share - с перепутанными lat/lon.
+    """
+    rng = np.random.default_rng(seed)
+    region = rng.integers(0, len(REGION_CENTERS), rows)
+    centers = np.array(REGION_CENTERS)[region]
+    lats = centers[:, 0] + rng.uniform(-REGION_SPREAD_DEG, REGION_SPREAD_DEG, rows)
+    lons = centers[:, 1] + rng.uniform(-REGION_SPREAD_DEG, REGION_SPREAD_DEG, rows)
+
+    coords = np.char.add(np.char.add(np.round(lats, 6).astype(str), ", "), np.round(lons, 6).astype(str))
+    swapped = rng.random(rows) < swapped_share
+    coords[swapped] = np.char.add(np.char.add(np.round(lons[swapped], 6).astype(str), ", "),
+                                  np.round(lats[swapped], 6).astype(str))
+    invalid = rng.random(rows) < invalid_share
+    coords[invalid] = rng.choice(["", "нет данных", "0, 0"], invalid.sum())
+
+    numbers = np.arange(1, rows + 1)
+    streets = np.array(STREETS)[rng.integers(0, len(STREETS), rows)]
+    cities = np.array(CITIES)[region]
+    return pd.DataFrame({
+        "Название компании": [f"ООО \"Поставщик {n}\"" for n in numbers],
+        "ИНН": (7700000000 + numbers).astype(str),
+        "Адрес компании": [f"г. {city}, ул. {street}, д. {n % 200 + 1}"
+                           for city, street, n in zip(cities, streets, numbers)],
+        "Координаты": coords,
+        "Главный ОКВЭД (название)": np.array(OKVED_NAMES)[rng.integers(0, len(OKVED_NAMES), rows)],
+        "Телефон": [f"+7 (900) {n % 1000:03d}-{n % 100:02d}-{n % 97:02d}" for n in numbers],
+    })
+
+
+@functools.lru_cache(maxsize=None)
+def make_suppliers_csv(rows, seed=0):
+    """Содержимое CSV-файла базы поставщиков (bytes), как его отдаёт Google Drive; генерируется один раз"""
+    return make_suppliers(rows, seed).to_csv(index=False).encode("utf-8")
+
+
+def make_delivery_rows(rows, seed=0):
+    """Строки ведомости доставки: столбцы DELIVERY_COLUMNS с реалистичной длиной значений"""
+    suppliers = make_suppliers(rows, seed, invalid_share=0, swapped_share=0)
+    rng = np.random.default_rng(seed)
+    object_coords = REGION_CENTERS[0]
+    records = []
+    for i, row in enumerate(suppliers.itertuples(index=False), 1):
+        lat, lon = map(float, row[3].split(", "))
+        records.append(make_delivery_record(
+            i, row[4][:40], "Устройство фундамента", row[0], row[2], "г. Москва, ул. Строителей, д. 1",
+            round(float(rng.uniform(5, 400)), 2), "blue", (lat, lon), object_coords, None
+        ))
+    return pd.DataFrame(records)
@@ -0,0 +1,357 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+# --- Настройки постоянного кэша ---
+CACHE_DIR = os.environ.get(
+    "TRANSPORT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "transport_cache.sqlite3")
+
+GEOCODE_TTL = 90 * 24 * 3600           # Найденные адреса храним 90 дней
+GEOCODE_NEGATIVE_TTL = 24 * 3600       # "Адрес не найден" храним сутки
+GEOCODE_MAX_ENTRIES = 50000            # Предел записей, дальше вытесняем по LRU
+
+ROUTE_MAX_BYTES = 200 * 1024 * 1024    # Предел объёма геометрий маршрутов в кэше
+ROUTE_COORD_PRECISION = 5              # Округление координат ключа (~1e-5° ≈ 1 м)
+ROUTE_NEGATIVE_TTL = 7 * 24 * 3600     # "Маршрут невозможен" храним неделю
+
+# Как часто (в вставках) проверять размер кэша
+_EVICT_EVERY = 100
+
+
+def connect_cache_db(path=CACHE_DB_PATH):
+    """Открывает SQLite базу кэша в режиме WAL (общая для всех сессий)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def make_address_key(address):
+    """Ключ кэша: нормализованный адрес в нижнем регистре без лишних пробелов"""
+    key = re.sub(r"\s*,\s*", ", ", str(address).lower())
+    return " ".join(key.split()).strip(" ,")
+
+
+def encode_polyline(coords, precision=ROUTE_COORD_PRECISION):
+    """Кодирует список (lat, lon) в строку Google Encoded Polyline"""
+    factor = 10 ** precision
+    result = []
+    prev_lat = prev_lon = 0
+    for lat, lon in coords:
+        lat_i = int(round(lat * factor))
+        lon_i = int(round(lon * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else (delta << 1)
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(result)
+
+
+def decode_polyline(encoded, precision=ROUTE_COORD_PRECISION):
+    """Декодирует строку Encoded Polyline в список (lat, lon)"""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = value = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else (value >> 1))
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append((lat / factor, lon / factor))
+    return coords
+
+
+def make_route_key(origin_coords, destination_coords, profile):
+    """Ключ маршрута: профиль и координаты, округлённые до ~1e-5°"""
+    return (
+        f"{profile}:"
+        f"{origin_coords[0]:.{ROUTE_COORD_PRECISION}f},{origin_coords[1]:.{ROUTE_COORD_PRECISION}f}:"
+        f"{destination_coords[0]:.{ROUTE_COORD_PRECISION}f},{destination_coords[1]:.{ROUTE_COORD_PRECISION}f}"
+    )
+
+
+class GeocodeCache:
+    """Постоянный кэш геокодирования с TTL, LRU-вытеснением и счётчиками попаданий"""
+
+    def __init__(self, path=CACHE_DB_PATH, ttl=GEOCODE_TTL, negative_ttl=GEOCODE_NEGATIVE_TTL,
+                 max_entries=GEOCODE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = connect_cache_db(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode (
+                key TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                full_address TEXT,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode(last_used)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                name TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("INSERT OR IGNORE INTO cache_stats(name) VALUES ('geocode')")
+
+    def get(self, address):
+        """
+        Возвращает (найдено_в_кэше, coords, full_address).
+        Для отрицательного результата: (True, None, None).
+        """
+        key = make_address_key(address)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lon, full_address, expires_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[3] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                self._conn.execute("UPDATE cache_stats SET misses = misses + 1 WHERE name = 'geocode'")
+                return False, None, None
+
+            self._conn.execute("UPDATE geocode SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.execute("UPDATE cache_stats SET hits = hits + 1 WHERE name = 'geocode'")
+
+        lat, lon, full_address = row[0], row[1], row[2]
+        if lat is None or lon is None:
+            return True, None, None
+        return True, (lat, lon), full_address
+
+    def set(self, address, coords, full_address):
+        """Сохраняет результат геокодирования (coords=None - отрицательный результат)"""
+        key = make_address_key(address)
+        now = time.time()
+        if coords:
+            lat, lon = coords
+            expires_at = now + self.ttl
+        else:
+            lat = lon = full_address = None
+            expires_at = now + self.negative_ttl
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode(key, lat, lon, full_address, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, lat, lon, full_address, expires_at, now)
+            )
+            self._inserts += 1
+            if self._inserts % _EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        """Удаляет просроченные записи и самые давно использованные сверх лимита"""
+        self._conn.execute("DELETE FROM geocode WHERE expires_at < ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        if count > self.max_entries:
+            # Освобождаем 10% запаса, чтобы не вытеснять на каждой вставке
+            excess = count - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM geocode WHERE key IN "
+                "(SELECT key FROM geocode ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def stats(self):
+        """Счётчики попаданий/промахов и текущий размер кэша"""
+        with self._lock:
+            hits, misses = self._conn.execute(
+                "SELECT hits, misses FROM cache_stats WHERE name = 'geocode'"
+            ).fetchone()
+            size = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        return {"hits": hits, "misses": misses, "size": size}
+
+    def clear(self):
+        """Полностью очищает кэш геокодирования"""
+        with self._lock:
+            self._conn.execute("DELETE FROM geocode")
+            self._conn.execute("UPDATE cache_stats SET hits = 0, misses = 0 WHERE name = 'geocode'")
+
+
+class RouteCache:
+    """Постоянный кэш маршрутов ORS: геометрия (encoded polyline), расстояние и время в пути"""
+
+    def __init__(self, path=CACHE_DB_PATH, max_bytes=ROUTE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = connect_cache_db(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS routes (
+                key TEXT PRIMARY KEY,
+                geometry TEXT,
+                distance_km REAL NOT NULL,
+                duration_s REAL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS routes_last_used ON routes(last_used)")
+        # Пары, для которых ORS не может построить маршрут (точка далеко от дорог и т.п.)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS route_failures (
+                key TEXT PRIMARY KEY,
+                code INTEGER,
+                message TEXT,
+                expires REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                name TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("INSERT OR IGNORE INTO cache_stats(name) VALUES ('routes')")
+
+    def get(self, origin_coords, destination_coords, profile="driving-car"):
+        """Возвращает (route_coords, distance_km, duration_s) или None, если маршрута нет в кэше"""
+        key = make_route_key(origin_coords, destination_coords, profile)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT geometry, distance_km, duration_s FROM routes WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._conn.execute("UPDATE cache_stats SET misses = misses + 1 WHERE name = 'routes'")
+                return None
+            self._conn.execute("UPDATE routes SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.execute("UPDATE cache_stats SET hits = hits + 1 WHERE name = 'routes'")
+
+        geometry, distance_km, duration_s = row
+        route_coords = decode_polyline(geometry) if geometry else None
+        return route_coords, distance_km, duration_s
+
+    def set(self, origin_coords, destination_coords, route_coords, distance_km, duration_s=None,
+            profile="driving-car"):
+        """Сохраняет маршрут в кэш"""
+        key = make_route_key(origin_coords, destination_coords, profile)
+        geometry = encode_polyline(route_coords) if route_coords else None
+        size = len(geometry) if geometry else 0
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO routes(key, geometry, distance_km, duration_s, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, geometry, distance_km, duration_s, size, time.time())
+            )
+            self._inserts += 1
+            if self._inserts % _EVICT_EVERY == 0:
+                self._evict()
+
+    def distances(self, profile="driving-car"):
+        """Все известные расстояния по дорогам: [(lat откуда, lon откуда, lat куда, lon куда, км)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, distance_km FROM routes WHERE key LIKE ?", (f"{profile}:%",)
+            ).fetchall()
+        result = []
+        for key, distance_km in rows:
+            origin, destination = key[len(profile) + 1:].split(":")
+            result.append((*map(float, origin.split(",")), *map(float, destination.split(",")), distance_km))
+        return result
+
+    def get_failure(self, origin_coords, destination_coords, profile="driving-car"):
+        """Возвращает (код ошибки ORS, сообщение), если маршрут между точками невозможен, иначе None"""
+        key = make_route_key(origin_coords, destination_coords, profile)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT code, message, expires FROM route_failures WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return row[0], row[1]
+
+    def set_failure(self, origin_coords, destination_coords, code, message, profile="driving-car",
+                    ttl=ROUTE_NEGATIVE_TTL):
+        """Запоминает, что маршрут между точками невозможен (отрицательный кэш с TTL)"""
+        key = make_route_key(origin_coords, destination_coords, profile)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO route_failures(key, code, message, expires) VALUES (?, ?, ?, ?)",
+                (key, code, message, time.time() + ttl)
+            )
+            self._conn.execute("DELETE FROM route_failures WHERE expires < ?", (time.time(),))
+
+    def _evict(self):
+        """Вытесняет давно использованные маршруты, пока объём геометрий больше лимита"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM routes").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM routes ORDER BY last_used ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM routes WHERE key = ?", victims)
+
+    def stats(self):
+        """Счётчики попаданий/промахов, число маршрутов и объём геометрий"""
+        with self._lock:
+            hits, misses = self._conn.execute(
+                "SELECT hits, misses FROM cache_stats WHERE name = 'routes'"
+            ).fetchone()
+            size, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM routes"
+            ).fetchone()
+            failures = self._conn.execute(
+                "SELECT COUNT(*) FROM route_failures WHERE expires >= ?", (time.time(),)
+            ).fetchone()[0]
+        return {"hits": hits, "misses": misses, "size": size, "bytes": total, "failures": failures}
+
+
+_geocode_cache = None
+_geocode_cache_lock = threading.Lock()
+_route_cache = None
+_route_cache_lock = threading.Lock()
+
+
+def get_geocode_cache():
+    """Общий для всех сессий экземпляр кэша геокодирования"""
+    global _geocode_cache
+    if _geocode_cache is None:
+        with _geocode_cache_lock:
+            if _geocode_cache is None:
+                _geocode_cache = GeocodeCache()
+    return _geocode_cache
+
+
+def get_route_cache():
+    """Общий для всех сессий экземпляр кэша маршрутов"""
+    global _route_cache
+    if _route_cache is None:
+        with _route_cache_lock:
+            if _route_cache is None:
+                _route_cache = RouteCache()
+    return _route_cache
@@ -1,5 +1,13 @@
 import streamlit as st
+import pandas as pd
 from utils import log_info
+from cache_utils import get_geocode_cache, get_route_cache
+from api_limits import get_api_guard
+from event_log import event_details, describe_fields, LOG_FILE_PATH
+from timing_utils import get_api_timings
+
+# Событий журнала на странице панели отладки
+LOG_PAGE_SIZE = 20
 
 def display_debug_button():
     """Отображает кнопку для вызова панели отладки"""
@@ -24,7 +32,7 @@ def display_debug_sidebar(session_state):
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🗑️ Очистить лог"):
-                session_state.error_log = []
+                session_state.error_log.clear()
                 st.rerun()
 
         with col2:
@@ -32,11 +40,33 @@ def display_debug_sidebar(session_state):
                 if session_state.error_log:
                     log_text = "\n".join([
                         f"[{entry['time']}] {entry['type']}: {entry['message']}"
-                        + (f"\n{entry['details']}" if entry['details'] else "")
+                        + (f"\n{event_details(entry)}" if event_details(entry) else "")
                         for entry in session_state.error_log
                     ])
                     st.text_area("Экспорт лога ошибок", log_text, height=200)
 
+        # Статистика постоянного кэша геокодирования
+        geocode_stats = get_geocode_cache().stats()
+        st.caption(
+            f"Кэш геокодирования: {geocode_stats['size']} адресов, "
+            f"попаданий {geocode_stats['hits']}, промахов {geocode_stats['misses']}"
+        )
+        route_stats = get_route_cache().stats()
+        st.caption(
+            f"Кэш маршрутов: {route_stats['size']} маршрутов ({route_stats['bytes'] / 1024:.0f} КБ), "
+            f"попаданий {route_stats['hits']}, промахов {route_stats['misses']}, "
+            f"невозможных маршрутов {route_stats['failures']}"
+        )
+
+        # Суточная квота и состояние предохранителей внешних API
+        for name in ("ors", "nominatim"):
+            api_status = get_api_guard(name).status()
+            if "limit" in api_status:
+                st.caption(f"{api_status['name']}: запросов за сутки {api_status['used']} из {api_status['limit']}")
+            if api_status["retry_in"] > 0:
+                st.warning(f"{api_status['name']} недоступен (предохранитель), "
+                           f"повтор через {api_status['retry_in']:.0f} с")
+
         # Отображение лога ошибок
         st.subheader("📋 Лог событий")
 
@@ -48,30 +78,65 @@ def display_debug_sidebar(session_state):
                 default=["ERROR", "API_ERROR", "WARNING"] if not debug_mode else ["ERROR", "API_ERROR", "WARNING", "INFO"]
             )
 
-            filtered_log = [entry for entry in session_state.error_log if entry['type'] in filter_types]
+            # Страницы журнала: новые события первыми, без копирования всего буфера
+            total = session_state.error_log.count(*filter_types)
+            pages = max((total + LOG_PAGE_SIZE - 1) // LOG_PAGE_SIZE, 1)
+            page = st.number_input(f"Страница (из {pages})", min_value=1, max_value=pages, value=1) if pages > 1 else 1
 
-            # Показываем последние записи в обратном порядке
-            for entry in reversed(filtered_log[-20:]):  # Последние 20 записей
+            for entry in session_state.error_log.page(filter_types, page - 1, LOG_PAGE_SIZE):
                 if entry['type'] == 'ERROR' or entry['type'] == 'API_ERROR':
                     st.error(f"**[{entry['time']}]** {entry['message']}")
                 elif entry['type'] == 'WARNING':
                     st.warning(f"**[{entry['time']}]** {entry['message']}")
-                elif entry['type'] == 'INFO' and debug_mode:
+                elif debug_mode:
                     st.info(f"**[{entry['time']}]** {entry['message']}")
+                else:
+                    continue
 
-                # Показываем детали если они есть и включен режим отладки
-                if entry['details'] and debug_mode:
+                if entry['fields']:
+                    st.caption(describe_fields(entry['fields']))
+
+                # Показываем детали если они есть и включен режим отладки (трассировка форматируется здесь)
+                if debug_mode and event_details(entry):
                     with st.expander("Подробности"):
                         st.code(entry['details'], language="text")
+
+            st.caption(f"Полный журнал всех сессий: {LOG_FILE_PATH}")
         else:
             st.info("Лог пуст")
 
+def display_timings(session_state):
+    """Перцентили длительности этапов сессии, запросов к внешним API и число вызовов API"""
+    stage_rows = session_state.timings.summary() if 'timings' in session_state else []
+    api_timings = get_api_timings()
+    api_rows = api_timings.summary()
+    if not stage_rows and not api_rows:
+        st.caption("Замеров длительности пока нет")
+        return
+
+    if stage_rows:
+        st.markdown("**Этапы (текущая сессия)**")
+        st.dataframe(pd.DataFrame(stage_rows), use_container_width=True, hide_index=True)
+    if api_rows:
+        st.markdown("**Внешние API (все сессии)**")
+        st.dataframe(pd.DataFrame(api_rows), use_container_width=True, hide_index=True)
+
+    calls = api_timings.calls()
+    if calls:
+        columns = st.columns(len(calls))
+        for column, (api, count) in zip(columns, sorted(calls.items())):
+            with column:
+                st.metric(f"Вызовов: {api}", count)
+
 def display_error_stats(session_state):
-    """Отображает статистику ошибок в нижней части страницы"""
+    """Отображает статистику ошибок и длительности этапов в нижней части страницы"""
     # Показываем статистику только если включена панель отладки
-    if session_state.show_debug and session_state.error_log:
-        error_count = len([e for e in session_state.error_log if e['type'] in ['ERROR', 'API_ERROR']])
-        warning_count = len([e for e in session_state.error_log if e['type'] == 'WARNING'])
+    if not session_state.show_debug:
+        return
+
+    if session_state.error_log:
+        error_count = session_state.error_log.count('ERROR', 'API_ERROR')
+        warning_count = session_state.error_log.count('WARNING')
 
         if error_count > 0 or warning_count > 0:
             st.markdown("---")
@@ -82,3 +147,7 @@ def display_error_stats(session_state):
                 st.metric("Предупреждения", warning_count)
             with col3:
                 st.metric("Всего событий", len(session_state.error_log))
+
+    # Где тратится время перезапуска: геокодирование, маршруты, карта, экспорт
+    with st.expander("⏱️ Длительность этапов (p50 / p95 / p99)"):
+        display_timings(session_state)
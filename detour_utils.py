@@ -0,0 +1,124 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+from cache_utils import get_route_cache
+from spatial_utils import haversine_km
+
+# Коэффициент извилистости дорог (дорога / прямая), если кэш маршрутов ещё мал
+DEFAULT_DETOUR_FACTOR = 1.3
+# Полосы расстояний по прямой (км): на коротких плечах дороги извилистее
+DISTANCE_BANDS_KM = (5, 15, 40, 100, 250)
+# Регион - ячейка сетки по середине отрезка (~110 × 60 км)
+REGION_CELL_DEG = 1.0
+# Меньше стольких маршрутов в группе - коэффициент берётся по полосе расстояний или по умолчанию
+MIN_SAMPLES = 5
+# Пары ближе этого расстояния по прямой для оценки коэффициента не используются (шум геокодирования)
+MIN_STRAIGHT_KM = 0.5
+# Допустимые коэффициенты: выбросы (паромы, объезды водоёмов) обрезаются
+MIN_FACTOR, MAX_FACTOR = 1.0, 3.0
+# Как часто модель переобучается по кэшу маршрутов (секунды)
+REFIT_SECONDS = 600
+
+# Код группы: регион * _BAND_BASE + номер полосы
+_BAND_BASE = 16
+
+
+def _group_codes(lat, lon, lats, lons, straight_km):
+    """Коды групп (регион × полоса расстояний) для отрезков от (lat, lon) до массивов точек"""
+    mid_lat = (np.asarray(lats, dtype=np.float64) + lat) / 2
+    mid_lon = (np.asarray(lons, dtype=np.float64) + lon) / 2
+    rows = np.floor((mid_lat + 90) / REGION_CELL_DEG).astype(np.int64)
+    cols = np.floor((mid_lon + 180) / REGION_CELL_DEG).astype(np.int64)
+    bands = np.searchsorted(DISTANCE_BANDS_KM, straight_km, side="right")
+    return (rows * int(360 / REGION_CELL_DEG + 1) + cols) * _BAND_BASE + bands
+
+
+class DetourModel:
+    """
+    Оценка расстояния по дорогам без запроса к API: расстояние по прямой (haversine)
+    умноженное на коэффициент извилистости. Коэффициенты - медианы отношения
+    «дорога / прямая» по известным маршрутам в группах регион × полоса расстояний.
+    """
+
+    def __init__(self, group_factors=None, band_factors=None, samples=0):
+        self.group_factors = group_factors or {}
+        self.band_factors = band_factors or {}
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, origin_lats, origin_lons, destination_lats, destination_lons, road_km):
+        """Обучение по массивам известных маршрутов (координаты концов и длина по дорогам)"""
+        origin_lats = np.asarray(origin_lats, dtype=np.float64)
+        origin_lons = np.asarray(origin_lons, dtype=np.float64)
+        destination_lats = np.asarray(destination_lats, dtype=np.float64)
+        destination_lons = np.asarray(destination_lons, dtype=np.float64)
+        road_km = np.asarray(road_km, dtype=np.float64)
+
+        # Поэлементный haversine: точка «откуда» своя для каждого маршрута
+        straight = haversine_km(origin_lats, origin_lons, destination_lats, destination_lons)
+        usable = (straight >= MIN_STRAIGHT_KM) & np.isfinite(road_km)
+        if not usable.any():
+            return cls()
+        straight = straight[usable]
+        ratios = np.clip(road_km[usable] / straight, MIN_FACTOR, MAX_FACTOR)
+        codes = _group_codes(origin_lats[usable], origin_lons[usable],
+                             destination_lats[usable], destination_lons[usable], straight)
+
+        frame = pd.DataFrame({"code": codes, "band": codes % _BAND_BASE, "ratio": ratios})
+        groups = frame.groupby("code")["ratio"].agg(["median", "size"])
+        groups = groups[groups["size"] >= MIN_SAMPLES]
+        bands = frame.groupby("band")["ratio"].agg(["median", "size"])
+        bands = bands[bands["size"] >= MIN_SAMPLES]
+        return cls(
+            dict(zip(groups.index.tolist(), groups["median"].tolist())),
+            dict(zip(bands.index.tolist(), bands["median"].tolist())),
+            int(usable.sum())
+        )
+
+    @classmethod
+    def from_route_cache(cls, cache=None, profile="driving-car"):
+        """Обучение по всем расстояниям из постоянного кэша маршрутов (ORS и Matrix API)"""
+        cache = cache if cache is not None else get_route_cache()
+        rows = cache.distances(profile)
+        if not rows:
+            return cls()
+        origin_lats, origin_lons, destination_lats, destination_lons, road_km = np.array(rows, dtype=np.float64).T
+        return cls.fit(origin_lats, origin_lons, destination_lats, destination_lons, road_km)
+
+    def factors(self, lat, lon, lats, lons, straight_km):
+        """Коэффициенты извилистости для отрезков от (lat, lon) до массивов точек"""
+        straight_km = np.asarray(straight_km, dtype=np.float64)
+        if not self.group_factors and not self.band_factors:
+            return np.full(straight_km.shape, DEFAULT_DETOUR_FACTOR)
+        codes = _group_codes(lat, lon, lats, lons, straight_km)
+        # Групп обычно немного: подбираем коэффициент для каждой уникальной, затем раскладываем
+        unique, inverse = np.unique(codes, return_inverse=True)
+        values = np.array([
+            self.group_factors.get(code, self.band_factors.get(code % _BAND_BASE, DEFAULT_DETOUR_FACTOR))
+            for code in unique.tolist()
+        ])
+        return values[inverse].reshape(straight_km.shape)
+
+    def estimate_km(self, lat, lon, lats, lons):
+        """
+        Расстояния от точки (lat, lon) до массивов точек одной векторной операцией.
+        Возвращает (по прямой, оценка по дорогам) - массивы в км.
+        """
+        straight = haversine_km(lat, lon, lats, lons)
+        return straight, straight * self.factors(lat, lon, lats, lons, straight)
+
+
+_model = None
+_model_fitted = 0.0
+_model_lock = threading.Lock()
+
+
+def get_detour_model():
+    """Общая для всех сессий модель, периодически переобучаемая по кэшу маршрутов"""
+    global _model, _model_fitted
+    with _model_lock:
+        if _model is None or time.monotonic() - _model_fitted > REFIT_SECONDS:
+            _model = DetourModel.from_route_cache()
+            _model_fitted = time.monotonic()
+        return _model
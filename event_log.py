@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import traceback
+from itertools import islice
+from collections import deque, Counter
+from datetime import datetime
+from logging.handlers import QueueListener, RotatingFileHandler
+from cache_utils import CACHE_DIR
+
+# Сколько последних событий сессии держим в памяти
+EVENT_LOG_CAPACITY = 1000
+
+# Файловый журнал событий всех сессий: JSON построчно, с ротацией
+LOG_DIR = os.path.join(CACHE_DIR, "logs")
+LOG_FILE_PATH = os.path.join(LOG_DIR, "events.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+
+# Уровни logging для типов событий
+LEVELS = {"ERROR": logging.ERROR, "API_ERROR": logging.ERROR, "WARNING": logging.WARNING, "INFO": logging.INFO}
+
+
+def capture_traceback(error=None):
+    """
+    Снимок трассировки исключения error (по умолчанию - обрабатываемого сейчас) без форматирования:
+    строки исходного кода читаются только при просмотре. None, если исключения нет.
+    """
+    if error is None:
+        error = sys.exc_info()[1]
+    if error is None or error.__traceback__ is None:
+        return None
+    return traceback.TracebackException.from_exception(error, lookup_lines=False)
+
+
+def event_details(entry):
+    """Подробности события; трассировка форматируется при первом обращении"""
+    tb = entry.get("traceback")
+    if tb is not None:
+        text = "".join(tb.format()).rstrip()
+        entry["details"] = f"{entry['details']}\nТрассировка: {text}" if entry["details"] else text
+        entry["traceback"] = None
+    return entry["details"]
+
+
+def describe_fields(fields):
+    """Структурные поля события одной строкой: API, HTTP-статус, длительность"""
+    parts = []
+    if fields.get("api"):
+        parts.append(f"API: {fields['api']}")
+    if fields.get("status") is not None:
+        parts.append(f"HTTP {fields['status']}")
+    if fields.get("latency_ms") is not None:
+        parts.append(f"{fields['latency_ms']:.0f} мс")
+    parts.extend(f"{key}: {value}" for key, value in fields.items()
+                 if key not in ("api", "status", "latency_ms") and value is not None)
+    return " · ".join(parts)
+
+
+class EventLog:
+    """
+    Журнал событий сессии: кольцевой буфер последних capacity событий
+    (старые вытесняются без копирования) и счётчики по типам.
+    """
+
+    def __init__(self, capacity=EVENT_LOG_CAPACITY):
+        self._events = deque(maxlen=capacity)
+        self._counts = Counter()
+
+    def append(self, entry):
+        if len(self._events) == self._events.maxlen:
+            self._counts[self._events[0]["type"]] -= 1
+        self._events.append(entry)
+        self._counts[entry["type"]] += 1
+
+    def clear(self):
+        self._events.clear()
+        self._counts.clear()
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def count(self, *types):
+        """Число событий указанных типов"""
+        return sum(self._counts[t] for t in types)
+
+    def page(self, types, page=0, page_size=20):
+        """Страница событий указанных типов, новые первыми"""
+        matched = (entry for entry in reversed(self._events) if entry["type"] in types)
+        return list(islice(matched, page * page_size, (page + 1) * page_size))
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Событие - строка JSON. Трассировка в файл не форматируется (только тип и текст исключения):
+    полностью она собирается лишь при просмотре в панели отладки. Событие не изменяется -
+    его одновременно читает поток скрипта.
+    """
+
+    def format(self, record):
+        entry = record.event
+        line = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "type": entry["type"],
+            "message": entry["message"],
+        }
+        line.update((key, value) for key, value in entry["fields"].items() if value is not None)
+        # details читается до traceback: если панель как раз дописала трассировку в details,
+        # traceback уже None и текст не попадёт в строку дважды
+        details = entry["details"]
+        tb = entry.get("traceback")
+        if details:
+            line["details"] = details
+        if tb is not None:
+            line["exception"] = "".join(tb.format_exception_only()).strip()
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+class _EventListener(QueueListener):
+    """Фоновая запись событий: LogRecord создаётся уже в потоке записи, а не в вызывающем"""
+
+    def prepare(self, entry):
+        return logging.makeLogRecord({
+            "name": "transport_scheme.events",
+            "levelno": LEVELS.get(entry["type"], logging.INFO),
+            "levelname": entry["type"],
+            "msg": entry["message"],
+            "created": entry["created"],
+            "event": entry,
+        })
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _event_queue():
+    """Очередь файлового журнала; None, если каталог журнала недоступен для записи"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            try:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                              encoding="utf-8", delay=True)
+            except OSError:
+                # Журнал ведётся только в памяти сессии
+                _queue = False
+            else:
+                handler.setFormatter(JsonLinesFormatter())
+                _queue = queue.SimpleQueue()
+                listener = _EventListener(_queue, handler)
+                listener.start()
+                atexit.register(listener.stop)
+    return _queue or None
+
+
+def write_event(entry):
+    """Передаёт событие в файловый журнал (без ожидания записи)"""
+    log_queue = _queue if _queue is not None else _event_queue()
+    if log_queue:
+        log_queue.put(entry)
@@ -1,43 +1,111 @@
 import io
-import base64
+import gzip
+import json
+import hashlib
 import pandas as pd
+import xlsxwriter
+from timing_utils import timed
 
-def export_to_excel(df, columns_to_show):
-    """Экспортирует данные в Excel файл и возвращает их в виде скачиваемой ссылки"""
+# MIME-тип и имя файла ведомости для скачивания
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXCEL_FILE_NAME = "Ведомость_поставщиков.xlsx"
+
+# Файлы экспорта карты
+MAP_FILE_NAME = "transport_map.html"
+ROUTES_FILE_NAME = "routes.geojson"
+
+# Начиная с этого числа строк Excel-файл пишется в режиме constant_memory
+CONSTANT_MEMORY_ROWS = 5000
+
+# Столбцы ведомости доставки материалов в порядке вывода
+DELIVERY_COLUMNS = [
+    "№ п/п",
+    "Наименование материала",
+    "% от общей потребности",
+    "Вид работ",
+    "Наименование поставщика",
+    "Адрес",
+    "Вид \"франко\" для данного материала",
+    "Железнодорожные перевозки %",
+    "Станции назначения, на которую прибывает материал",
+    "Расстояние перевозки, км",
+    "Автомобильные перевозки %",
+    "Средняя дальность возки, км"
+]
+
+def excel_bytes(df, columns_to_show):
+    """Формирует Excel-файл ведомости и возвращает его содержимое (bytes)"""
     # Создаем DataFrame только с нужными колонками
-    export_df = df[columns_to_show].copy()
+    export_df = df[columns_to_show]
+
+    # Ширина столбцов: длина самого длинного значения или заголовка
+    lengths = export_df.astype(str).apply(lambda col: col.str.len().max()) if len(export_df) else None
+    widths = [
+        max(int(lengths[col]) if lengths is not None else 0, len(str(col)) + 2)
+        for col in export_df.columns
+    ]
 
     # Создаем буфер для хранения Excel-файла
     output = io.BytesIO()
 
-    # Используем pandas для создания Excel файла
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        export_df.to_excel(writer, sheet_name='Ведомость поставщиков', index=False)
+    # Строки пишутся по порядку, поэтому большие ведомости формируются в режиме constant_memory
+    workbook = xlsxwriter.Workbook(output, {
+        'in_memory': len(export_df) < CONSTANT_MEMORY_ROWS,
+        'constant_memory': len(export_df) >= CONSTANT_MEMORY_ROWS,
+        'strings_to_formulas': False,
+        'strings_to_urls': False
+    })
+    worksheet = workbook.add_worksheet('Ведомость поставщиков')
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
 
-        # Получаем объект workbook и worksheet
-        workbook = writer.book
-        worksheet = writer.sheets['Ведомость поставщиков']
+    for i, width in enumerate(widths):
+        worksheet.set_column(i, i, width)
+    worksheet.write_row(0, 0, [str(col) for col in export_df.columns], header_format)
 
-        # Автоматическая настройка ширины столбцов
-        for i, col in enumerate(export_df.columns):
-            column_width = max(export_df[col].astype(str).map(len).max(), len(col) + 2)
-            worksheet.set_column(i, i, column_width)
+    # Пустые значения (None/NaN) записываются пустыми ячейками
+    values = export_df.astype(object).where(export_df.notna(), None)
+    for row_num, row in enumerate(values.itertuples(index=False, name=None), 1):
+        worksheet.write_row(row_num, 0, row)
+
+    workbook.close()
 
     # Получаем содержимое буфера
-    processed_data = output.getvalue()
-
-    # Создаем ссылку для скачивания
-    b64 = base64.b64encode(processed_data).decode()
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="Ведомость_поставщиков.xlsx">📥 Скачать Excel-файл</a>'
-
-    return href
-
-def save_map_screenshot(html_content, width=1200, height=800):
-    """Сохраняет HTML-версию карты для скачивания"""
-    try:
-        # Кодируем HTML в base64 для скачивания
-        b64 = base64.b64encode(html_content.encode()).decode()
-        href = f'<a href="data:text/html;charset=utf-8;base64,{b64}" download="transport_map.html">📥 Скачать HTML карты</a>'
-        return href
-    except Exception as e:
+    return output.getvalue()
+
+def excel_export_key(df, columns_to_show):
+    """Хэш содержимого ведомости - ключ кэша готового Excel-файла"""
+    hashes = pd.util.hash_pandas_object(df[columns_to_show].astype(str), index=False)
+    digest = hashlib.sha1(hashes.to_numpy().tobytes())
+    digest.update("\x1f".join(columns_to_show).encode("utf-8"))
+    return digest.hexdigest()
+
+def get_excel_export(session_state, df, columns_to_show, build=True):
+    """
+    Excel-файл ведомости из кэша сессии (session_state.excel_export).
+    Файл формируется заново только при изменении данных; при build=False
+    вместо формирования возвращается None.
+    """
+    key = excel_export_key(df, columns_to_show)
+    cached = session_state.excel_export
+    if cached is not None and cached['key'] == key:
+        return cached['data']
+    if not build:
         return None
+    with timed(session_state, "Экспорт Excel"):
+        data = excel_bytes(df, columns_to_show)
+    session_state.excel_export = {'key': key, 'data': data}
+    return data
+
+def map_html_file(m, compress=False):
+    """
+    HTML карты для скачивания, отрисованный один раз: (data, file_name, mime).
+    compress=True - gzip (HTML с маршрутами сжимается в несколько раз).
+    """
+    data = m.get_root().render().encode("utf-8")
+    if compress:
+        return gzip.compress(data, compresslevel=6), MAP_FILE_NAME + ".gz", "application/gzip"
+    return data, MAP_FILE_NAME, "text/html"
+
+def geojson_bytes(collection):
+    """Компактная запись GeoJSON (без пробелов и \\u-экранирования)"""
+    return json.dumps(collection, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
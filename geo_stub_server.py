@@ -0,0 +1,412 @@
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from collections import deque, Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from spatial_utils import haversine_km
+
+# Локальная замена ORS (directions, matrix) и Nominatim (search) для нагрузочных проверок без квот и сети.
+# Приложение направляется на неё переменными окружения ORS_BASE_URL и NOMINATIM_URL.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Коэффициент извилистости маршрутов: детерминированный для пары точек, в этих пределах
+MIN_DETOUR, MAX_DETOUR = 1.15, 1.6
+STUB_SPEED_KMH = 60
+# Точек геометрии на километр прямой (не меньше MIN и не больше MAX на маршрут)
+ROUTE_POINTS_PER_KM = 1.0
+MIN_ROUTE_POINTS, MAX_ROUTE_POINTS = 10, 500
+# Лимит ORS Matrix API: произведение источников и назначений в одном запросе
+MATRIX_MAX_ROUTES = 3500
+
+# Область, в которую геокодируются адреса (европейская часть России)
+GEOCODE_BOUNDS = ((45.0, 60.0), (30.0, 50.0))
+
+# Сервисы заглушки: у каждого свой лимит частоты и своя статистика
+SERVICES = ("ors_directions", "ors_matrix", "nominatim")
+
+
+def _unit(*parts):
+    """Детерминированное число из [0, 1) по значениям parts"""
+    return zlib.crc32(repr(parts).encode("utf-8")) / 2 ** 32
+
+
+def _point_key(lat, lon):
+    return round(lat, 5), round(lon, 5)
+
+
+class StubConfig:
+    """
+    Поведение заглушки.
+    latency/jitter - задержка ответа (с); rate_per_minute - лимиты частоты по сервисам (429 сверх лимита);
+    p429/p_error - доля случайных ответов 429 и 503; unroutable_share - доля точек «далеко от дорог»
+    (ORS: ошибка 2010 / null в матрице); not_found_share - доля адресов, которые Nominatim не находит.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, ors_rate_per_minute=0, nominatim_rate_per_minute=0,
+                 p429=0.0, p_error=0.0, unroutable_share=0.0, not_found_share=0.0, retry_after=1,
+                 require_key=True, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_per_minute = {
+            "ors_directions": ors_rate_per_minute,
+            "ors_matrix": ors_rate_per_minute,
+            "nominatim": nominatim_rate_per_minute,
+        }
+        self.p429 = p429
+        self.p_error = p_error
+        self.unroutable_share = unroutable_share
+        self.not_found_share = not_found_share
+        self.retry_after = retry_after
+        self.require_key = require_key
+        self.seed = seed
+
+
+class _MinuteWindow:
+    """Скользящее минутное окно запросов: как у ORS, сверх лимита - отказ без постановки в очередь"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            while self._times and now - self._times[0] >= 60:
+                self._times.popleft()
+            if len(self._times) >= self.limit:
+                return False
+            self._times.append(now)
+            return True
+
+
+def detour_factor(origin, destination):
+    """Коэффициент извилистости пары точек (lat, lon) - одинаковый в directions и matrix"""
+    return MIN_DETOUR + (MAX_DETOUR - MIN_DETOUR) * _unit(_point_key(*origin), _point_key(*destination))
+
+
+def is_unroutable(point, share):
+    """Точка «далеко от дорог» (детерминированно по координатам)"""
+    return share > 0 and _unit("unroutable", _point_key(*point)) < share
+
+
+def route_geometry(origin, destination):
+    """
+    Детерминированный маршрут между точками (lat, lon): плавная кривая вокруг прямой.
+    Возвращает (координаты [lon, lat] для GeoJSON, расстояние в м, время в с).
+    """
+    straight_km = float(haversine_km(origin[0], origin[1], destination[0], destination[1]))
+    distance_m = straight_km * detour_factor(origin, destination) * 1000
+    points = int(min(max(straight_km * ROUTE_POINTS_PER_KM, MIN_ROUTE_POINTS), MAX_ROUTE_POINTS))
+    t = np.linspace(0, 1, points)
+    lat = origin[0] + (destination[0] - origin[0]) * t
+    lon = origin[1] + (destination[1] - origin[1]) * t
+    # Отклонение поперёк отрезка: синусоида, число «изгибов» и сторона зависят от пары точек
+    bends = 1 + int(_unit("bends", _point_key(*origin), _point_key(*destination)) * 3)
+    offset = 0.05 * np.sin(np.pi * bends * t)
+    lat = lat - (destination[1] - origin[1]) * offset
+    lon = lon + (destination[0] - origin[0]) * offset
+    coordinates = np.round(np.column_stack([lon, lat]), 6).tolist()
+    return coordinates, round(distance_m, 1), round(distance_m / 1000 / STUB_SPEED_KMH * 3600, 1)
+
+
+def geocode_point(address):
+    """Детерминированные координаты адреса в пределах GEOCODE_BOUNDS"""
+    (lat_min, lat_max), (lon_min, lon_max) = GEOCODE_BOUNDS
+    normalized = " ".join(address.lower().split())
+    return (round(lat_min + (lat_max - lat_min) * _unit("lat", normalized), 6),
+            round(lon_min + (lon_max - lon_min) * _unit("lon", normalized), 6))
+
+
+class StubError(Exception):
+    """Ответ заглушки с ошибкой: HTTP-статус, тело (JSON) и заголовки"""
+
+    def __init__(self, status, body, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+def _ors_error(status, code, message):
+    return StubError(status, {"error": {"code": code, "message": message}})
+
+
+def _parse_json(raw):
+    """Тело запроса ORS: JSON-объект"""
+    try:
+        body = json.loads(raw) if raw else {}
+    except ValueError:
+        raise _ors_error(400, 2000, "Unable to parse JSON request")
+    if not isinstance(body, dict):
+        raise _ors_error(400, 2000, "Request body must be a JSON object")
+    return body
+
+
+class GeoStubServer(ThreadingHTTPServer):
+    """HTTP-сервер заглушки: каждый запрос - в своём потоке, статистика по сервисам"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config=None, verbose=False):
+        self.config = config or StubConfig()
+        self.verbose = verbose
+        self._random = random.Random(self.config.seed)
+        self._windows = {name: _MinuteWindow(self.config.rate_per_minute[name]) for name in SERVICES}
+        self._stats = {name: Counter() for name in SERVICES}
+        self._active = Counter()
+        self._lock = threading.Lock()
+        super().__init__(address, _StubHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self):
+        """Счётчики по сервисам: запросы, ответы по статусам, максимум одновременных запросов"""
+        with self._lock:
+            return {name: dict(counter) for name, counter in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            for counter in self._stats.values():
+                counter.clear()
+
+    def _begin(self, service):
+        with self._lock:
+            self._stats[service]["requests"] += 1
+            self._active[service] += 1
+            self._stats[service]["max_active"] = max(self._stats[service]["max_active"], self._active[service])
+
+    def _end(self, service, status):
+        with self._lock:
+            self._active[service] -= 1
+            self._stats[service][f"status_{status}"] += 1
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def inject(self, service):
+        """Задержка и отказы, общие для всех сервисов (до обработки запроса)"""
+        config = self.config
+        delay = config.latency + (config.jitter * self._roll() if config.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        retry_headers = {"Retry-After": str(config.retry_after)}
+        if not self._windows[service].allow():
+            raise StubError(429, {"error": "Rate limit exceeded"}, retry_headers)
+        if config.p429 and self._roll() < config.p429:
+            raise StubError(429, {"error": "Rate limit exceeded"}, retry_headers)
+        if config.p_error and self._roll() < config.p_error:
+            raise StubError(503, {"error": "Service temporarily unavailable"})
+
+    def ors_directions(self, profile, body):
+        coordinates = body.get("coordinates") or []
+        if len(coordinates) != 2:
+            raise _ors_error(400, 2003, "Stub supports exactly two coordinates")
+        (lon1, lat1), (lon2, lat2) = coordinates
+        origin, destination = (lat1, lon1), (lat2, lon2)
+        for i, point in enumerate((origin, destination)):
+            if is_unroutable(point, self.config.unroutable_share):
+                raise _ors_error(404, 2010, f"Could not find routable point within a radius of 350.0 meters "
+                                            f"of specified coordinate {i}: {point[1]} {point[0]}.")
+        line, distance, duration = route_geometry(origin, destination)
+        return {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": line},
+                "properties": {
+                    "segments": [{"distance": distance, "duration": duration}],
+                    "summary": {"distance": distance, "duration": duration},
+                },
+            }],
+            "metadata": {"service": "routing", "query": {"profile": profile}},
+        }
+
+    def ors_matrix(self, profile, body):
+        locations = body.get("locations") or []
+        sources = body.get("sources") or list(range(len(locations)))
+        destinations = body.get("destinations") or list(range(len(locations)))
+        if len(sources) * len(destinations) > MATRIX_MAX_ROUTES:
+            raise _ors_error(400, 6004, f"Request parameters exceed the server configuration limits. "
+                                        f"Only a total of {MATRIX_MAX_ROUTES} routes are allowed.")
+        points = [(lat, lon) for lon, lat in locations]
+        share = self.config.unroutable_share
+        distances, durations = [], []
+        for s in sources:
+            distance_row, duration_row = [], []
+            for d in destinations:
+                if is_unroutable(points[s], share) or is_unroutable(points[d], share):
+                    distance_row.append(None)
+                    duration_row.append(None)
+                    continue
+                straight_km = float(haversine_km(points[s][0], points[s][1], points[d][0], points[d][1]))
+                distance = straight_km * detour_factor(points[s], points[d]) * 1000
+                distance_row.append(round(distance, 1))
+                duration_row.append(round(distance / 1000 / STUB_SPEED_KMH * 3600, 1))
+            distances.append(distance_row)
+            durations.append(duration_row)
+        metrics = body.get("metrics") or ["duration"]
+        result = {"metadata": {"service": "matrix", "query": {"profile": profile}}}
+        if "distance" in metrics:
+            result["distances"] = distances
+        if "duration" in metrics:
+            result["durations"] = durations
+        return result
+
+    def nominatim_search(self, query):
+        address = (query.get("q") or [""])[0]
+        if not address.strip():
+            raise StubError(400, {"error": {"code": 400, "message": "Nothing to search for."}})
+        if self.config.not_found_share and _unit("not_found", address) < self.config.not_found_share:
+            return []
+        lat, lon = geocode_point(address)
+        return [{
+            "place_id": zlib.crc32(address.encode("utf-8")),
+            "lat": str(lat),
+            "lon": str(lon),
+            "display_name": f"{address}, Россия",
+            "class": "place",
+            "type": "house",
+            "importance": 0.5,
+            "boundingbox": [str(lat - 0.0005), str(lat + 0.0005), str(lon - 0.0005), str(lon + 0.0005)],
+        }]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive: клиенты с пулом соединений (aiohttp, requests) переиспользуют соединения
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        """Тело запроса читается всегда, даже при отказе: иначе сбивается keep-alive соединение"""
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _handle(self, service, respond, require_key=False):
+        server = self.server
+        server._begin(service)
+        status = 500
+        try:
+            try:
+                if require_key and not self.headers.get("Authorization"):
+                    raise StubError(403, {"error": "Access to this API has been disallowed"})
+                server.inject(service)
+                body = respond()
+            except (AttributeError, KeyError, IndexError, TypeError, ValueError) as e:
+                # Некорректные параметры (не та структура координат, индекс вне списка и т.п.)
+                raise _ors_error(400, 2003, f"Invalid request parameters: {e!r}")
+            status = 200
+            self._send_json(200, body)
+        except StubError as e:
+            status = e.status
+            self._send_json(e.status, e.body, e.headers)
+        except Exception as e:
+            # Ошибка самой заглушки - ответ 500 вместо обрыва соединения
+            self._send_json(500, {"error": {"code": 500, "message": repr(e)}})
+            raise
+        finally:
+            server._end(service, status)
+
+    def do_POST(self):
+        raw = self._read_body()
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        # /v2/directions/{profile}/geojson и /v2/matrix/{profile}[/json]
+        if len(parts) == 4 and parts[:2] == ["v2", "directions"] and parts[3] == "geojson":
+            service, method = "ors_directions", self.server.ors_directions
+        elif len(parts) in (3, 4) and parts[:2] == ["v2", "matrix"] and parts[3:] in ([], ["json"]):
+            service, method = "ors_matrix", self.server.ors_matrix
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": f"Unknown endpoint: {self.path}"}})
+            return
+        self._handle(service, lambda: method(parts[2], _parse_json(raw)), self.server.config.require_key)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path in ("/search", "/search.php"):
+            query = parse_qs(url.query)
+            self._handle("nominatim", lambda: self.server.nominatim_search(query))
+        elif url.path == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": f"Unknown endpoint: {self.path}"}})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start_stub_server(host=DEFAULT_HOST, port=0, config=None, verbose=False):
+    """Заглушка в фоновом потоке (port=0 - свободный порт); остановка - server.shutdown()"""
+    server = GeoStubServer((host, port), config, verbose)
+    threading.Thread(target=server.serve_forever, name="geo-stub-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Локальная замена ORS (directions, matrix) и Nominatim (search) для нагрузочных проверок"
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, до N с")
+    parser.add_argument("--ors-rate", type=int, default=0,
+                        help="Лимит запросов ORS в минуту на каждый сервис (0 - без лимита)")
+    parser.add_argument("--nominatim-rate", type=int, default=0,
+                        help="Лимит запросов Nominatim в минуту (0 - без лимита)")
+    parser.add_argument("--p429", type=float, default=0.0, help="Доля случайных ответов 429")
+    parser.add_argument("--p-error", type=float, default=0.0, help="Доля случайных ответов 503")
+    parser.add_argument("--unroutable", type=float, default=0.0,
+                        help="Доля точек, до которых ORS не строит маршрут (ошибка 2010)")
+    parser.add_argument("--not-found", type=float, default=0.0, help="Доля адресов, которые Nominatim не находит")
+    parser.add_argument("--retry-after", type=int, default=1, help="Заголовок Retry-After в ответах 429, с")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение для случайных отказов")
+    parser.add_argument("--verbose", action="store_true", help="Печатать каждый запрос")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(
+        latency=args.latency, jitter=args.jitter,
+        ors_rate_per_minute=args.ors_rate, nominatim_rate_per_minute=args.nominatim_rate,
+        p429=args.p429, p_error=args.p_error, unroutable_share=args.unroutable, not_found_share=args.not_found,
+        retry_after=args.retry_after, seed=args.seed
+    )
+    server = GeoStubServer((args.host, args.port), config, args.verbose)
+    print(f"Заглушка геосервисов: {server.url}\n"
+          f"  ORS_BASE_URL={server.url}\n"
+          f"  NOMINATIM_URL={server.url}\n"
+          f"Статистика: {server.url}/stats", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats(), ensure_ascii=False, indent=2), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
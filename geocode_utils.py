@@ -0,0 +1,149 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeocoderServiceError
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from api_limits import TokenBucket, get_api_guard
+from cache_utils import get_geocode_cache, make_address_key
+from offline_geocoder import get_offline_geocoder
+from timing_utils import get_api_timings
+
+# Политика Nominatim: не более 1 запроса в секунду и осмысленный User-Agent
+NOMINATIM_USER_AGENT = "transport_scheme_app (github.com/remeenemee/transport_scheme)"
+NOMINATIM_RATE = float(os.environ.get("NOMINATIM_RATE", 1.0))
+NOMINATIM_TIMEOUT = 10
+# Адрес Nominatim (например, http://127.0.0.1:8765 - локальная заглушка geo_stub_server.py); пусто - публичный сервер
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "")
+
+# Сколько запросов держим «в полёте», чтобы сетевые задержки не снижали темп
+GEOCODE_WORKERS = 4
+
+_RETRYABLE_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderServiceError)
+
+
+def _nominatim_endpoint(url):
+    """Параметры domain/scheme клиента geopy для адреса Nominatim; пустой адрес - публичный сервер"""
+    if not url:
+        return {}
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    return {"domain": parts.netloc + parts.path.rstrip("/"), "scheme": parts.scheme}
+
+
+class GeocodingEngine:
+    """
+    Геокодер с одним долгоживущим клиентом Nominatim и общим ограничителем частоты.
+    Если задан локальный адресный индекс (local), Nominatim запрашивается только
+    для адресов без уверенного совпадения в нём. Повторяющиеся отказы Nominatim
+    размыкают предохранитель (guard): запросы на время отклоняются сразу.
+    """
+
+    def __init__(self, geolocator=None, rate=NOMINATIM_RATE, cache=None, max_workers=GEOCODE_WORKERS,
+                 local=None, guard=None):
+        self.geolocator = geolocator or Nominatim(user_agent=NOMINATIM_USER_AGENT, timeout=NOMINATIM_TIMEOUT,
+                                                  **_nominatim_endpoint(NOMINATIM_URL))
+        self.limiter = TokenBucket(rate)
+        self.cache = cache
+        self.max_workers = max_workers
+        self.local = local
+        self.guard = guard or get_api_guard("nominatim")
+
+    def geocode(self, address):
+        """
+        Координаты адреса: сначала по локальному индексу, затем через Nominatim.
+        Центр улицы из индекса (дом не найден) - только если Nominatim тоже не нашёл адрес.
+        Возвращает (coords, full_addr) или (None, None), ошибки API пробрасываются.
+        """
+        fallback = (None, None)
+        if self.local is not None:
+            with get_api_timings().span("Локальный геокодер", api="Локальный геокодер"):
+                coords, full_addr, confident = self.local.geocode(address)
+            if confident:
+                return coords, full_addr
+            fallback = (coords, full_addr)
+        coords, full_addr = self.geocode_remote(address)
+        if coords is None:
+            return fallback
+        return coords, full_addr
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, max=8),
+        retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+        reraise=True
+    )
+    def geocode_remote(self, address):
+        """
+        Один запрос к Nominatim с учётом лимита частоты.
+        Возвращает (coords, full_addr) или (None, None), ошибки API пробрасываются.
+        При разомкнутом предохранителе - ApiUnavailableError без запроса и повторов.
+        """
+        self.guard.check()
+        # Ожидание лимита и сам запрос замеряются отдельно: видно, что именно тормозит
+        with get_api_timings().span("Nominatim: ожидание лимита"):
+            self.limiter.acquire()
+        try:
+            with get_api_timings().span("Nominatim: запрос", api="Nominatim"):
+                location = self.geolocator.geocode(address)
+        except Exception as e:
+            # Предохранитель учитывает только ошибки доступности, на которых делаются повторы
+            self.guard.record(e if isinstance(e, _RETRYABLE_ERRORS) else None)
+            raise
+        self.guard.record()
+        if location:
+            return (location.latitude, location.longitude), location.address
+        return None, None
+
+    def geocode_many(self, addresses):
+        """
+        Пакетное геокодирование: дубликаты и адреса из кэша не запрашиваются.
+        Генератор выдаёт (address, coords, full_addr, error) по мере готовности результатов.
+        """
+        cache = self.cache if self.cache is not None else get_geocode_cache()
+
+        # Группируем адреса по ключу кэша, чтобы каждый уникальный адрес запрашивать один раз
+        groups = {}
+        for address in addresses:
+            groups.setdefault(make_address_key(address), []).append(address)
+
+        pending = {}
+        for key, group in groups.items():
+            found, coords, full_addr = cache.get(group[0])
+            if found:
+                for address in group:
+                    yield address, coords, full_addr, None
+            else:
+                pending[key] = group
+
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.geocode, group[0]): group for group in pending.values()}
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    coords, full_addr = future.result()
+                except Exception as e:
+                    # Ошибки API не кэшируем - адрес будет запрошен повторно
+                    for address in group:
+                        yield address, None, None, e
+                    continue
+                cache.set(group[0], coords, full_addr)
+                for address in group:
+                    yield address, coords, full_addr, None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_geocoding_engine():
+    """Общий для всех сессий экземпляр геокодера"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = GeocodingEngine(local=get_offline_geocoder())
+    return _engine
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+# Строки группируются по материалу и объекту: средняя дальность считается для каждого объекта отдельно
+GROUP_COLUMNS = ["Наименование материала", "object_key"]
+
+# Доля изменённых строк, до которой пересчитываются только затронутые группы
+INCREMENTAL_MAX_FRACTION = 0.25
+
+SUMMARY_COLUMNS = {
+    "suppliers": "Поставщиков",
+    "share": "Доля итого, %",
+    "auto_share": "Автомобильные перевозки, %",
+    "rail_share": "Железнодорожные перевозки, %",
+    "average": "Средняя дальность возки, км",
+    "min_distance": "Мин. расстояние, км",
+    "max_distance": "Макс. расстояние, км",
+}
+
+
+def _numbers(values, default):
+    """Числовой столбец: "-", пустые и нечисловые значения заменяются на default"""
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").fillna(default).to_numpy(float)
+
+
+def _signature(record):
+    """Поля строки, от которых зависит расчёт дальности"""
+    return (
+        record["Наименование материала"], tuple(record["object_coords"]), record["% от общей потребности"],
+        record["Автомобильные перевозки %"], record["Железнодорожные перевозки %"],
+        record["Расстояние перевозки, км"]
+    )
+
+
+def haul_columns(records):
+    """
+    Числовые столбцы расчёта по строкам ведомости.
+    Вес строки - доля поставщика в потребности (%), для средней дальности возки
+    учитывается только её автомобильная часть.
+    """
+    share = _numbers([r["% от общей потребности"] for r in records], 100.0)
+    auto = _numbers([r["Автомобильные перевозки %"] for r in records], 100.0)
+    rail = _numbers([r["Железнодорожные перевозки %"] for r in records], 0.0)
+    distance = _numbers([r["Расстояние перевозки, км"] for r in records], np.nan)
+    auto_weight = share * auto / 100
+    return pd.DataFrame({
+        "Наименование материала": [r["Наименование материала"] for r in records],
+        "object_key": [tuple(r["object_coords"]) for r in records],
+        "object_name": [r["Станции назначения, на которую прибывает материал"] for r in records],
+        "share": share,
+        "auto_weight": auto_weight,
+        "rail_weight": share * rail / 100,
+        # Строки без расстояния не влияют на среднюю дальность
+        "haul_weight": np.where(np.isnan(distance), 0.0, auto_weight),
+        "weighted_distance": np.where(np.isnan(distance), 0.0, auto_weight * distance),
+        "distance": distance,
+    })
+
+
+def aggregate_haul(rows, by=GROUP_COLUMNS):
+    """Агрегаты по материалам и объектам за один проход groupby"""
+    grouped = rows.groupby(by, sort=False)
+    summary = grouped.agg(
+        material=("Наименование материала", "first"),
+        object_key=("object_key", "first"),
+        object_name=("object_name", "first"),
+        suppliers=("share", "size"),
+        share=("share", "sum"),
+        auto_weight=("auto_weight", "sum"),
+        rail_weight=("rail_weight", "sum"),
+        haul_weight=("haul_weight", "sum"),
+        weighted_distance=("weighted_distance", "sum"),
+        min_distance=("distance", "min"),
+        max_distance=("distance", "max"),
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        summary["average"] = (summary["weighted_distance"] / summary["haul_weight"]).round(2)
+        summary["auto_share"] = (summary["auto_weight"] / summary["share"] * 100).round(1)
+        summary["rail_share"] = (summary["rail_weight"] / summary["share"] * 100).round(1)
+    return summary[["material", "object_key", "object_name", *SUMMARY_COLUMNS]]
+
+
+class HaulEngine:
+    """
+    Средняя дальность возки и сводка по материалам над строками ведомости (хранится в session_state).
+    При изменении или добавлении отдельных строк пересчитываются только затронутые группы.
+    """
+
+    def __init__(self):
+        self._signatures = []
+        self._group_codes = {}          # (материал, объект) → номер группы
+        self._rows = self._coded(haul_columns([]))
+        self.summary = aggregate_haul(self._rows, "group")
+
+    def _coded(self, rows):
+        """Номер группы для каждой строки (агрегаты индексируются им, а не строковыми ключами)"""
+        rows["group"] = np.array([
+            self._group_codes.setdefault(key, len(self._group_codes))
+            for key in zip(rows["Наименование материала"], rows["object_key"])
+        ], dtype=int)
+        return rows
+
+    def _changed_positions(self, signatures):
+        """Номера изменённых и добавленных строк или None, если нужен полный пересчёт"""
+        old = self._signatures
+        if len(signatures) < len(old):
+            return None
+        changed = [i for i, (a, b) in enumerate(zip(old, signatures)) if a != b]
+        changed.extend(range(len(old), len(signatures)))
+        if len(changed) > max(1, len(signatures) * INCREMENTAL_MAX_FRACTION):
+            return None
+        return changed
+
+    def update(self, records):
+        """Пересчитывает агрегаты, если строки изменились; возвращает сводку"""
+        signatures = [_signature(r) for r in records]
+        if signatures == self._signatures:
+            return self.summary
+
+        changed = self._changed_positions(signatures)
+        if changed is None:
+            self._rows = self._coded(haul_columns(records))
+            self.summary = aggregate_haul(self._rows, "group")
+        else:
+            new_rows = self._coded(haul_columns([records[i] for i in changed]))
+            new_rows.index = changed
+            old_positions = [i for i in changed if i < len(self._signatures)]
+            touched = np.union1d(new_rows["group"], self._rows.loc[old_positions, "group"])
+
+            self._rows = pd.concat([self._rows.drop(index=old_positions), new_rows]).sort_index()
+            in_touched = np.isin(self._rows["group"].to_numpy(), touched)
+            partial = aggregate_haul(self._rows[in_touched], "group")
+            kept = self.summary[~self.summary.index.isin(touched)]
+            self.summary = pd.concat([kept, partial])
+        self._signatures = signatures
+        return self.summary
+
+    def apply(self, records):
+        """
+        Записывает средневзвешенную дальность возки группы в каждую строку ведомости.
+        Пишутся все строки, а не только изменённые: после очистки ведомости те же строки
+        приходят новыми словарями с прежними сигнатурами и без средней дальности.
+        """
+        self.update(records)
+        averages = np.full(len(self._group_codes), np.nan)
+        averages[self.summary.index.to_numpy()] = self.summary["average"].to_numpy()
+        values = averages[self._rows["group"].to_numpy()]
+        # Группа без расстояний - в строке остаётся её собственное расстояние
+        values = np.where(np.isnan(values), self._rows["distance"].to_numpy(), values)
+        for record, value in zip(records, values.tolist()):
+            if value == value:
+                record["Средняя дальность возки, км"] = value
+        return records
+
+    def summary_table(self):
+        """Сводка для отображения: материал, объект и агрегаты с русскими заголовками"""
+        table = self.summary.drop(columns="object_key")
+        return table.rename(columns={"material": "Наименование материала", "object_name": "Объект",
+                                     **SUMMARY_COLUMNS}).reset_index(drop=True)
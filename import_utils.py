@@ -0,0 +1,202 @@
+import io
+import csv
+import pandas as pd
+from openpyxl import load_workbook
+from utils import (
+    geocode_addresses_cached, iter_routes_ors, make_delivery_record,
+    MATERIAL_COLORS, AVAILABLE_COLORS
+)
+from ors_async import ORS_DIRECTIONS_PER_MINUTE, ROUTE_WORKERS
+from timing_utils import timed_stage
+
+# Размер порции при чтении CSV
+CSV_CHUNK_ROWS = 500
+
+DEFAULT_MATERIAL = "Песок, щебень, грунт"
+DEFAULT_WORK_TYPE = "Устройство дорожной одежды"
+
+# Альтернативные названия столбцов (в т.ч. выгрузка базы поставщиков)
+COLUMN_ALIASES = {
+    "Название компании": "Наименование поставщика",
+    "Поставщик": "Наименование поставщика",
+    "Адрес компании": "Адрес",
+    "Адрес поставщика": "Адрес",
+    "Материал": "Наименование материала",
+}
+
+
+def parse_coords(text):
+    """Разбор строки "широта, долгота"; None, если формат или диапазон некорректны"""
+    try:
+        lat, lon = map(float, [x.strip() for x in str(text).split(",")])
+    except ValueError:
+        return None
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None
+
+
+def _normalize_header(header):
+    """Названия столбцов к формату ведомости; исходное название сохраняется, если оно уже есть"""
+    names = [str(h).strip() if h is not None else "" for h in header]
+    return [
+        COLUMN_ALIASES[name] if name in COLUMN_ALIASES and COLUMN_ALIASES[name] not in names else name
+        for name in names
+    ]
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _iter_xlsx(source):
+    """Строки первого листа в режиме read_only - книга не загружается в память целиком"""
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = _normalize_header(next(rows, []))
+        for line, values in enumerate(rows, 2):
+            if values is None or all(v is None for v in values):
+                continue
+            yield line, {name: _cell(value) for name, value in zip(header, values) if name}
+    finally:
+        workbook.close()
+
+
+def _iter_csv(source):
+    """Строки CSV порциями по CSV_CHUNK_ROWS (разделитель определяется автоматически)"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            yield from _iter_csv(f)
+        return
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    sample = source.read(4096)
+    source.seek(0)
+    if isinstance(sample, bytes):
+        sample = sample.decode("utf-8-sig", errors="ignore")
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+    except csv.Error:
+        sep = ","
+
+    line = 1
+    for chunk in pd.read_csv(source, sep=sep, dtype=str, chunksize=CSV_CHUNK_ROWS, encoding="utf-8-sig"):
+        chunk.columns = _normalize_header(chunk.columns)
+        for record in chunk.fillna("").to_dict("records"):
+            line += 1
+            yield line, {name: str(value).strip() for name, value in record.items()}
+
+
+def iter_supplier_rows(source, filename):
+    """
+    Потоковое чтение файла поставщиков (XLSX или CSV).
+    source - путь или файловый объект. Генератор выдаёт (номер строки в файле, dict столбцов).
+    """
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return _iter_xlsx(source)
+    return _iter_csv(source)
+
+
+def validate_rows(rows):
+    """
+    Проверка строк файла поставщиков.
+    Возвращает (supplier_rows, errors): строки для расчёта и список (номер строки, сообщение).
+    """
+    supplier_rows = []
+    errors = []
+    for line, row in rows:
+        name = row.get("Наименование поставщика", "")
+        address = row.get("Адрес", "")
+        coords_text = row.get("Координаты", "")
+        if not name:
+            errors.append((line, "Не указано наименование поставщика"))
+            continue
+        coords = parse_coords(coords_text) if coords_text else None
+        if coords_text and coords is None:
+            if not address:
+                errors.append((line, f"Некорректные координаты: {coords_text}"))
+                continue
+            # Координаты не разобраны, но есть адрес - определим по нему
+        if coords is None and not address:
+            errors.append((line, "Не указан ни адрес, ни координаты"))
+            continue
+        supplier_rows.append({
+            "line": line,
+            "name": name,
+            "address": address,
+            "coords": coords,
+            "full_addr": address or (f"Координаты: {coords[0]:.5f}, {coords[1]:.5f}" if coords else None),
+            "material": row.get("Наименование материала") or DEFAULT_MATERIAL,
+            "work_type": row.get("Вид работ") or DEFAULT_WORK_TYPE,
+            "color": row.get("Цвет", ""),
+        })
+    return supplier_rows, errors
+
+
+@timed_stage("Геокодирование (пакет)")
+def geocode_rows(session_state, supplier_rows, on_progress=None):
+    """
+    Координаты поставщиков без заданных координат - одним пакетом по уникальным адресам.
+    on_progress(done, total, address, coords) вызывается по мере готовности.
+    """
+    to_geocode = {}
+    for row in supplier_rows:
+        if row["coords"] is None:
+            to_geocode.setdefault(row["address"], []).append(row)
+
+    total = len(to_geocode)
+    for done, (address, coords, full_addr) in enumerate(
+            geocode_addresses_cached(session_state, list(to_geocode)), 1):
+        for row in to_geocode[address]:
+            row["coords"] = coords
+            if coords is not None:
+                row["full_addr"] = full_addr
+        if on_progress:
+            on_progress(done, total, address, coords)
+    return supplier_rows
+
+
+@timed_stage("Маршруты (пакет)")
+def route_rows(session_state, ors_client, supplier_rows, object_coords,
+               rate_per_minute=ORS_DIRECTIONS_PER_MINUTE, workers=ROUTE_WORKERS, on_progress=None):
+    """
+    Маршруты от поставщиков к объекту: параллельные запросы (не более workers одновременно)
+    с общим лимитом частоты ORS. Повторяющиеся координаты и маршруты из кэша не запрашиваются повторно.
+    on_progress(done, total, row) вызывается по мере готовности.
+    """
+    groups = {}
+    for row in supplier_rows:
+        if row["coords"] is not None:
+            groups.setdefault((round(row["coords"][0], 5), round(row["coords"][1], 5)), []).append(row)
+
+    groups = list(groups.values())
+    pairs = [(group[0]["coords"], object_coords) for group in groups]
+    for done, (i, (route_coords, distance)) in enumerate(
+            iter_routes_ors(session_state, ors_client, pairs, rate_per_minute, workers), 1):
+        for row in groups[i]:
+            row["route_coords"] = route_coords
+            row["distance"] = distance
+        if on_progress:
+            on_progress(done, len(groups), groups[i][0])
+    return supplier_rows
+
+
+def build_records(supplier_rows, object_coords, object_addr, start_idx=1):
+    """Строки ведомости; поставщики без координат пропускаются"""
+    colors = list(AVAILABLE_COLORS.values())
+    records = []
+    for row in supplier_rows:
+        if row["coords"] is None:
+            continue
+        material = row["material"]
+        color = row["color"] or MATERIAL_COLORS.get(material, colors[len(records) % len(colors)])
+        records.append(make_delivery_record(
+            start_idx + len(records), material, row["work_type"], row["name"], row["full_addr"],
+            object_addr, row.get("distance"), color, row["coords"], object_coords, row.get("route_coords")
+        ))
+    return records
@@ -0,0 +1,311 @@
+import json
+import hashlib
+import folium
+from spatial_utils import simplify_route
+from cache_utils import ROUTE_COORD_PRECISION
+from branca.element import MacroElement
+from jinja2 import Template
+from folium.plugins import FastMarkerCluster
+
+# Начиная с этого числа точек поставщики отображаются клиентскими кластерами
+CLUSTER_THRESHOLD = 500
+
+# Столбцы базы, из которых строятся всплывающие окна поставщиков
+POPUP_COLUMNS = ['Название компании', 'ИНН', 'Главный ОКВЭД (название)', 'Адрес компании']
+
+
+class SupplierLookup(MacroElement):
+    """Общая таблица сведений о поставщиках, из которой всплывающие окна строятся по клику"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = {{ this.rows_json }};
+        {% endmacro %}
+    """)
+
+    def __init__(self, rows):
+        super().__init__()
+        self._name = "SupplierLookup"
+        # Без \u-экранирования кириллицы: таблица получается вдвое-втрое компактнее
+        self.rows_json = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+
+def _cluster_callback(lookup_name):
+    """JS-функция создания маркера кластера: подсказка и окно формируются лениво"""
+    return f"""function (row) {{
+        var esc = function (s) {{
+            return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+                .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+        }};
+        var info = function () {{ return {lookup_name}[row[2]]; }};
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {{
+            radius: 5, color: 'blue', fill: true, fillOpacity: 1.0
+        }});
+        marker.bindTooltip(function () {{ return esc(info()[0]); }});
+        marker.bindPopup(function () {{
+            var r = info();
+            return '<b>' + esc(r[0]) + '</b><br>ИНН: ' + esc(r[1]) +
+                '<br>ОКВЭД: ' + esc(r[2]) + '<br>Адрес: ' + esc(r[3]);
+        }}, {{maxWidth: 300}});
+        return marker;
+    }}"""
+
+
+def add_supplier_points(m, suppliers, cluster_threshold=CLUSTER_THRESHOLD):
+    """
+    Добавляет точки поставщиков на карту.
+    До cluster_threshold точек - отдельные CircleMarker с подсказками,
+    больше - FastMarkerCluster с компактным массивом координат.
+    """
+    valid = suppliers[suppliers['coords_valid']]
+
+    if len(valid) <= cluster_threshold:
+        for _, row in valid.iterrows():
+            # Создаем всплывающую подсказку с информацией о поставщике
+            popup_text = f"""<b>{row['Название компании']}</b><br>
+                            ИНН: {row['ИНН']}<br>
+                            ОКВЭД: {row['Главный ОКВЭД (название)']}<br>
+                            Адрес: {row['Адрес компании']}"""
+
+            # Добавляем маркер поставщика
+            folium.CircleMarker(
+                [row['lat'], row['lon']],
+                popup=folium.Popup(popup_text, max_width=300),
+                tooltip=row['Название компании'],
+                radius=5,  # Маленький радиус
+                color="blue",
+                fill=True,
+                fill_opacity=1.0,
+            ).add_to(m)
+        return
+
+    # Сведения для окон передаются одной таблицей, маркеры - массивом [lat, lon, номер строки]
+    lookup = SupplierLookup(valid[POPUP_COLUMNS].astype(str).values.tolist())
+    lookup.add_to(m)
+    data = [
+        [round(lat, 6), round(lon, 6), i]
+        for i, (lat, lon) in enumerate(zip(valid['lat'].tolist(), valid['lon'].tolist()))
+    ]
+    FastMarkerCluster(
+        data,
+        callback=_cluster_callback(lookup.get_name()),
+        name="Поставщики",
+        disable_clustering_at_zoom=14
+    ).add_to(m)
+
+
+def fingerprint(*parts):
+    """Отпечаток входных данных карты или слоя (для сравнения между перезапусками скрипта)"""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class MapCache:
+    """
+    Собранные карты и слои между перезапусками скрипта Streamlit (хранится в session_state).
+    Объект пересобирается только при изменении отпечатка его входных данных.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._base_children = set()
+
+    def get(self, name, key, build):
+        """Возвращает (объект, пересобран_ли); build() вызывается только при смене key"""
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1], False
+        value = build()
+        self._entries[name] = (key, value)
+        return value, True
+
+    def base_map(self, key, build):
+        """
+        Базовая карта (объект, точки поставщиков). st_folium добавляет в карту слой
+        из feature_group_to_add, поэтому при повторном использовании он убирается,
+        чтобы скрипт базовой карты не менялся и компонент не перемонтировался.
+        """
+        m, rebuilt = self.get("base", key, build)
+        if rebuilt:
+            self._base_children = set(m._children)
+        else:
+            for name in [n for n in m._children if n not in self._base_children]:
+                del m._children[name]
+        return m, rebuilt
+
+    def peek(self, name, key):
+        """Объект из кэша без пересборки (None, если его нет или key изменился)"""
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        return None
+
+    def clear(self):
+        self._entries.clear()
+        self._base_children = set()
+
+
+def build_object_map(object_coords, radius=5, popup="Место размещения объекта", zoom_start=10, others=()):
+    """Карта с объектом строительства (маленькая красная точка); others - координаты остальных объектов"""
+    m = folium.Map(location=object_coords, zoom_start=zoom_start)
+    for coords in [object_coords, *others]:
+        folium.CircleMarker(
+            coords,
+            radius=radius,
+            color="red",
+            fill=True,
+            fill_opacity=1.0,
+            popup=popup,
+            tooltip="Объект"
+        ).add_to(m)
+    if others:
+        m.fit_bounds([object_coords, *others])
+    return m
+
+
+def delivery_objects(records):
+    """Координаты объектов ведомости без повторов, в порядке появления"""
+    return list(dict.fromkeys(tuple(record["object_coords"]) for record in records))
+
+
+def number_icon(idx, color):
+    """Круглая иконка с номером поставщика"""
+    return folium.DivIcon(html=f"""
+            <div style="
+                background: {color};
+                color: white;
+                border-radius: 50%;
+                width: 24px;
+                height: 24px;
+                text-align: center;
+                line-height: 24px;
+                font-weight: bold;
+                font-size: 14px;
+                box-shadow: 1px 1px 3px rgba(0,0,0,0.4);
+            ">{idx}</div>""")
+
+
+def delivery_layer_inputs(records):
+    """Данные записей, от которых зависит слой маршрутов на карте"""
+    return [
+        (
+            record["№ п/п"], record["supplier_coords"], record["object_coords"], record["Цвет"],
+            record["Наименование поставщика"], record["Наименование материала"],
+            record["Расстояние перевозки, км"], record.get("route_coords")
+        )
+        for record in records
+    ]
+
+
+def add_delivery_markers(parent, records):
+    """Номера поставщиков с попапом информации"""
+    for record in records:
+        idx = record["№ п/п"]
+        folium.Marker(
+            record["supplier_coords"],
+            popup=f"№{idx}: {record['Наименование поставщика']}",
+            tooltip=f"Поставщик №{idx}",
+            icon=number_icon(idx, record["Цвет"])
+        ).add_to(parent)
+
+
+def build_delivery_layer(records, route_tolerance):
+    """Слой с номерами поставщиков и маршрутами (по дорогам или по прямой)"""
+    layer = folium.FeatureGroup(name="Поставщики и маршруты")
+    add_delivery_markers(layer, records)
+    for record in records:
+        sup_coords = record["supplier_coords"]
+        color = record["Цвет"]
+
+        # Маршрут
+        route_coords = record.get("route_coords")
+        if route_coords:
+            folium.PolyLine(
+                locations=simplify_route(route_coords, route_tolerance),
+                weight=5,
+                color=color,
+                opacity=0.8,
+                tooltip=f"{record['Наименование материала']} → {record['Расстояние перевозки, км']} км (по дорогам)"
+            ).add_to(layer)
+        else:
+            # Резерв — прямая
+            folium.PolyLine(
+                locations=[sup_coords, record["object_coords"]],
+                weight=3,
+                color=color,
+                dash_array="10",
+                opacity=0.6,
+                tooltip=f"{record['Наименование материала']} → {record['Расстояние перевозки, км']} км (оценка по прямой)"
+            ).add_to(layer)
+    return layer
+
+
+def route_feature(locations, color, tooltip, straight=False):
+    """
+    Линия маршрута как объект GeoJSON (координаты [lon, lat], округлены до ~1 м).
+    straight=True - резервная прямая, рисуется пунктиром.
+    """
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [
+                [round(lon, ROUTE_COORD_PRECISION), round(lat, ROUTE_COORD_PRECISION)]
+                for lat, lon in locations
+            ]
+        },
+        "properties": {"color": color, "tooltip": tooltip, "straight": straight}
+    }
+
+
+def routes_geojson(features):
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _route_style(feature):
+    props = feature["properties"]
+    if props["straight"]:
+        return {"color": props["color"], "weight": 3, "opacity": 0.6, "dashArray": "10"}
+    return {"color": props["color"], "weight": 5, "opacity": 0.8}
+
+
+def add_routes_layer(parent, collection):
+    """Все маршруты одним слоем GeoJSON вместо отдельной PolyLine на каждый"""
+    if not collection["features"]:
+        return
+    folium.GeoJson(
+        collection,
+        name="Маршруты",
+        style_function=_route_style,
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False)
+    ).add_to(parent)
+
+
+def delivery_routes_geojson(records, route_tolerance):
+    """Маршруты ведомости доставки (по дорогам или по прямой) в GeoJSON"""
+    features = []
+    for record in records:
+        route_coords = record.get("route_coords")
+        material = record["Наименование материала"]
+        distance = record["Расстояние перевозки, км"]
+        if route_coords:
+            features.append(route_feature(
+                simplify_route(route_coords, route_tolerance), record["Цвет"],
+                f"{material} → {distance} км (по дорогам)"
+            ))
+        else:
+            features.append(route_feature(
+                [record["supplier_coords"], record["object_coords"]], record["Цвет"],
+                f"{material} → {distance} км (оценка по прямой)", straight=True
+            ))
+    return routes_geojson(features)
+
+
+def build_delivery_export(records, object_coords, route_tolerance):
+    """Карта для экспорта: объект, номера поставщиков и маршруты слоем GeoJSON. Возвращает (карта, GeoJSON)"""
+    others = [coords for coords in delivery_objects(records) if coords != tuple(object_coords)]
+    m = build_object_map(object_coords, others=others)
+    add_delivery_markers(m, records)
+    collection = delivery_routes_geojson(records, route_tolerance)
+    add_routes_layer(m, collection)
+    return m, collection
@@ -0,0 +1,498 @@
+import os
+import re
+import sys
+import csv
+import sqlite3
+import argparse
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from spatial_utils import SpatialIndex
+
+# Путь к локальному адресному индексу (SQLite); если задан - Nominatim нужен только при неуверенном совпадении
+OFFLINE_GEOCODER_ENV = "OFFLINE_GEOCODER_INDEX"
+
+# Минимальная оценка совпадения, при которой результат принимается без Nominatim
+CONFIDENT_SCORE = 0.75
+# Минимальное сходство названия (по триграммам), при котором кандидат рассматривается
+MIN_SIMILARITY = 0.45
+SETTLEMENT_CANDIDATES = 10
+# Нечёткий поиск ведётся по самым редким триграммам запроса: частые ("ск ", "ово")
+# встречаются в десятках тысяч названий и только замедляют выборку
+FUZZY_TRIGRAMS = 6
+
+# Дома без addr:city относятся к ближайшему населённому пункту в этом радиусе (км)
+SETTLEMENT_RADIUS_KM = 5
+
+# Типы населённых пунктов OSM (place=*)
+PLACE_TYPES = {"city", "town", "village", "hamlet", "isolated_dwelling", "suburb", "locality"}
+
+# Слова-типы адресных элементов (сравниваются после нормализации)
+SETTLEMENT_WORDS = {
+    "город", "г", "поселок", "пос", "п", "пгт", "рп", "село", "с", "деревня", "дер",
+    "хутор", "х", "станица", "ст", "снт", "мкр", "микрорайон", "нп"
+}
+STREET_WORDS = {
+    "улица", "ул", "проспект", "пр", "пр-т", "просп", "переулок", "пер", "шоссе", "ш",
+    "бульвар", "б-р", "бул", "площадь", "пл", "проезд", "пр-д", "тупик", "туп",
+    "набережная", "наб", "аллея", "линия", "тракт", "квартал", "кв-л"
+}
+DISTRICT_WORDS = {"район", "р-н", "округ", "го", "мо"}
+REGION_WORDS = {"область", "обл", "край", "республика", "респ", "ао"}
+HOUSE_WORDS = {"д", "дом", "зд", "здание", "вл", "владение", "стр", "строение", "к", "корп", "корпус", "литера", "лит"}
+
+
+def normalize_text(text):
+    """Нижний регистр, ё→е, без пунктуации (кроме дефиса и косой черты)"""
+    text = str(text).lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s/-]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_name(text):
+    """Название без слов-типов: "ул. Электрическая" → "электрическая" """
+    words = [w for w in normalize_text(text).split() if w not in SETTLEMENT_WORDS | STREET_WORDS
+             | DISTRICT_WORDS | REGION_WORDS]
+    return " ".join(words)
+
+
+def normalize_house(text):
+    """Номер дома: "д. 12 А корп. 1" → "12а/1"; None, если номера нет"""
+    text = normalize_text(text)
+    # Буква дома - не «к» перед номером корпуса: "д 5 к 2" → "5/2", а не "5к"
+    match = re.search(r"(\d+)\s*((?!к\s*\d)[а-я](?![а-я]))?(?:\s*(?:/|к|корп|корпус|стр|строение)\s*(\d+))?",
+                      text)
+    if not match:
+        return None
+    number, letter, building = match.groups()
+    return number + (letter or "") + (f"/{building}" if building else "")
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Сходство строк по триграммам (коэффициент Жаккара), 0..1"""
+    if not a or not b:
+        return 0.0
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+def _split_house(text):
+    """Номер дома в конце части адреса: "кутузова 12а" → ("кутузова", "12а"); без номера - (text, None)"""
+    match = re.search(r"\s(\d+[а-я]?(?:/\d+)?)$", text)
+    if not match:
+        return text, None
+    return text[:match.start()], normalize_house(match.group(1))
+
+
+def parse_address(address):
+    """
+    Разбор адреса на элементы по запятым и словам-типам.
+    Возвращает dict с ключами region, district, settlement, street, house (None - элемента нет).
+    """
+    parts = {"region": None, "district": None, "settlement": None, "street": None, "house": None}
+    unknown = []
+    for raw in str(address).split(","):
+        words = normalize_text(raw).split()
+        if not words or re.fullmatch(r"\d{6}", words[0]) and len(words) == 1:
+            continue  # Пустая часть или почтовый индекс
+        word_set = set(words)
+        if word_set & REGION_WORDS:
+            parts["region"] = normalize_name(raw)
+        elif word_set & DISTRICT_WORDS:
+            parts["district"] = normalize_name(raw)
+        elif words[0] in HOUSE_WORDS or re.fullmatch(r"\d+[а-я]?(/\d+)?", words[0]):
+            if parts["house"] is None:
+                parts["house"] = normalize_house(raw)
+        elif word_set & STREET_WORDS:
+            # Номер дома в той же части: "ул. Кутузова 12а"
+            text, house = _split_house(normalize_text(raw))
+            if house and parts["house"] is None:
+                parts["house"] = house
+            else:
+                text = normalize_text(raw)
+            parts["street"] = normalize_name(text)
+        elif word_set & SETTLEMENT_WORDS:
+            parts["settlement"] = normalize_name(raw)
+        else:
+            # Номер дома и в части без слова-типа: "Невское, Гагарина 229"
+            text, house = _split_house(normalize_text(raw))
+            if house and parts["house"] is None:
+                parts["house"] = house
+            else:
+                text = normalize_text(raw)
+            unknown.append(normalize_name(text))
+    # Части без слова-типа: первая - населённый пункт, следующая - улица
+    for name in unknown:
+        if parts["settlement"] is None:
+            parts["settlement"] = name
+        elif parts["street"] is None:
+            parts["street"] = name
+    return parts
+
+
+_SCHEMA = """
+CREATE TABLE settlements (
+    id INTEGER PRIMARY KEY, name TEXT, norm TEXT, kind TEXT,
+    district TEXT, district_norm TEXT, region TEXT, lat REAL, lon REAL
+);
+CREATE TABLE settlement_trigrams (
+    tri TEXT, settlement_id INTEGER, PRIMARY KEY (tri, settlement_id)
+) WITHOUT ROWID;
+CREATE TABLE trigram_counts (tri TEXT PRIMARY KEY, n INTEGER) WITHOUT ROWID;
+CREATE TABLE streets (
+    id INTEGER PRIMARY KEY, settlement_id INTEGER, name TEXT, norm TEXT, lat REAL, lon REAL
+);
+CREATE TABLE houses (street_id INTEGER, number TEXT, label TEXT, lat REAL, lon REAL);
+"""
+_INDEXES = """
+CREATE INDEX settlements_norm ON settlements (norm);
+CREATE INDEX streets_settlement ON streets (settlement_id);
+CREATE INDEX houses_street ON houses (street_id, number);
+"""
+
+
+class AddressIndexBuilder:
+    """Сбор адресов (населённый пункт → улица → дом) и запись индекса в SQLite"""
+
+    def __init__(self):
+        self.settlements = {}   # (norm, district_norm) → dict
+        self.streets = {}       # (settlement_key, norm) → dict
+        self.houses = {}        # (street_key, number) → (label, lat, lon)
+
+    def add_settlement(self, name, lat, lon, kind="", district="", region=""):
+        key = (normalize_name(name), normalize_name(district))
+        if not key[0]:
+            return None
+        entry = self.settlements.get(key)
+        if entry is None:
+            self.settlements[key] = {"name": name, "kind": kind, "district": district, "region": region,
+                                     "lat": lat, "lon": lon, "points": []}
+        elif lat is not None and entry["lat"] is None:
+            entry.update(lat=lat, lon=lon, kind=kind or entry["kind"])
+        return key
+
+    def add_street(self, settlement_key, name, lat=None, lon=None):
+        key = (settlement_key, normalize_name(name))
+        entry = self.streets.setdefault(key, {"name": name, "points": []})
+        if lat is not None:
+            entry["points"].append((lat, lon))
+        return key
+
+    def add_house(self, settlement_key, street, number, lat, lon):
+        norm = normalize_house(number)
+        if norm is None:
+            return
+        street_key = self.add_street(settlement_key, street or "", lat, lon)
+        self.settlements[settlement_key]["points"].append((lat, lon))
+        self.houses[(street_key, norm)] = (str(number), lat, lon)
+
+    def write(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        conn = sqlite3.connect(path)
+        conn.executescript(_SCHEMA)
+
+        settlement_ids = {}
+        trigram_counts = Counter()
+        for i, (key, s) in enumerate(self.settlements.items(), 1):
+            lat, lon = s["lat"], s["lon"]
+            if lat is None:
+                if not s["points"]:
+                    continue
+                lat, lon = np.mean(s["points"], axis=0).tolist()
+            settlement_ids[key] = i
+            conn.execute("INSERT INTO settlements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (i, s["name"], key[0], s["kind"], s["district"], key[1], s["region"], lat, lon))
+            settlement_trigrams = trigrams(key[0])
+            trigram_counts.update(settlement_trigrams)
+            conn.executemany("INSERT OR IGNORE INTO settlement_trigrams VALUES (?, ?)",
+                             [(t, i) for t in settlement_trigrams])
+        conn.executemany("INSERT INTO trigram_counts VALUES (?, ?)", trigram_counts.items())
+
+        street_ids = {}
+        for i, ((settlement_key, norm), st) in enumerate(self.streets.items(), 1):
+            if settlement_key not in settlement_ids or not st["points"]:
+                continue
+            lat, lon = np.mean(st["points"], axis=0).tolist()
+            street_ids[(settlement_key, norm)] = i
+            conn.execute("INSERT INTO streets VALUES (?, ?, ?, ?, ?, ?)",
+                         (i, settlement_ids[settlement_key], st["name"], norm, lat, lon))
+
+        conn.executemany("INSERT INTO houses VALUES (?, ?, ?, ?, ?)", [
+            (street_ids[street_key], number, label, lat, lon)
+            for (street_key, number), (label, lat, lon) in self.houses.items()
+            if street_key in street_ids
+        ])
+        conn.executescript(_INDEXES)
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        return len(settlement_ids), len(street_ids), len(self.houses)
+
+
+def build_index_from_csv(csv_path, builder=None):
+    """
+    Адреса из CSV (например, выгрузка ФИАС/ГАР, дополненная координатами).
+    Столбцы: region, district, settlement, street, house, lat, lon (settlement_type - необязательно).
+    """
+    builder = builder or AddressIndexBuilder()
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                lat, lon = float(row["lat"]), float(row["lon"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            settlement_key = builder.add_settlement(
+                row.get("settlement", ""), None, None, row.get("settlement_type", ""),
+                row.get("district", ""), row.get("region", ""))
+            if settlement_key is None:
+                continue
+            if row.get("house"):
+                builder.add_house(settlement_key, row.get("street", ""), row["house"], lat, lon)
+            elif row.get("street"):
+                builder.add_street(settlement_key, row["street"], lat, lon)
+            else:
+                builder.add_settlement(row["settlement"], lat, lon, row.get("settlement_type", ""),
+                                       row.get("district", ""), row.get("region", ""))
+    return builder
+
+
+def build_index_from_osm(pbf_path, builder=None):
+    """Адреса из выгрузки OpenStreetMap (.osm.pbf): place=*, addr:* и названия улиц; нужен пакет osmium"""
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Для построения индекса из OSM установите пакет osmium: pip install osmium")
+
+    builder = builder or AddressIndexBuilder()
+    places, addresses, named_streets = [], [], []
+
+    class AddressHandler(osmium.SimpleHandler):
+        def _collect(self, tags, lat, lon):
+            if tags.get("place") in PLACE_TYPES and tags.get("name"):
+                places.append((tags["name"], tags["place"], lat, lon,
+                               tags.get("addr:district", ""), tags.get("addr:region", "")))
+            if tags.get("addr:housenumber"):
+                addresses.append((tags.get("addr:city") or tags.get("addr:place") or "",
+                                  tags.get("addr:street", ""), tags["addr:housenumber"],
+                                  tags.get("addr:district", ""), lat, lon))
+
+        def node(self, n):
+            if n.tags:
+                self._collect(n.tags, n.location.lat, n.location.lon)
+
+        def way(self, w):
+            points = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+            if not points:
+                return
+            lat, lon = np.mean(points, axis=0).tolist()
+            self._collect(w.tags, lat, lon)
+            if w.tags.get("highway") and w.tags.get("name"):
+                named_streets.append((w.tags["name"], lat, lon))
+
+    AddressHandler().apply_file(pbf_path, locations=True)
+
+    # Район населённого пункта - по тегам его домов, если у самого пункта его нет
+    districts = defaultdict(Counter)
+    for city, _, _, district, _, _ in addresses:
+        if city and district:
+            districts[normalize_name(city)][district] += 1
+
+    place_keys = []
+    for name, kind, lat, lon, district, region in places:
+        district = district or next(iter(districts[normalize_name(name)].most_common(1)), ("",))[0]
+        place_keys.append(builder.add_settlement(name, lat, lon, kind, district, region))
+    by_name = {}
+    for key in place_keys:
+        by_name.setdefault(key[0], key)
+
+    # Дома без addr:city и улицы - к ближайшему населённому пункту
+    index = SpatialIndex([p[2] for p in places], [p[3] for p in places]) if places else None
+
+    def nearest_place(lat, lon):
+        if index is None:
+            return None
+        position, _ = index.nearest(lat, lon, SETTLEMENT_RADIUS_KM)
+        return place_keys[position] if position is not None else None
+
+    for city, street, number, district, lat, lon in addresses:
+        key = by_name.get(normalize_name(city)) if city else None
+        if key is None and city:
+            key = builder.add_settlement(city, None, None, "", district)
+        if key is None:
+            key = nearest_place(lat, lon)
+        if key is not None:
+            builder.add_house(key, street, number, lat, lon)
+
+    for name, lat, lon in named_streets:
+        key = nearest_place(lat, lon)
+        if key is not None:
+            builder.add_street(key, name, lat, lon)
+    return builder
+
+
+class OfflineGeocoder:
+    """
+    Поиск адреса по локальному индексу: населённый пункт (с учётом района) →
+    улица → дом, названия сравниваются по триграммам.
+    """
+
+    def __init__(self, path, confident_score=CONFIDENT_SCORE):
+        self.path = path
+        self.confident_score = confident_score
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def _settlement_candidates(self, name):
+        """Населённые пункты с похожим названием: [(сходство, строка settlements)] по убыванию сходства"""
+        columns = "s.id, s.name, s.norm, s.district, s.district_norm, s.region, s.lat, s.lon"
+        rows = self._conn.execute(f"SELECT {columns} FROM settlements s WHERE s.norm = ?", (name,)).fetchall()
+        if not rows:
+            tris = list(trigrams(name))
+            placeholders = ",".join("?" * len(tris))
+            rare = [tri for tri, _ in self._conn.execute(
+                f"SELECT tri, n FROM trigram_counts WHERE tri IN ({placeholders}) ORDER BY n LIMIT ?",
+                tris + [FUZZY_TRIGRAMS])]
+            if not rare:
+                return []
+            placeholders = ",".join("?" * len(rare))
+            rows = self._conn.execute(f"""
+                SELECT {columns}
+                FROM settlement_trigrams t JOIN settlements s ON s.id = t.settlement_id
+                WHERE t.tri IN ({placeholders})
+                GROUP BY s.id ORDER BY COUNT(*) DESC LIMIT 200
+            """, rare).fetchall()
+        scored = [(similarity(name, row[2]), row) for row in rows]
+        scored = [item for item in scored if item[0] >= MIN_SIMILARITY]
+        scored.sort(key=lambda item: -item[0])
+        return scored[:SETTLEMENT_CANDIDATES]
+
+    def _best_street(self, settlement_id, name):
+        if not name:
+            # Адрес без улицы (addr:place) - дома населённого пункта без названия улицы
+            row = self._conn.execute(
+                "SELECT id, name, norm, lat, lon FROM streets WHERE settlement_id = ? AND norm = ''",
+                (settlement_id,)).fetchone()
+            return (1.0 if row is not None else 0.0), row
+        best = (0.0, None)
+        for row in self._conn.execute(
+                "SELECT id, name, norm, lat, lon FROM streets WHERE settlement_id = ?", (settlement_id,)):
+            score = similarity(name, row[2])
+            if score > best[0]:
+                best = (score, row)
+        return best
+
+    def _house(self, street_id, number):
+        """Дом по точному номеру, иначе - по номеру без литеры/корпуса"""
+        row = self._conn.execute(
+            "SELECT label, lat, lon FROM houses WHERE street_id = ? AND number = ?", (street_id, number)).fetchone()
+        if row is None:
+            base = re.match(r"\d+", number).group()
+            if base != number:
+                row = self._conn.execute(
+                    "SELECT label, lat, lon FROM houses WHERE street_id = ? AND number = ?",
+                    (street_id, base)).fetchone()
+        return row
+
+    def _best_match(self, address):
+        """(score, coords, labels, street_only) лучшего совпадения; street_only - дом не найден, центр улицы"""
+        parts = parse_address(address)
+        if not parts["settlement"]:
+            return 0.0, None, None, False
+
+        with self._lock:
+            best = (0.0, None, None, False)
+            for settlement_score, settlement in self._settlement_candidates(parts["settlement"]):
+                sid, s_name, _, district, district_norm, region, s_lat, s_lon = settlement
+                # Район в запросе - подтверждает или опровергает населённый пункт
+                if parts["district"]:
+                    settlement_score *= (0.5 + 0.5 * similarity(parts["district"], district_norm)
+                                         if district_norm else 0.95)
+
+                street_name = parts["street"] or ""
+                if parts["street"] is None and parts["house"] is None:
+                    candidate = (settlement_score, (s_lat, s_lon), [s_name, district, region], False)
+                else:
+                    street_score, street = self._best_street(sid, street_name)
+                    if street is None or street_score < MIN_SIMILARITY:
+                        continue
+                    score = 0.4 * settlement_score + 0.6 * street_score
+                    coords, labels = (street[3], street[4]), [street[1], s_name, district, region]
+                    house = self._house(street[0], parts["house"]) if parts["house"] else None
+                    if house is not None:
+                        coords = (house[1], house[2])
+                        labels.insert(0, f"д. {house[0]}")
+                    elif parts["house"]:
+                        # Дом не найден - координаты центра улицы, до дома могут быть километры:
+                        # такое совпадение не бывает уверенным
+                        score = min(score, self.confident_score) * 0.9
+                    candidate = (score, coords, labels, parts["house"] is not None and house is None)
+                if candidate[0] > best[0]:
+                    best = candidate
+        return best
+
+    def lookup(self, address):
+        """
+        Возвращает (coords, full_addr, score) лучшего совпадения или (None, None, 0.0).
+        Уверенным считается совпадение с score >= confident_score.
+        """
+        score, coords, labels, _ = self._best_match(address)
+        if coords is None:
+            return None, None, 0.0
+        return coords, ", ".join(label for label in labels if label), score
+
+    def geocode(self, address):
+        """
+        (coords, full_addr, confident): уверенное совпадение - confident=True; центр улицы, если дом
+        не найден в индексе, - confident=False (запасной вариант, когда Nominatim не нашёл адрес);
+        иначе (None, None, False)
+        """
+        score, coords, labels, street_only = self._best_match(address)
+        if coords is None or (score < self.confident_score and not street_only):
+            return None, None, False
+        return coords, ", ".join(label for label in labels if label), score >= self.confident_score
+
+
+_geocoders = {}
+_geocoders_lock = threading.Lock()
+
+
+def get_offline_geocoder(path=None):
+    """
+    Общий для всех сессий локальный геокодер.
+    Путь по умолчанию - из переменной окружения OFFLINE_GEOCODER_INDEX; None, если индекс не задан.
+    """
+    path = path or os.environ.get(OFFLINE_GEOCODER_ENV)
+    if not path or not os.path.exists(path):
+        return None
+    with _geocoders_lock:
+        if path not in _geocoders:
+            _geocoders[path] = OfflineGeocoder(path)
+        return _geocoders[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Построение локального адресного индекса для геокодирования")
+    parser.add_argument("sources", nargs="+", help="Выгрузки OSM (.osm.pbf) и/или CSV с адресами и координатами")
+    parser.add_argument("--output", required=True, help="Файл индекса (.sqlite)")
+    args = parser.parse_args(argv)
+
+    builder = AddressIndexBuilder()
+    for source in args.sources:
+        if source.lower().endswith(".csv"):
+            build_index_from_csv(source, builder)
+        else:
+            build_index_from_osm(source, builder)
+    settlements, streets, houses = builder.write(args.output)
+    print(f"Индекс сохранён: {args.output}; населённых пунктов {settlements}, улиц {streets}, домов {houses}",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+import os
+import sys
+import math
+import heapq
+import argparse
+import threading
+import numpy as np
+from spatial_utils import SpatialIndex, EARTH_RADIUS_KM
+
+# Путь к файлу графа дорог (.npz); если задан - маршруты строятся локально, без ORS
+OFFLINE_GRAPH_ENV = "OFFLINE_ROUTING_GRAPH"
+
+# Скорости по типам дорог (км/ч) для профиля driving-car
+HIGHWAY_SPEEDS = {
+    "motorway": 110, "motorway_link": 60,
+    "trunk": 90, "trunk_link": 50,
+    "primary": 70, "primary_link": 40,
+    "secondary": 60, "secondary_link": 40,
+    "tertiary": 50, "tertiary_link": 30,
+    "unclassified": 40, "residential": 30,
+    "living_street": 10, "service": 20,
+    "road": 30, "track": 15,
+}
+MAX_SPEED_MPS = max(HIGHWAY_SPEEDS.values()) / 3.6
+
+# Ограничения доступа, при которых дорога в граф не попадает
+NO_ACCESS = {"no", "private"}
+ONEWAY_FORWARD = {"yes", "true", "1"}
+
+# Как ORS: точка дальше этого расстояния от дорог считается недоступной
+MAX_SNAP_KM = 0.35
+
+PROFILE = "driving-car"
+
+
+class RoutingError(Exception):
+    """Маршрут не найден (точка вне графа дорог или нет связи)"""
+
+
+def _csr(keys, n, *columns):
+    """CSR-представление рёбер, сгруппированных по keys: (indptr, *колонки в порядке групп)"""
+    order = np.argsort(keys, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+    return (indptr,) + tuple(col[order] for col in columns)
+
+
+class RoadGraph:
+    """
+    Ориентированный граф дорог в CSR-массивах numpy.
+    Вес ребра - время проезда (с), дополнительно хранится длина (м).
+    Обратный граф нужен для поиска «многие к одному».
+    """
+
+    def __init__(self, lats, lons, src, dst, lengths, durations, routable=None):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        self.src, self.dst = src, dst
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.durations = np.asarray(durations, dtype=np.float32)
+        n = len(self.lats)
+
+        self._indptr, self._indices, self._weights, self._edge_lengths = _csr(
+            src, n, dst, self.durations, self.lengths)
+        self._rindptr, self._rindices, self._rweights, self._redge_lengths = _csr(
+            dst, n, src, self.durations, self.lengths)
+
+        # Границы списков смежности - списком Python: в цикле поиска это быстрее обращения к numpy
+        self._indptr_list = self._indptr.tolist()
+        self._rindptr_list = self._rindptr.tolist()
+
+        # Точки привязываются только к узлам основной связной части графа
+        if routable is None:
+            routable = self._largest_component()
+        self.routable = np.asarray(routable, dtype=bool)
+        nodes = np.flatnonzero(self.routable)
+        self._index = SpatialIndex(self.lats[nodes], self.lons[nodes], nodes)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _largest_component(self):
+        """Маска узлов крупнейшей слабо связной компоненты"""
+        n = len(self.lats)
+        labels = np.full(n, -1, dtype=np.int64)
+        indptr, indices = self._indptr, self._indices
+        rindptr, rindices = self._rindptr, self._rindices
+        best_label, best_size = -1, 0
+        for start in range(n):
+            if labels[start] >= 0:
+                continue
+            labels[start] = start
+            stack = [start]
+            size = 0
+            while stack:
+                u = stack.pop()
+                size += 1
+                neighbours = np.concatenate((indices[indptr[u]:indptr[u + 1]], rindices[rindptr[u]:rindptr[u + 1]]))
+                for v in neighbours[labels[neighbours] < 0].tolist():
+                    if labels[v] < 0:
+                        labels[v] = start
+                        stack.append(v)
+            if size > best_size:
+                best_label, best_size = start, size
+        return labels == best_label
+
+    def save(self, path):
+        np.savez_compressed(
+            path, lats=self.lats, lons=self.lons, src=self.src, dst=self.dst,
+            lengths=self.lengths, durations=self.durations, routable=self.routable
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["lats"], data["lons"], data["src"], data["dst"],
+                       data["lengths"], data["durations"], data["routable"])
+
+    def snap(self, lat, lon, max_km=MAX_SNAP_KM):
+        """Ближайший узел графа к точке (lat, lon)"""
+        node, _ = self._index.nearest(lat, lon, max_km)
+        if node is None:
+            raise RoutingError(f"Точка ({lat:.5f}, {lon:.5f}) дальше {max_km * 1000:.0f} м от дорог графа")
+        return int(node)
+
+    def shortest_path(self, source, target):
+        """
+        Быстрейший путь A* (эвристика - время по прямой на максимальной скорости).
+        Возвращает (узлы пути, длина м, время с).
+        """
+        if source == target:
+            return [source], 0.0, 0.0
+        indptr, indices = self._indptr_list, self._indices
+        weights, edge_lengths = self._weights, self._edge_lengths
+        # Эвристика считается только для узлов, попавших в очередь, и запоминается:
+        # расчёт по всем узлам графа дороже самого поиска
+        lats, lons = self.lats, self.lons
+        target_lat, target_lon = math.radians(lats[target]), math.radians(lons[target])
+        cos_target = math.cos(target_lat)
+        seconds_per_rad = 2 * EARTH_RADIUS_KM * 1000 / MAX_SPEED_MPS
+        h = {}
+
+        def heuristic(v):
+            value = h.get(v)
+            if value is None:
+                lat, lon = math.radians(lats[v]), math.radians(lons[v])
+                a = (math.sin((lat - target_lat) / 2) ** 2
+                     + cos_target * math.cos(lat) * math.sin((lon - target_lon) / 2) ** 2)
+                value = h[v] = seconds_per_rad * math.asin(math.sqrt(min(a, 1.0)))
+            return value
+
+        best = {source: 0.0}
+        length = {source: 0.0}
+        pred = {source: -1}
+        settled = set()
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            _, g, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in settled:
+                continue
+            settled.add(u)
+            start, end = indptr[u], indptr[u + 1]
+            for v, w, l in zip(indices[start:end].tolist(), weights[start:end].tolist(),
+                               edge_lengths[start:end].tolist()):
+                ng = g + w
+                if ng < best.get(v, float("inf")):
+                    best[v] = ng
+                    length[v] = length[u] + l
+                    pred[v] = u
+                    heapq.heappush(heap, (ng + heuristic(v), ng, v))
+        else:
+            raise RoutingError("Между точками нет пути по дорогам графа")
+
+        path = [target]
+        while pred[path[-1]] >= 0:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return path, length[target], best[target]
+
+    def costs_to(self, target, sources):
+        """
+        «Многие к одному»: один поиск Дейкстры от target по обратному графу.
+        Возвращает {source: (длина м, время с)} для достижимых источников.
+        """
+        remaining = set(sources)
+        result = {}
+        indptr, indices = self._rindptr_list, self._rindices
+        weights, edge_lengths = self._rweights, self._redge_lengths
+
+        best = {target: 0.0}
+        length = {target: 0.0}
+        settled = set()
+        heap = [(0.0, target)]
+        while heap and remaining:
+            g, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if u in remaining:
+                remaining.discard(u)
+                result[u] = (length[u], g)
+            start, end = indptr[u], indptr[u + 1]
+            for v, w, l in zip(indices[start:end].tolist(), weights[start:end].tolist(),
+                               edge_lengths[start:end].tolist()):
+                ng = g + w
+                if ng < best.get(v, float("inf")):
+                    best[v] = ng
+                    length[v] = length[u] + l
+                    heapq.heappush(heap, (ng, v))
+        return result
+
+
+def build_graph_from_osm(pbf_path):
+    """Граф дорог для автомобиля из выгрузки OpenStreetMap (.osm.pbf); нужен пакет osmium"""
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Для построения графа из OSM установите пакет osmium: pip install osmium")
+
+    class WayHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.node_ids = {}
+            self.lats, self.lons = [], []
+            self.src, self.dst, self.speeds = [], [], []
+
+        def _node(self, node):
+            idx = self.node_ids.get(node.ref)
+            if idx is None:
+                idx = self.node_ids[node.ref] = len(self.lats)
+                self.lats.append(node.lat)
+                self.lons.append(node.lon)
+            return idx
+
+        def way(self, w):
+            tags = w.tags
+            speed = HIGHWAY_SPEEDS.get(tags.get("highway"))
+            if speed is None or tags.get("access") in NO_ACCESS or tags.get("motor_vehicle") in NO_ACCESS:
+                return
+            maxspeed = tags.get("maxspeed", "")
+            if maxspeed.isdigit():
+                speed = min(speed, int(maxspeed))
+            oneway = tags.get("oneway", "")
+            forward = oneway != "-1"
+            backward = not (oneway in ONEWAY_FORWARD or tags.get("highway") == "motorway"
+                            or tags.get("junction") == "roundabout") or oneway == "-1"
+
+            nodes = [self._node(n) for n in w.nodes if n.location.valid()]
+            for a, b in zip(nodes, nodes[1:]):
+                if forward:
+                    self.src.append(a)
+                    self.dst.append(b)
+                    self.speeds.append(speed)
+                if backward:
+                    self.src.append(b)
+                    self.dst.append(a)
+                    self.speeds.append(speed)
+
+    handler = WayHandler()
+    handler.apply_file(pbf_path, locations=True)
+
+    lats = np.asarray(handler.lats, dtype=np.float64)
+    lons = np.asarray(handler.lons, dtype=np.float64)
+    src = np.asarray(handler.src, dtype=np.int32)
+    dst = np.asarray(handler.dst, dtype=np.int32)
+    # Длины рёбер по формуле гаверсинусов (м)
+    lat1, lon1, lat2, lon2 = map(np.radians, (lats[src], lons[src], lats[dst], lons[dst]))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    lengths = 2 * EARTH_RADIUS_KM * 1000 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    durations = lengths / (np.asarray(handler.speeds, dtype=np.float64) / 3.6)
+    return RoadGraph(lats, lons, src, dst, lengths, durations)
+
+
+class OfflineRoutingClient:
+    """
+    Локальная замена openrouteservice.Client по локальному графу дорог.
+    Методы directions и distance_matrix принимают те же аргументы и возвращают
+    ответы того же формата (координаты [lon, lat], расстояния в метрах).
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def _route(self, coordinates):
+        nodes = [self.graph.snap(lat, lon) for lon, lat in coordinates]
+        path, distance, duration = [nodes[0]], 0.0, 0.0
+        for a, b in zip(nodes, nodes[1:]):
+            leg, leg_distance, leg_duration = self.graph.shortest_path(a, b)
+            path.extend(leg[1:])
+            distance += leg_distance
+            duration += leg_duration
+        return path, distance, duration
+
+    def directions(self, coordinates, profile=PROFILE, format="geojson", **kwargs):
+        path, distance, duration = self._route(coordinates)
+        geometry = {
+            "type": "LineString",
+            "coordinates": [[lon, lat] for lat, lon in zip(self.graph.lats[path].tolist(),
+                                                           self.graph.lons[path].tolist())]
+        }
+        return {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {
+                    "segments": [{"distance": round(distance, 1), "duration": round(duration, 1)}],
+                    "summary": {"distance": round(distance, 1), "duration": round(duration, 1)}
+                }
+            }]
+        }
+
+    def distance_matrix(self, locations, profile=PROFILE, sources=None, destinations=None,
+                        metrics=None, **kwargs):
+        sources = list(range(len(locations))) if sources is None else list(sources)
+        destinations = list(range(len(locations))) if destinations is None else list(destinations)
+        metrics = metrics or ["duration"]
+
+        def snap_or_none(location):
+            try:
+                return self.graph.snap(location[1], location[0])
+            except RoutingError:
+                return None
+
+        source_nodes = [snap_or_none(locations[i]) for i in sources]
+        distances = [[None] * len(destinations) for _ in sources]
+        durations = [[None] * len(destinations) for _ in sources]
+        for j, dest in enumerate(destinations):
+            dest_node = snap_or_none(locations[dest])
+            if dest_node is None:
+                continue
+            # Один обратный поиск на каждое назначение - сразу для всех источников
+            costs = self.graph.costs_to(dest_node, [n for n in source_nodes if n is not None])
+            for i, node in enumerate(source_nodes):
+                if node in costs:
+                    distances[i][j] = round(costs[node][0], 1)
+                    durations[i][j] = round(costs[node][1], 1)
+
+        result = {}
+        if "distance" in metrics:
+            result["distances"] = distances
+        if "duration" in metrics:
+            result["durations"] = durations
+        return result
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_offline_router(path=None):
+    """
+    Общий для всех сессий локальный маршрутизатор (граф загружается один раз).
+    Путь по умолчанию - из переменной окружения OFFLINE_ROUTING_GRAPH; None, если граф не задан.
+    """
+    path = path or os.environ.get(OFFLINE_GRAPH_ENV)
+    if not path or not os.path.exists(path):
+        return None
+    with _routers_lock:
+        if path not in _routers:
+            _routers[path] = OfflineRoutingClient(RoadGraph.load(path))
+        return _routers[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Построение графа дорог для локальной маршрутизации")
+    parser.add_argument("pbf", help="Выгрузка OpenStreetMap (.osm.pbf), например kaliningrad-latest.osm.pbf")
+    parser.add_argument("output", help="Файл графа (.npz)")
+    args = parser.parse_args(argv)
+
+    graph = build_graph_from_osm(args.pbf)
+    graph.save(args.output)
+    print(f"Граф сохранён: {args.output}; узлов {len(graph)}, рёбер {len(graph.src)}, "
+          f"в основной компоненте {int(graph.routable.sum())}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
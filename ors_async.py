@@ -0,0 +1,184 @@
+import os
+import json
+import queue
+import atexit
+import asyncio
+import threading
+import aiohttp
+from api_limits import TokenBucket, get_api_guard
+from timing_utils import get_api_timings
+
+# Адрес ORS; для проверок без квоты - локальная заглушка (geo_stub_server.py)
+ORS_BASE_URL = os.environ.get("ORS_BASE_URL", "https://api.openrouteservice.org")
+PROFILE = "driving-car"
+
+# Бесплатный план ORS: 40 запросов маршрутов в минуту
+ORS_DIRECTIONS_PER_MINUTE = 40
+# Одновременных запросов (и соединений keep-alive в пуле)
+ROUTE_WORKERS = 4
+
+ORS_TIMEOUT = 60
+KEEPALIVE_SECONDS = 60
+MAX_ATTEMPTS = 3
+# Статусы, при которых запрос повторяется: превышение лимита и временная недоступность
+RETRY_STATUSES = {429, 502, 503, 504}
+# Коды ошибок ORS, при которых маршрут между точками невозможен (повтор бесполезен):
+# 2004 - превышен лимит расстояния, 2009 - маршрут не найден, 2010 - точка далеко от дорог
+UNROUTABLE_CODES = {2004, 2009, 2010}
+
+
+class ORSRequestError(Exception):
+    """Ошибка ответа ORS: HTTP-статус и тело ответа"""
+
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+def ors_error_code(error):
+    """Код ошибки ORS из ответа сервера (ORSRequestError или openrouteservice ApiError) или None"""
+    body = getattr(error, "body", None)
+    if body is None:
+        body = getattr(error, "message", None)
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return None
+    if isinstance(body, dict) and isinstance(body.get("error"), dict):
+        return body["error"].get("code")
+    return None
+
+
+class AsyncORSClient:
+    """
+    Асинхронный клиент ORS Directions: одна сессия aiohttp с пулом keep-alive соединений,
+    не более concurrency одновременных запросов и общий лимит частоты.
+    Каждая попытка проходит через guard (суточная квота и предохранитель), если он задан.
+    """
+
+    def __init__(self, api_key, base_url=ORS_BASE_URL, rate_per_minute=ORS_DIRECTIONS_PER_MINUTE,
+                 concurrency=ROUTE_WORKERS, timeout=ORS_TIMEOUT, guard=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate_per_minute / 60.0)
+        self.guard = guard
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=KEEPALIVE_SECONDS),
+                headers={"Authorization": self.api_key},
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def directions(self, origin, destination, profile=PROFILE):
+        """Маршрут между точками (lat, lon): ответ ORS в формате GeoJSON"""
+        url = f"{self.base_url}/v2/directions/{profile}/geojson"
+        body = {"coordinates": [[origin[1], origin[0]], [destination[1], destination[0]]]}
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if self.guard is not None:
+                # Квота исчерпана или предохранитель разомкнут - ошибка сразу, без ожидания и запроса
+                self.guard.check()
+            with get_api_timings().span("ORS: ожидание лимита"):
+                await self.limiter.acquire_async()
+            retry_after = None
+            try:
+                with get_api_timings().span("ORS: directions (async)", api="ORS"):
+                    async with self._get_session().post(url, json=body) as response:
+                        if response.status == 200:
+                            result = await response.json(content_type=None)
+                            if self.guard is not None:
+                                self.guard.record()
+                            return result
+                        error = ORSRequestError(response.status, await response.text())
+                        retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if self.guard is not None:
+                self.guard.record(error)
+            if isinstance(error, ORSRequestError) and error.status not in RETRY_STATUSES or attempt == MAX_ATTEMPTS:
+                raise error
+            await asyncio.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+
+    async def route_many(self, pairs, profile=PROFILE, on_result=None):
+        """
+        Маршруты для списка пар (откуда, куда) параллельно.
+        Возвращает ответы ORS или исключения в порядке pairs; on_result(номер, результат) - по мере готовности.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def route_one(i, pair):
+            async with semaphore:
+                try:
+                    result = await self.directions(pair[0], pair[1], profile)
+                except Exception as e:
+                    result = e
+            if on_result is not None:
+                on_result(i, result)
+            return result
+
+        return await asyncio.gather(*(route_one(i, pair) for i, pair in enumerate(pairs)))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    """Фоновый цикл событий: сессии aiohttp и их соединения живут между перезапусками скрипта"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="ors-async", daemon=True).start()
+    return _loop
+
+
+def iter_routes(client, pairs, profile=PROFILE):
+    """
+    Синхронный обход результатов route_many по мере готовности: (номер пары, ответ или исключение).
+    Результаты обрабатываются в вызывающем потоке (например, в потоке скрипта Streamlit).
+    """
+    results = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        client.route_many(pairs, profile, lambda i, result: results.put((i, result))), _event_loop()
+    )
+    for _ in range(len(pairs)):
+        yield results.get()
+    future.result()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_async_ors_client(api_key, rate_per_minute=ORS_DIRECTIONS_PER_MINUTE, concurrency=ROUTE_WORKERS):
+    """Общий для всех сессий клиент на ключ: пул соединений и лимит частоты не пересоздаются"""
+    key = (api_key, rate_per_minute, concurrency)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = AsyncORSClient(api_key, rate_per_minute=rate_per_minute, concurrency=concurrency,
+                                           guard=get_api_guard("ors"))
+        return _clients[key]
+
+
+@atexit.register
+def _close_clients():
+    """Закрывает сессии aiohttp при завершении процесса"""
+    if _loop is None:
+        return
+    for client in list(_clients.values()):
+        try:
+            asyncio.run_coroutine_threadsafe(client.close(), _loop).result(timeout=5)
+        except Exception:
+            pass
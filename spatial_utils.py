@@ -0,0 +1,169 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Размер ячейки сетки индекса в градусах (~11 км по широте)
+GRID_CELL_DEG = 0.1
+
+# Упрощение маршрутов: метров на пиксель на экваторе при zoom 0 (Web Mercator)
+METERS_PER_PIXEL_Z0 = 156543.03392
+# Допуск для хранения маршрута в сессии (практически без потерь)
+SESSION_ROUTE_TOLERANCE_M = 1.0
+# Насколько уровней приближения сверх начального карта остаётся точной
+DISPLAY_ZOOM_MARGIN = 3
+# Уровень детализации маршрутов в экспортируемой HTML-карте
+EXPORT_ROUTE_ZOOM = 15
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Расстояние по прямой (км) от точки (lat, lon) до массивов точек lats/lons"""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def tolerance_for_zoom(zoom, latitude, pixels=1.0):
+    """Допуск упрощения (м), невидимый на карте при данном уровне приближения"""
+    return pixels * METERS_PER_PIXEL_Z0 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def simplify_route(route_coords, tolerance_m):
+    """
+    Упрощение линии маршрута алгоритмом Дугласа-Пекера.
+    route_coords: список (lat, lon); tolerance_m - допустимое отклонение в метрах.
+    Возвращает список (lat, lon) с сохранёнными первой и последней точками.
+    """
+    if not route_coords or len(route_coords) < 3 or tolerance_m <= 0:
+        return route_coords
+
+    points = np.asarray(route_coords, dtype=np.float64)
+    # Локальная равнопромежуточная проекция в метрах - для длины маршрутов внутри региона достаточно
+    cos_lat = math.cos(math.radians(points[:, 0].mean()))
+    y = np.radians(points[:, 0]) * EARTH_RADIUS_KM * 1000
+    x = np.radians(points[:, 1]) * EARTH_RADIUS_KM * 1000 * cos_lat
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        px, py = x[start + 1:end], y[start + 1:end]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            distances = np.hypot(px - x[start], py - y[start])
+        else:
+            # Расстояние до отрезка (а не до бесконечной прямой)
+            t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length_sq, 0.0, 1.0)
+            distances = np.hypot(px - (x[start] + t * dx), py - (y[start] + t * dy))
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance_m:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return [tuple(p) for p in points[keep].tolist()]
+
+
+class SpatialIndex:
+    """
+    Сеточный пространственный индекс по координатам поставщиков.
+    Точки отсортированы по ключу ячейки, поиск ячеек - бинарный (np.searchsorted).
+    Результаты запросов - позиции точек в исходных массивах (для DataFrame.iloc).
+    """
+
+    def __init__(self, lats, lons, positions=None, cell_deg=GRID_CELL_DEG):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if positions is None:
+            positions = np.arange(len(lats))
+        self.cell_deg = cell_deg
+        self._cols = int(360 / cell_deg) + 2
+
+        keys = self._cell_keys(lats, lons)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.positions = np.asarray(positions)[order]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _cell_rows_cols(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_deg).astype(np.int64)
+        cols = np.floor((np.asarray(lons) + 180) / self.cell_deg).astype(np.int64)
+        return rows, cols
+
+    def _cell_keys(self, lats, lons):
+        rows, cols = self._cell_rows_cols(lats, lons)
+        return rows * self._cols + cols
+
+    def _candidates(self, row_min, row_max, col_min, col_max):
+        """Индексы точек (в отсортированных массивах) из прямоугольника ячеек"""
+        col_min = max(col_min, 0)
+        col_max = min(col_max, self._cols - 1)
+        rows = np.arange(max(row_min, 0), row_max + 1, dtype=np.int64)
+        starts = np.searchsorted(self._keys, rows * self._cols + col_min, side="left")
+        ends = np.searchsorted(self._keys, rows * self._cols + col_max, side="right")
+        if len(starts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+
+    def query_radius(self, lat, lon, radius_km):
+        """Все точки в радиусе radius_km: (позиции, расстояния), по возрастанию расстояния"""
+        if len(self) == 0:
+            return np.empty(0, dtype=self.positions.dtype), np.empty(0)
+        dlat = radius_km / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+        dlon = min(radius_km / (KM_PER_DEGREE * cos_lat), 180)
+        row_min, col_min = self._cell_rows_cols(lat - dlat, lon - dlon)
+        row_max, col_max = self._cell_rows_cols(lat + dlat, lon + dlon)
+
+        idx = self._candidates(int(row_min), int(row_max), int(col_min), int(col_max))
+        distances = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        inside = distances <= radius_km
+        idx, distances = idx[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return self.positions[idx[order]], distances[order]
+
+    def k_nearest(self, lat, lon, k, max_km=float("inf")):
+        """k ближайших точек (не дальше max_km): (позиции, расстояния)"""
+        if len(self) == 0 or k <= 0:
+            return np.empty(0, dtype=self.positions.dtype), np.empty(0)
+        row, col = self._cell_rows_cols(lat, lon)
+        row, col = int(row), int(col)
+        max_rings = int(180 / self.cell_deg) + 1
+
+        # Расширяем кольцо ячеек, пока k-я найденная точка не окажется ближе
+        # любой точки за пределами просмотренного квадрата
+        ring = 0
+        while True:
+            idx = self._candidates(row - ring, row + ring, col - ring, col + ring)
+            distances = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+            edge_lat = min(abs(lat) + (ring + 1) * self.cell_deg, 89.9)
+            bound_km = ring * self.cell_deg * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+            enough = len(idx) >= k and np.partition(distances, k - 1)[k - 1] <= bound_km
+            if enough or len(idx) == len(self) or bound_km >= max_km or ring >= max_rings:
+                break
+            ring = max(1, ring * 2)
+
+        inside = distances <= max_km
+        idx, distances = idx[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")[:k]
+        return self.positions[idx[order]], distances[order]
+
+    def nearest(self, lat, lon, max_km=float("inf")):
+        """Ближайшая точка: (позиция, расстояние) или (None, None), если в радиусе никого нет"""
+        positions, distances = self.k_nearest(lat, lon, 1, max_km)
+        if len(positions) == 0:
+            return None, None
+        return positions[0], float(distances[0])
@@ -4,29 +4,66 @@ from streamlit_folium import st_folium
 import pandas as pd
 from PIL import Image
 import os
+import time
 
 # Импортируем наши модули
 from utils import (
     log_error, log_info, log_warning, log_api_error, 
-    geocode_address_cached, init_ors_client, get_route_ors,
+    geocode_address_cached, init_ors_client, get_route_ors, make_delivery_record,
     MATERIAL_COLORS, AVAILABLE_COLORS, MATERIALS
 )
-from export_utils import export_to_excel, save_map_screenshot
+from export_utils import (
+    get_excel_export, map_html_file, geojson_bytes,
+    DELIVERY_COLUMNS, EXCEL_FILE_NAME, XLSX_MIME, ROUTES_FILE_NAME
+)
 from debug_ui import display_debug_sidebar, display_error_stats
+from spatial_utils import (
+    simplify_route, tolerance_for_zoom,
+    SESSION_ROUTE_TOLERANCE_M, DISPLAY_ZOOM_MARGIN, EXPORT_ROUTE_ZOOM
+)
+from import_utils import iter_supplier_rows, validate_rows, geocode_rows, route_rows, build_records, parse_coords
+from map_utils import (
+    MapCache, fingerprint, build_object_map, delivery_objects, delivery_layer_inputs, build_delivery_layer,
+    build_delivery_export
+)
+from haul_utils import HaulEngine
+from event_log import EventLog
+from timing_utils import StageTimings, timed, timed_builder
+from transport_problem import (
+    assign_suppliers, plan_routes, plan_records, candidates_from_records, TransportProblemError
+)
 
 # --- Настройка страницы ---
 st.set_page_config(layout="wide", page_title="Транспортная схема доставки", page_icon="🚚")
+rerun_started = time.perf_counter()
 
 # --- Инициализация сессии ---
 if 'delivery_data' not in st.session_state:
     st.session_state.delivery_data = []
 
-if 'geocode_cache' not in st.session_state:
-    st.session_state.geocode_cache = {}
-
 # Инициализация лога ошибок
 if 'error_log' not in st.session_state:
-    st.session_state.error_log = []
+    st.session_state.error_log = EventLog()
+
+# Длительности этапов (перцентили в панели отладки)
+if 'timings' not in st.session_state:
+    st.session_state.timings = StageTimings()
+
+# Готовый Excel-файл ведомости (формируется по запросу)
+if 'excel_export' not in st.session_state:
+    st.session_state.excel_export = None
+
+# Собранная карта и её слои между перезапусками скрипта
+if 'map_cache' not in st.session_state:
+    st.session_state.map_cache = MapCache()
+
+# Средняя дальность возки и сводка по материалам (пересчитываются только при изменении строк)
+if 'haul_engine' not in st.session_state:
+    st.session_state.haul_engine = HaulEngine()
+
+# Поставщики-кандидаты с мощностями для распределения по объектам
+if 'supplier_candidates' not in st.session_state:
+    st.session_state.supplier_candidates = []
 
 if 'debug_mode' not in st.session_state:
     st.session_state.debug_mode = False
@@ -48,6 +85,35 @@ if 'ors_api_key' not in st.session_state:
 # Получаем клиент ORS если API-ключ уже установлен
 ors_client = init_ors_client(st.session_state)
 
+# --- Координаты объекта ---
+def resolve_object_location(use_object_coords, obj_coord_input, object_address):
+    """Координаты и адрес объекта из полей ввода; при ошибке выполнение скрипта останавливается"""
+    if use_object_coords:
+        try:
+            lat, lon = map(float, [x.strip() for x in obj_coord_input.split(",")])
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                obj_coords = (lat, lon)
+                obj_full_addr = f"Координаты: {lat:.5f}, {lon:.5f}"
+                log_info(st.session_state, f"Введены координаты объекта вручную: {obj_coords}")
+            else:
+                error_msg = "Координаты объекта вне допустимого диапазона."
+                log_error(st.session_state, error_msg)
+                st.error(error_msg)
+                st.stop()
+        except Exception as e:
+            error_msg = "Некорректный формат координат объекта"
+            log_error(st.session_state, error_msg, details=str(e))
+            st.error("Введите корректные координаты объекта: например, 54.7100, 20.4800")
+            st.stop()
+    else:
+        obj_coords, obj_full_addr = geocode_address_cached(st.session_state, object_address)
+        if obj_coords is None:
+            error_msg = f"Не удалось определить координаты объекта: {object_address}"
+            log_error(st.session_state, error_msg)
+            st.error("Не удалось определить координаты объекта. Проверьте адрес или введите координаты вручную.")
+            st.stop()
+    return obj_coords, obj_full_addr
+
 # --- Интерфейс ---
 st.title("🚚 Транспортная схема доставки материалов")
 
@@ -102,7 +168,8 @@ with st.expander("📘 Инструкция по использованию"):
     """)
 
 # --- Запрос API-ключа, если не установлен ---
-if not st.session_state.ors_api_key:
+# С локальным графом дорог ключ не нужен
+if not st.session_state.ors_api_key and ors_client is None:
     st.warning("⚠️ Для работы приложения необходим API-ключ OpenRouteService")
 
     with st.form("api_key_form"):
@@ -187,6 +254,7 @@ if st.session_state.page == "manual":
     with col2:
         st.subheader("📍 Адрес объекта (место размещения)")
         use_object_coords = st.checkbox("Ввести координаты объекта вручную")
+        obj_coord_input, object_address = "", ""
         if use_object_coords:
             obj_coord_input = st.text_input("Координаты объекта (широта, долгота)", "")
         else:
@@ -197,33 +265,11 @@ if st.session_state.page == "manual":
 
     # --- Кнопка добавления ---
     if st.button("➕ Добавить поставщика"):
+        add_started = time.perf_counter()
         log_info(st.session_state, "Начало процесса добавления поставщика")
 
         # Геокодирование объекта
-        if use_object_coords:
-            try:
-                lat, lon = map(float, [x.strip() for x in obj_coord_input.split(",")])
-                if -90 <= lat <= 90 and -180 <= lon <= 180:
-                    obj_coords = (lat, lon)
-                    obj_full_addr = f"Координаты: {lat:.5f}, {lon:.5f}"
-                    log_info(st.session_state, f"Введены координаты объекта вручную: {obj_coords}")
-                else:
-                    error_msg = "Координаты объекта вне допустимого диапазона."
-                    log_error(st.session_state, error_msg)
-                    st.error(error_msg)
-                    st.stop()
-            except Exception as e:
-                error_msg = "Некорректный формат координат объекта"
-                log_error(st.session_state, error_msg, details=str(e))
-                st.error("Введите корректные координаты объекта: например, 54.7100, 20.4800")
-                st.stop()
-        else:
-            obj_coords, obj_full_addr = geocode_address_cached(st.session_state, object_address)
-            if obj_coords is None:
-                error_msg = f"Не удалось определить координаты объекта: {object_address}"
-                log_error(st.session_state, error_msg)
-                st.error("Не удалось определить координаты объекта. Проверьте адрес или введите координаты вручную.")
-                st.stop()
+        obj_coords, obj_full_addr = resolve_object_location(use_object_coords, obj_coord_input, object_address)
 
         # Геокодирование поставщика
         use_supplier_coords = st.checkbox("Ввести координаты поставщика вручную", key="supp_coords")
@@ -256,27 +302,15 @@ if st.session_state.page == "manual":
         # Расчёт маршрута по дорогам
         log_info(st.session_state, "Начало расчёта маршрута")
         route_coords, road_distance = get_route_ors(st.session_state, ors_client, sup_coords, obj_coords)
+        # В сессии храним упрощённую геометрию, полная остаётся в кэше маршрутов
+        route_coords = simplify_route(route_coords, SESSION_ROUTE_TOLERANCE_M)
 
         # Сохранение
         idx = len(st.session_state.delivery_data) + 1
-        st.session_state.delivery_data.append({
-            "№ п/п": idx,
-            "Наименование материала": material,
-            "% от общей потребности": 100,
-            "Вид работ": work_type,
-            "Наименование поставщика": supplier_name,
-            "Адрес": sup_full_addr,
-            "Вид \"франко\" для данного материала": "-",
-            "Железнодорожные перевозки %": "-",
-            "Станции назначения, на которую прибывает материал": obj_full_addr,
-            "Расстояние перевозки, км": road_distance,
-            "Автомобильные перевозки %": 100,
-            "Средняя дальность возки, км": road_distance,
-            "Цвет": selected_color,
-            "supplier_coords": sup_coords,
-            "object_coords": obj_coords,
-            "route_coords": route_coords
-        })
+        st.session_state.delivery_data.append(make_delivery_record(
+            idx, material, work_type, supplier_name, sup_full_addr, obj_full_addr,
+            road_distance, selected_color, sup_coords, obj_coords, route_coords
+        ))
 
         log_info(st.session_state, f"Поставщик добавлен успешно: {supplier_name}, расстояние: {road_distance} км")
 
@@ -284,34 +318,159 @@ if st.session_state.page == "manual":
         if route_coords:
             success_msg += f"по дорогам: {road_distance} км"
         else:
-            success_msg += f"по прямой: {road_distance} км (маршрут по дорогам недоступен)"
+            success_msg += f"по оценке: {road_distance} км (маршрут по дорогам недоступен, расчёт по прямой с учётом извилистости дорог)"
 
         st.success(success_msg)
+        st.session_state.timings.record("Добавление поставщика (всего)", time.perf_counter() - add_started)
+
+    # --- Импорт поставщиков из файла ---
+    with st.expander("📥 Импорт поставщиков из Excel/CSV"):
+        st.markdown(
+            "Обязательные столбцы: **Наименование поставщика** и **Адрес** или **Координаты** "
+            "(широта, долгота). Необязательные: **Наименование материала**, **Вид работ**, **Цвет**. "
+            "Объект берётся из полей «Адрес объекта» выше."
+        )
+        uploaded_file = st.file_uploader("Файл поставщиков", type=["xlsx", "csv"], key="import_file")
+
+        if uploaded_file is not None and st.button("📥 Импортировать поставщиков"):
+            log_info(st.session_state, f"Импорт поставщиков из файла: {uploaded_file.name}")
+            try:
+                supplier_rows, import_errors = validate_rows(iter_supplier_rows(uploaded_file, uploaded_file.name))
+            except Exception as e:
+                log_error(st.session_state, f"Ошибка чтения файла {uploaded_file.name}", details=str(e))
+                st.error(f"❌ Не удалось прочитать файл: {str(e)}")
+                st.stop()
+
+            if import_errors:
+                log_warning(st.session_state, f"Пропущено строк с ошибками: {len(import_errors)}")
+                st.warning(f"⚠️ Пропущено строк с ошибками: {len(import_errors)}")
+                st.dataframe(
+                    pd.DataFrame(import_errors, columns=["Строка", "Ошибка"]),
+                    use_container_width=True, hide_index=True
+                )
+            if not supplier_rows:
+                st.error("❌ В файле нет строк для импорта")
+                st.stop()
+
+            obj_coords, obj_full_addr = resolve_object_location(use_object_coords, obj_coord_input, object_address)
+
+            # Геокодирование и маршруты - одним пакетом, с дедупликацией и лимитами API
+            progress_bar = st.progress(0.0, text="Геокодирование адресов...")
+            geocode_rows(st.session_state, supplier_rows, lambda done, total, address, coords: progress_bar.progress(
+                done / total * 0.5, text=f"Геокодирование: {done}/{total}"
+            ))
+            route_rows(st.session_state, ors_client, supplier_rows, obj_coords, on_progress=lambda done, total, row: (
+                progress_bar.progress(0.5 + done / total * 0.5, text=f"Маршруты: {done}/{total}")
+            ))
+            progress_bar.empty()
+
+            for row in supplier_rows:
+                # В сессии храним упрощённую геометрию, полная остаётся в кэше маршрутов
+                row["route_coords"] = simplify_route(row.get("route_coords"), SESSION_ROUTE_TOLERANCE_M)
+            records = build_records(
+                supplier_rows, obj_coords, obj_full_addr, start_idx=len(st.session_state.delivery_data) + 1
+            )
+            st.session_state.delivery_data.extend(records)
+
+            not_found = len(supplier_rows) - len(records)
+            log_info(st.session_state, f"Импортировано поставщиков: {len(records)}, без координат: {not_found}")
+            st.success(f"✅ Импортировано поставщиков: {len(records)}")
+            if not_found:
+                st.warning(f"⚠️ Не удалось определить координаты для {not_found} поставщиков")
+
+    # --- Распределение поставщиков по нескольким объектам ---
+    with st.expander("🏗️ Распределение поставщиков по объектам"):
+        candidates = candidates_from_records(st.session_state.delivery_data, st.session_state.supplier_candidates)
+        if not candidates:
+            st.info("Добавьте поставщиков-кандидатов вручную или импортом из файла.")
+        else:
+            st.markdown(
+                "Объёмы каждого материала распределяются между поставщиками так, чтобы суммарная "
+                "транспортная работа (объём × км по дорогам) была минимальной. Пустая мощность - без ограничения. "
+                "Ведомость заменяется рассчитанным распределением."
+            )
+            suppliers_df = st.data_editor(
+                pd.DataFrame({
+                    "Наименование поставщика": [c["name"] for c in candidates],
+                    "Наименование материала": [c["material"] for c in candidates],
+                    "Адрес": [c["address"] for c in candidates],
+                    "Мощность": [c["capacity"] for c in candidates],
+                }, dtype=object).astype({"Мощность": float}),
+                disabled=["Наименование поставщика", "Наименование материала", "Адрес"],
+                hide_index=True, use_container_width=True, key="assign_suppliers"
+            )
+            sites_df = st.data_editor(
+                pd.DataFrame({"Объект": ["Объект 1"], "Адрес или координаты": [object_address or obj_coord_input]}),
+                num_rows="dynamic", hide_index=True, use_container_width=True, key="assign_sites"
+            )
+            sites_df = sites_df.dropna(subset=["Адрес или координаты"])
+            site_names = [str(name) if pd.notna(name) and name else f"Объект {i}"
+                          for i, name in enumerate(sites_df["Объект"], 1)]
+            materials = list(dict.fromkeys(c["material"] for c in candidates))
+            st.caption("Потребность объектов в материалах (в единицах мощности поставщиков)")
+            demand_df = st.data_editor(
+                pd.DataFrame(0.0, index=site_names, columns=materials),
+                use_container_width=True, key=f"assign_demand_{fingerprint(site_names, materials)}"
+            )
+
+            if st.button("🧮 Рассчитать распределение"):
+                log_info(st.session_state, f"Распределение поставщиков: {len(candidates)} кандидатов, "
+                                           f"{len(site_names)} объектов")
+                for candidate, capacity in zip(candidates, suppliers_df["Мощность"]):
+                    candidate["capacity"] = None if pd.isna(capacity) else float(capacity)
+
+                sites = []
+                for name, location in zip(site_names, sites_df["Адрес или координаты"]):
+                    coords = parse_coords(location)
+                    full_addr = f"Координаты: {coords[0]:.5f}, {coords[1]:.5f}" if coords else None
+                    if coords is None:
+                        coords, full_addr = geocode_address_cached(st.session_state, str(location))
+                    if coords is None:
+                        log_error(st.session_state, f"Не удалось определить координаты объекта: {location}")
+                        st.error(f"❌ Не удалось определить координаты объекта «{name}»: {location}")
+                        st.stop()
+                    sites.append({"name": name, "address": full_addr, "coords": coords})
+
+                demands = {
+                    (j, material): float(demand_df.iloc[j][material])
+                    for j in range(len(sites)) for material in materials
+                    if pd.notna(demand_df.iloc[j][material]) and demand_df.iloc[j][material] > 0
+                }
+                if not demands:
+                    st.error("❌ Укажите потребность хотя бы одного объекта")
+                    st.stop()
+
+                with st.spinner("Расчёт матрицы расстояний и распределения..."):
+                    try:
+                        plan, distances, _ = assign_suppliers(st.session_state, ors_client, candidates, sites, demands)
+                    except TransportProblemError as e:
+                        log_warning(st.session_state, f"Распределение невозможно: {e}")
+                        st.error(f"❌ {e}")
+                        st.stop()
+                    routes = plan_routes(st.session_state, ors_client, plan, candidates, sites)
+
+                st.session_state.supplier_candidates = candidates
+                st.session_state.delivery_data = plan_records(plan, candidates, sites, demands, distances, routes)
+                st.success(f"✅ Распределение рассчитано: поставок в ведомости - {len(plan)}")
 
 # --- Отображение результатов ---
 st.header("📋 Ведомость доставки материалов")
 
 if st.session_state.delivery_data:
+    st.session_state.haul_engine.apply(st.session_state.delivery_data)
     df = pd.DataFrame(st.session_state.delivery_data)
-    columns_to_show = [
-        "№ п/п",
-        "Наименование материала",
-        "% от общей потребности",
-        "Вид работ",
-        "Наименование поставщика",
-        "Адрес",
-        "Вид \"франко\" для данного материала",
-        "Железнодорожные перевозки %",
-        "Станции назначения, на которую прибывает материал",
-        "Расстояние перевозки, км",
-        "Автомобильные перевозки %",
-        "Средняя дальность возки, км"
-    ]
+    columns_to_show = DELIVERY_COLUMNS
     st.dataframe(df[columns_to_show], use_container_width=True)
 
-    # Кнопка экспорта в Excel
-    excel_href = export_to_excel(df, columns_to_show)
-    st.markdown(excel_href, unsafe_allow_html=True)
+    with st.expander("📐 Сводка по материалам"):
+        st.dataframe(st.session_state.haul_engine.summary_table(), use_container_width=True, hide_index=True)
+
+    # Экспорт в Excel: файл формируется по запросу и хранится, пока ведомость не изменится
+    excel_data = get_excel_export(st.session_state, df, columns_to_show, build=False)
+    if excel_data is None and st.button("📊 Сформировать Excel-файл"):
+        excel_data = get_excel_export(st.session_state, df, columns_to_show)
+    if excel_data is not None:
+        st.download_button("📥 Скачать Excel-файл", data=excel_data, file_name=EXCEL_FILE_NAME, mime=XLSX_MIME)
 
     # --- Легенда материалов ---
     # Создаем уникальный список материалов и их цветов
@@ -350,100 +509,78 @@ if st.session_state.delivery_data:
     # --- Карта ---
     st.header("🗺️ Транспортная схема доставки")
     first_obj = st.session_state.delivery_data[0]
-    m = folium.Map(location=first_obj["object_coords"], zoom_start=10)
-
-    # Объект - теперь маленькая красная точка
-    folium.CircleMarker(
-        first_obj["object_coords"],
-        radius=5,  # Маленький радиус
-        color="red",
-        fill=True,
-        fill_opacity=1.0,
-        popup="Место размещения объекта",
-        tooltip="Объект"
-    ).add_to(m)
-
-    # Поставщики и маршруты
-    for record in st.session_state.delivery_data:
-        sup_coords = record["supplier_coords"]
-        color = record["Цвет"]
-        idx = record["№ п/п"]
-
-        # Убрали стандартный маркер поставщика, оставляем только номер
-
-        # Номер поставщика с попапом информации
-        folium.Marker(
-            sup_coords,
-            popup=f"№{idx}: {record['Наименование поставщика']}",
-            tooltip=f"Поставщик №{idx}",
-            icon=folium.DivIcon(html=f"""
-            <div style="
-                background: {color};
-                color: white;
-                border-radius: 50%;
-                width: 24px;
-                height: 24px;
-                text-align: center;
-                line-height: 24px;
-                font-weight: bold;
-                font-size: 14px;
-                box-shadow: 1px 1px 3px rgba(0,0,0,0.4);
-            ">{idx}</div>""")
-        ).add_to(m)
-
-        # Маршрут
-        route_coords = record.get("route_coords")
-        if route_coords:
-            folium.PolyLine(
-                locations=route_coords,
-                weight=5,
-                color=color,
-                opacity=0.8,
-                tooltip=f"{record['Наименование материала']} → {record['Расстояние перевозки, км']} км (по дорогам)"
-            ).add_to(m)
-        else:
-            # Резерв — прямая
-            folium.PolyLine(
-                locations=[sup_coords, record["object_coords"]],
-                weight=3,
-                color=color,
-                dash_array="10",
-                opacity=0.6,
-                tooltip=f"{record['Наименование материала']} → {record['Расстояние перевозки, км']} км (по прямой)"
-            ).add_to(m)
-
-    # Сохраняем объект карты в session_state для доступа к HTML
-    folium_map = st_folium(m, width="100%", height=600, returned_objects=["last_object_clicked"])
+    objects = delivery_objects(st.session_state.delivery_data)
+    # Точки маршрутов, невидимые при данном масштабе, на карту не передаём
+    route_tolerance = tolerance_for_zoom(10 + DISPLAY_ZOOM_MARGIN, first_obj["object_coords"][0])
+
+    # Базовая карта и слой маршрутов пересобираются только при изменении их входных данных,
+    # слой маршрутов передаётся в st_folium отдельно и не перемонтирует карту
+    m, map_rebuilt = st.session_state.map_cache.base_map(
+        fingerprint(objects),
+        timed_builder(st.session_state, "Построение карты", lambda: build_object_map(objects[0], others=objects[1:]))
+    )
+    delivery_layer, _ = st.session_state.map_cache.get(
+        "delivery",
+        fingerprint(delivery_layer_inputs(st.session_state.delivery_data), route_tolerance),
+        timed_builder(st.session_state, "Построение слоя маршрутов",
+                      lambda: build_delivery_layer(st.session_state.delivery_data, route_tolerance))
+    )
+
+    with timed(st.session_state, "Отрисовка карты (st_folium)"):
+        folium_map = st_folium(
+            m,
+            width="100%",
+            height=600,
+            returned_objects=["last_object_clicked"],
+            feature_group_to_add=delivery_layer,
+            render=map_rebuilt
+        )
 
     # Добавляем кнопки экспорта и скриншота
     col1, col2 = st.columns(2)
 
     with col1:
-        if st.button("💾 Сохранить карту"):
-            # Получаем HTML карты
-            map_html = m._repr_html_()
-            href = save_map_screenshot(map_html)
-            if href:
-                st.markdown(href, unsafe_allow_html=True)
-                st.info("Сохраните карту и откройте файл в любом браузере для просмотра интерактивной карты.")
-                st.success("✅ Ссылка для скачивания карты создана!")
-            else:
-                st.error("Не удалось создать ссылку для скачивания карты")
-                log_error(st.session_state, "Ошибка при создании ссылки для скачивания карты")
+        # Карта для экспорта собирается по запросу, отдельно от отображаемой,
+        # с детализацией маршрутов для приближения; HTML отрисовывается один раз
+        compress_map = st.checkbox("Сжать HTML карты (gzip)", key="compress_map")
+        export_key = fingerprint(delivery_layer_inputs(st.session_state.delivery_data), compress_map)
+        map_files = st.session_state.map_cache.peek("export", export_key)
+        if map_files is None and st.button("💾 Сохранить карту"):
+            def build_map_files():
+                m_export, routes = build_delivery_export(
+                    st.session_state.delivery_data,
+                    first_obj["object_coords"],
+                    tolerance_for_zoom(EXPORT_ROUTE_ZOOM, first_obj["object_coords"][0])
+                )
+                return map_html_file(m_export, compress_map), geojson_bytes(routes)
+            try:
+                map_files, _ = st.session_state.map_cache.get(
+                    "export", export_key, timed_builder(st.session_state, "Экспорт карты", build_map_files)
+                )
+                log_info(st.session_state, f"Карта для экспорта сформирована: {len(map_files[0][0])} байт")
+            except Exception as e:
+                st.error("Не удалось сформировать карту для скачивания")
+                log_error(st.session_state, "Ошибка при формировании карты для скачивания", details=str(e))
+        if map_files is not None:
+            (map_data, map_name, map_mime), routes_data = map_files
+            st.download_button("📥 Скачать HTML карты", data=map_data, file_name=map_name, mime=map_mime)
+            st.download_button("📥 Скачать маршруты (GeoJSON)", data=routes_data,
+                               file_name=ROUTES_FILE_NAME, mime="application/geo+json")
+            st.info("Сохраните карту и откройте файл в любом браузере для просмотра интерактивной карты.")
 
     with col2:
         # Очистка
         if st.button("🗑️ Очистить все данные"):
             log_info(st.session_state, "Очистка всех данных")
             st.session_state.delivery_data = []
-            st.session_state.geocode_cache = {}
+            st.session_state.supplier_candidates = []
+            st.session_state.haul_engine = HaulEngine()
+            st.session_state.map_cache.clear()
             st.rerun()
 
 else:
     st.info("Добавьте поставщиков, чтобы увидеть ведомость и транспортную схему.")
 
-    # --- Статистика в подвале (только если включен режим отладки) ---
-    display_error_stats(st.session_state)
-
-# --- Статистика в подвале ---
+# --- Статистика в подвале (только если включен режим отладки) ---
+st.session_state.timings.record("Перезапуск скрипта", time.perf_counter() - rerun_started)
 display_error_stats(st.session_state)
\ No newline at end of file
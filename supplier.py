@@ -2,14 +2,29 @@ import streamlit as st
 import folium
 from streamlit_folium import st_folium
 import pandas as pd
+import numpy as np
 import os
-from geopy.distance import geodesic
+import time
 from utils import (
     log_error, log_info, log_warning, log_api_error,
-    geocode_address_cached, init_ors_client, get_route_ors,
+    geocode_address_cached, init_ors_client, get_route_ors, get_distances_to_object_ors,
     MATERIAL_COLORS, AVAILABLE_COLORS, MATERIALS
 )
-from export_utils import export_to_excel, save_map_screenshot
+from export_utils import get_excel_export, map_html_file, geojson_bytes, EXCEL_FILE_NAME, XLSX_MIME, ROUTES_FILE_NAME
+from spatial_utils import (
+    SpatialIndex, simplify_route, tolerance_for_zoom,
+    SESSION_ROUTE_TOLERANCE_M, DISPLAY_ZOOM_MARGIN, EXPORT_ROUTE_ZOOM
+)
+from map_utils import (
+    add_supplier_points, MapCache, fingerprint, build_object_map, number_icon,
+    route_feature, routes_geojson, add_routes_layer
+)
+from supplier_data import load_suppliers_snapshot, load_local_snapshot, get_okved_list, category_distance_table
+from detour_utils import get_detour_model
+from haul_utils import HaulEngine
+from event_log import EventLog
+from timing_utils import StageTimings, timed, timed_builder
+from debug_ui import display_timings
 
 # --- Настройка страницы ---
 st.set_page_config(layout="wide", page_title="Модуль программы для работы с базой поставщиков", page_icon="🏭")
@@ -18,11 +33,17 @@ st.set_page_config(layout="wide", page_title="Модуль программы д
 if 'delivery_data' not in st.session_state:
     st.session_state.delivery_data = []
 
-if 'geocode_cache' not in st.session_state:
-    st.session_state.geocode_cache = {}
-
 if 'error_log' not in st.session_state:
-    st.session_state.error_log = []
+    st.session_state.error_log = EventLog()
+
+# Длительности этапов (перцентили внизу страницы)
+if 'timings' not in st.session_state:
+    st.session_state.timings = StageTimings()
+rerun_started = time.perf_counter()
+
+# Готовый Excel-файл ведомости (формируется по запросу)
+if 'excel_export' not in st.session_state:
+    st.session_state.excel_export = None
 
 if 'ors_api_key' not in st.session_state:
     st.session_state.ors_api_key = ""
@@ -55,6 +76,11 @@ if 'object_address' not in st.session_state:
 
 if 'suppliers_df' not in st.session_state:
     st.session_state.suppliers_df = None
+    # Новая сессия сразу получает последний локальный снимок базы, если он есть
+    try:
+        st.session_state.suppliers_df = load_local_snapshot(st.secrets["GOOGLE_DRIVE_SUPPLIERS_URL"])
+    except Exception as e:
+        log_warning(st.session_state, "Не удалось открыть локальный снимок базы поставщиков", str(e))
 
 if 'filtered_suppliers' not in st.session_state:
     st.session_state.filtered_suppliers = None
@@ -62,6 +88,20 @@ if 'filtered_suppliers' not in st.session_state:
 if 'selected_okved' not in st.session_state:
     st.session_state.selected_okved = None
 
+if 'category_distances' not in st.session_state:
+    st.session_state.category_distances = None
+
+if 'supplier_index' not in st.session_state:
+    st.session_state.supplier_index = None
+
+# Собранная карта и слои между перезапусками скрипта
+if 'map_cache' not in st.session_state:
+    st.session_state.map_cache = MapCache()
+
+# Средняя дальность возки и сводка по материалам (пересчитываются только при изменении строк)
+if 'haul_engine' not in st.session_state:
+    st.session_state.haul_engine = HaulEngine()
+
 # --- Заголовок страницы ---
 st.title("Модуль программы для работы с базой поставщиков")
 
@@ -78,31 +118,20 @@ def load_suppliers():
         
         st.info("📥 Загружаем данные поставщиков с Google Drive...")
         
-        # Читаем CSV файл напрямую с Google Drive
-        df = pd.read_csv(google_drive_url)
-        df = df.fillna('')  # Заполняем пустые значения
-
-        # Извлечение координат
-        df['lat'] = 0.0
-        df['lon'] = 0.0
-
-        # Парсинг координат из столбца "Координаты"
-        for idx, row in df.iterrows():
-            if 'Координаты' in row and row['Координаты'] and isinstance(row['Координаты'], str):
-                try:
-                    lat, lon = map(float, row['Координаты'].split(','))
-                    df.at[idx, 'lat'] = lat
-                    df.at[idx, 'lon'] = lon
-                except:
-                    pass
-
-        # Создаем информационное поле
-        df['info'] = df.apply(lambda row: f"{row['Название компании']}\nИНН: {row['ИНН']}\nАдрес: {row['Адрес компании']}", axis=1)
+        # Условное обновление локального снимка базы (по ETag/Last-Modified/хэшу содержимого)
+        with timed(st.session_state, "Загрузка поставщиков"):
+            df, source = load_suppliers_snapshot(google_drive_url)
+        if source == "offline":
+            st.warning("⚠️ Google Drive недоступен, используется последняя сохранённая копия базы")
+            log_warning(st.session_state, "Google Drive недоступен, загружен локальный снимок базы поставщиков")
+        elif source == "unchanged":
+            log_info(st.session_state, "База поставщиков не изменилась, загружен локальный снимок")
+        invalid_count = int((~df['coords_valid']).sum())
+        if invalid_count:
+            log_warning(st.session_state, f"Поставщиков без корректных координат: {invalid_count}")
 
         # Извлечение уникальных ОКВЭД для фильтрации
-        okved_list = df['Главный ОКВЭД (название)'].unique().tolist()
-        okved_list = [x for x in okved_list if x]
-        okved_list.sort()
+        okved_list = get_okved_list(df)
 
         # Сохраняем DataFrame в сессии
         st.session_state.suppliers_df = df
@@ -117,27 +146,92 @@ def load_suppliers():
         st.error("Проверьте доступность ссылки и подключение к интернету.")
         return None, []
 
+# Пространственный индекс по отфильтрованным поставщикам (один на набор данных и ОКВЭД)
+def get_supplier_index():
+    index_key = (id(st.session_state.suppliers_df), st.session_state.selected_okved)
+    cached = st.session_state.supplier_index
+    if cached is None or cached['key'] != index_key:
+        suppliers = st.session_state.filtered_suppliers
+        valid = suppliers['coords_valid'].to_numpy()
+        index = SpatialIndex(
+            suppliers['lat'].to_numpy()[valid],
+            suppliers['lon'].to_numpy()[valid],
+            np.flatnonzero(valid)
+        )
+        st.session_state.supplier_index = {'key': index_key, 'index': index}
+        log_info(st.session_state, f"Построен пространственный индекс по {len(index)} поставщикам")
+    return st.session_state.supplier_index['index']
+
+# Базовая карта модуля: объект и точки отфильтрованных поставщиков
+def build_supplier_base_map(object_coords, suppliers):
+    m = build_object_map(object_coords, radius=10, popup=folium.Popup("Объект", max_width=200))
+    # Добавляем поставщиков из отфильтрованного списка (крупные категории - кластерами)
+    add_supplier_points(m, suppliers)
+    return m
+
+# Слой выбранных поставщиков: маркеры с номерами и маршруты
+def build_selected_layer(selected_suppliers, object_coords, route_tolerance):
+    layer = folium.FeatureGroup(name="Выбранные поставщики")
+    for i, supplier in enumerate(selected_suppliers):
+        # Получаем данные поставщика
+        sup_coords = supplier['Координаты']
+        idx = i + 1  # Номер поставщика
+
+        # Выбираем цвет из доступных (для разнообразия)
+        color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
+
+        # Добавляем маркер с номером
+        folium.Marker(
+            sup_coords,
+            popup=f"№{idx}: {supplier['Название компании']}",
+            tooltip=f"Поставщик №{idx}",
+            icon=number_icon(idx, supplier.get('Цвет', color))
+        ).add_to(layer)
+
+        # Расчет времени в пути (средняя скорость 40 км/ч)
+        distance = supplier['Расстояние']
+        travel_time_hours = distance / 40 if distance > 0 else 0
+        hours = int(travel_time_hours)
+        minutes = int((travel_time_hours - hours) * 40)
+
+        if hours > 0:
+            time_str = f"{hours}ч {minutes}мин"
+        else:
+            time_str = f"{minutes}мин"
+
+        # Добавляем маршрут
+        route_coords = supplier['Маршрут']
+        if route_coords:
+            folium.PolyLine(
+                locations=simplify_route(route_coords, route_tolerance),
+                weight=5,
+                color=supplier.get('Цвет', color),
+                opacity=0.8,
+                tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по дорогам) - {time_str}"
+            ).add_to(layer)
+        else:
+            # Резерв — прямая линия, если маршрут не определен
+            folium.PolyLine(
+                locations=[sup_coords, object_coords],
+                weight=3,
+                color=color,
+                dash_array="10",
+                opacity=0.6,
+                tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (оценка по прямой) - {time_str}"
+            ).add_to(layer)
+    return layer
+
 # Обработчик выбора поставщика на карте
 def handle_supplier_click(clicked_point):
     if clicked_point and st.session_state.object_coords and st.session_state.filtered_suppliers is not None:
         # Получаем координаты клика
         lat, lon = clicked_point['lat'], clicked_point['lng']
 
-        # Находим ближайшего поставщика из фильтрованного списка
+        # Находим ближайшего поставщика из фильтрованного списка через пространственный индекс
         closest_supplier = None
-        min_distance = float('inf')
-
-        for idx, row in st.session_state.filtered_suppliers.iterrows():
-            supplier_coords = (row['lat'], row['lon'])
-            click_coords = (lat, lon)
-
-            # Расчет расстояния от клика до поставщика
-            distance = geodesic(click_coords, supplier_coords).kilometers
-
-            # Если это ближайший поставщик к клику
-            if distance < min_distance and distance < 10:  # Порог в 10 км
-                min_distance = distance
-                closest_supplier = row
+        position, distance = get_supplier_index().nearest(lat, lon, max_km=10)  # Порог в 10 км
+        if position is not None:
+            closest_supplier = st.session_state.filtered_suppliers.iloc[position]
 
         # Если нашли поставщика в радиусе клика
         if closest_supplier is not None:
@@ -154,6 +248,8 @@ def handle_supplier_click(clicked_point):
                     supplier_coords,
                     st.session_state.object_coords
                 )
+                # В сессии храним упрощённую геометрию, полная остаётся в кэше маршрутов
+                route_coords = simplify_route(route_coords, SESSION_ROUTE_TOLERANCE_M)
 
                 # Создаем запись для выбранного поставщика
                 # Используем цвет, выбранный пользователем в интерфейсе
@@ -249,6 +345,7 @@ with col1:
         df, okved_list = load_suppliers()
         if df is not None:
             st.session_state.suppliers_df = df
+            st.session_state.supplier_index = None
             st.success(f"✅ Загружено {len(df)} поставщиков")
         else:
             st.error("❌ Ошибка при загрузке данных поставщиков")
@@ -258,9 +355,7 @@ with col1:
         st.header("3.Выберите категорию поставщиков")
 
         # Получение списка уникальных ОКВЭД
-        okved_list = st.session_state.suppliers_df['Главный ОКВЭД (название)'].unique().tolist()
-        okved_list = [x for x in okved_list if x]
-        okved_list.sort()
+        okved_list = get_okved_list(st.session_state.suppliers_df)
 
         # Выбор ОКВЭД
         okved_list.insert(0, "Ничего")  # Добавляем опцию "Ничего" в начало списка
@@ -299,12 +394,46 @@ with col1:
         # Предпросмотр выбранного цвета
         st.markdown(f"<div style='background-color: {selected_color}; width: 100%; height: 20px; border-radius: 5px;'></div>", unsafe_allow_html=True)
 
+    # Расстояния по дорогам для всей категории (пакетный расчёт через Matrix API)
+    if st.session_state.filtered_suppliers is not None and st.session_state.object_coords is not None:
+        st.header("5.Расстояния по дорогам")
+
+        category_distances = st.session_state.category_distances
+        if (category_distances is None
+                or category_distances["okved"] != st.session_state.selected_okved
+                or category_distances["object_coords"] != st.session_state.object_coords):
+            # Оценка по прямой с учётом извилистости дорог - сразу, без запросов к API
+            category_distances = {
+                "okved": st.session_state.selected_okved,
+                "object_coords": st.session_state.object_coords,
+                "table": category_distance_table(
+                    st.session_state.filtered_suppliers, st.session_state.object_coords, get_detour_model()
+                )
+            }
+            st.session_state.category_distances = category_distances
+
+        if st.button("📏 Рассчитать расстояния для всей категории"):
+            table = category_distances["table"]
+            valid = st.session_state.filtered_suppliers.loc[table.index]
+            distances = get_distances_to_object_ors(
+                st.session_state,
+                ors_client,
+                list(zip(valid['lat'], valid['lon'])),
+                st.session_state.object_coords
+            )
+            table["Расстояние по дорогам, км"] = [np.nan if d is None else d for d in distances]
+            category_distances["table"] = table.sort_values("Расстояние по дорогам, км", na_position="last")
+
+        st.caption("Оценка по дорогам - расстояние по прямой с коэффициентом извилистости дорог, "
+                   "рассчитанным по уже построенным маршрутам")
+        st.dataframe(category_distances["table"], use_container_width=True, hide_index=True)
+
 with col2:
     # Отображение карты
     st.header("Карта поставщиков")
 
     # Проверка наличия API-ключа для построения маршрутов
-    if not st.session_state.ors_api_key:
+    if not st.session_state.ors_api_key and ors_client is None:
         st.warning("⚠️ API-ключ OpenRouteService не установлен. Маршруты будут рассчитаны по прямой линии. Используйте панель 'Ввести временный API-ключ для тестирования'.")
 
     # Если объект не задан, показываем сообщение
@@ -313,123 +442,38 @@ with col2:
     elif st.session_state.filtered_suppliers is None:
         st.warning("⚠️ Загрузите данные поставщиков и выберите ОКВЭД")
     else:
-        # Создаем карту
-        m = folium.Map(location=st.session_state.object_coords, zoom_start=10)
-
-        # Добавляем объект - маленькая красная точка
-        folium.CircleMarker(
-            st.session_state.object_coords,
-            radius=10,  # Маленький радиус
-            color="red",
-            fill=True,
-            fill_opacity=1.0,
-            popup=folium.Popup("Объект", max_width=200),
-            tooltip="Объект"
-
-        ).add_to(m)
-
-        # Добавляем поставщиков из отфильтрованного списка
-        for idx, row in st.session_state.filtered_suppliers.iterrows():
-            # Проверяем, что координаты корректные
-            if row['lat'] != 0 and row['lon'] != 0:
-                # Создаем всплывающую подсказку с информацией о поставщике
-                popup_text = f"""<b>{row['Название компании']}</b><br>
-                                ИНН: {row['ИНН']}<br>
-                                ОКВЭД: {row['Главный ОКВЭД (название)']}<br>
-                                Адрес: {row['Адрес компании']}"""
-
-                # Добавляем маркер поставщика
-                folium.CircleMarker(
-                    [row['lat'], row['lon']],
-                    popup=folium.Popup(popup_text, max_width=300),
-                    tooltip=row['Название компании'],
-                    radius=5,  # Маленький радиус
-                    color="blue",
-                    fill=True,
-                    fill_opacity=1.0,
-                ).add_to(m)
-
-        # Добавляем выбранных поставщиков и маршруты
-        for i, supplier in enumerate(st.session_state.selected_suppliers):
-            # Получаем данные поставщика
-            sup_coords = supplier['Координаты']
-            idx = i + 1  # Номер поставщика
-
-            # Выбираем цвет из доступных (для разнообразия)
-            color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
-
-            # Добавляем маркер с номером
-            folium.Marker(
-                sup_coords,
-                popup=f"№{idx}: {supplier['Название компании']}",
-                tooltip=f"Поставщик №{idx}",
-                icon=folium.DivIcon(html=f"""
-                <div style="
-                    background: {supplier.get('Цвет', color)};
-                    color: white;
-                    border-radius: 50%;
-                    width: 24px;
-                    height: 24px;
-                    text-align: center;
-                    line-height: 24px;
-                    font-weight: bold;
-                    font-size: 14px;
-                    box-shadow: 1px 1px 3px rgba(0,0,0,0.4);
-                ">{idx}</div>""")
-            ).add_to(m)
-
-            # Добавляем маршрут
-            route_coords = supplier['Маршрут']
-            if route_coords:
-                # Расчет времени в пути (средняя скорость 40 км/ч)
-                distance = supplier['Расстояние']
-                travel_time_hours = distance / 40 if distance > 0 else 0
-                hours = int(travel_time_hours)
-                minutes = int((travel_time_hours - hours) * 40)
-                
-                if hours > 0:
-                    time_str = f"{hours}ч {minutes}мин"
-                else:
-                    time_str = f"{minutes}мин"
-                
-                folium.PolyLine(
-                    locations=route_coords,
-                    weight=5,
-                    color=supplier.get('Цвет', color),
-                    opacity=0.8,
-                    tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по дорогам) - {time_str}"
-                ).add_to(m)
-            else:
-                # Резерв — прямая линия, если маршрут не определен
-                # Расчет времени в пути (средняя скорость 40 км/ч)
-                distance = supplier['Расстояние']
-                travel_time_hours = distance / 40 if distance > 0 else 0
-                hours = int(travel_time_hours)
-                minutes = int((travel_time_hours - hours) * 40)
-                
-                if hours > 0:
-                    time_str = f"{hours}ч {minutes}мин"
-                else:
-                    time_str = f"{minutes}мин"
-                
-                folium.PolyLine(
-                    locations=[sup_coords, st.session_state.object_coords],
-                    weight=3,
-                    color=color,
-                    dash_array="10",
-                    opacity=0.6,
-                    tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по прямой) - {time_str}"
-                ).add_to(m)
-
-        # Отображаем карту с обработкой кликов
-        folium_map = st_folium(
-            m,
-            width="100%",
-            height=600,
-            returned_objects=["last_object_clicked"],
-            key="supplier_map"
+        # Базовая карта (объект и точки поставщиков) пересобирается только при смене данных
+        m, map_rebuilt = st.session_state.map_cache.base_map(
+            fingerprint(st.session_state.object_coords, id(st.session_state.suppliers_df), st.session_state.selected_okved),
+            timed_builder(st.session_state, "Построение карты", lambda: build_supplier_base_map(
+                st.session_state.object_coords, st.session_state.filtered_suppliers
+            ))
+        )
+        # Точки маршрутов, невидимые при данном масштабе, на карту не передаём
+        route_tolerance = tolerance_for_zoom(10 + DISPLAY_ZOOM_MARGIN, st.session_state.object_coords[0])
+
+        # Выбранные поставщики и маршруты - отдельный слой поверх базовой карты
+        selected_layer, _ = st.session_state.map_cache.get(
+            "selected",
+            fingerprint(st.session_state.selected_suppliers, st.session_state.object_coords, route_tolerance),
+            timed_builder(st.session_state, "Построение слоя маршрутов", lambda: build_selected_layer(
+                st.session_state.selected_suppliers, st.session_state.object_coords, route_tolerance
+            ))
         )
 
+        # Отображаем карту с обработкой кликов. Для неизменной базовой карты пропускается полная
+        # отрисовка HTML (render=False); JS-код карты streamlit-folium всё равно генерирует при каждом перезапуске
+        with timed(st.session_state, "Отрисовка карты (st_folium)"):
+            folium_map = st_folium(
+                m,
+                width="100%",
+                height=600,
+                returned_objects=["last_object_clicked"],
+                key="supplier_map",
+                feature_group_to_add=selected_layer,
+                render=map_rebuilt
+            )
+
         # Обрабатываем клик по карте
         if folium_map["last_object_clicked"] is not None:
             # Пытаемся добавить поставщика при клике
@@ -440,6 +484,7 @@ with col2:
 st.header("📋 Ведомость поставщиков")
 
 if st.session_state.delivery_data:
+    st.session_state.haul_engine.apply(st.session_state.delivery_data)
     df = pd.DataFrame(st.session_state.delivery_data)
     columns_to_show = [
         "№ п/п",
@@ -457,9 +502,15 @@ if st.session_state.delivery_data:
     ]
     st.dataframe(df[columns_to_show], use_container_width=True)
 
-    # Кнопка экспорта в Excel
-    excel_href = export_to_excel(df, columns_to_show)
-    st.markdown(excel_href, unsafe_allow_html=True)
+    with st.expander("📐 Сводка по материалам"):
+        st.dataframe(st.session_state.haul_engine.summary_table(), use_container_width=True, hide_index=True)
+
+    # Экспорт в Excel: файл формируется по запросу и хранится, пока ведомость не изменится
+    excel_data = get_excel_export(st.session_state, df, columns_to_show, build=False)
+    if excel_data is None and st.button("📊 Сформировать Excel-файл"):
+        excel_data = get_excel_export(st.session_state, df, columns_to_show)
+    if excel_data is not None:
+        st.download_button("📥 Скачать Excel-файл", data=excel_data, file_name=EXCEL_FILE_NAME, mime=XLSX_MIME)
 
     # --- Легенда материалов ---
     # Создаем уникальный список материалов и их цветов
@@ -496,88 +547,74 @@ if st.session_state.delivery_data:
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        if st.button("💾 Сохранить карту"):
-            # Создаем карту для экспорта
-            m_export = folium.Map(location=st.session_state.object_coords, zoom_start=10)
-
-            # Добавляем объект
-            folium.CircleMarker(
-                st.session_state.object_coords,
-                radius=5,
-                color="red",
-                fill=True,
-                fill_opacity=1.0,
-                popup="Место размещения объекта",
-                tooltip="Объект"
-            ).add_to(m_export)
-
-            # Добавляем выбранных поставщиков и маршруты
-            for i, supplier in enumerate(st.session_state.selected_suppliers):
-                sup_coords = supplier['Координаты']
-                idx = i + 1
-                color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
-
-                # Маркер с номером
-                folium.Marker(
-                    sup_coords,
-                    popup=f"№{idx}: {supplier['Название компании']}",
-                    tooltip=f"Поставщик №{idx}",
-                    icon=folium.DivIcon(html=f"""
-                    <div style="
-                        background: {color};
-                        color: white;
-                        border-radius: 50%;
-                        width: 24px;
-                        height: 24px;
-                        text-align: center;
-                        line-height: 24px;
-                        font-weight: bold;
-                        font-size: 14px;
-                        box-shadow: 1px 1px 3px rgba(0,0,0,0.4);
-                    ">{idx}</div>""")
-                ).add_to(m_export)
-
-                # Добавляем маршрут (по дорогам или по прямой)
-                route_coords = supplier.get('Маршрут')
-                distance = supplier.get('Расстояние', 0)
-                
-                # Расчет времени в пути (средняя скорость 60 км/ч)
-                travel_time_hours = distance / 60 if distance > 0 else 0
-                hours = int(travel_time_hours)
-                minutes = int((travel_time_hours - hours) * 60)
-                
-                if hours > 0:
-                    time_str = f"{hours}ч {minutes}мин"
-                else:
-                    time_str = f"{minutes}мин"
-                
-                if route_coords:
-                    folium.PolyLine(
-                        locations=route_coords,
-                        weight=5,
-                        color=color,
-                        opacity=0.8,
-                        tooltip=f"{supplier['ОКВЭД']} → {distance} км (по дорогам) - {time_str}"
-                    ).add_to(m_export)
-                else:
-                    folium.PolyLine(
-                        locations=[sup_coords, st.session_state.object_coords],
-                        weight=3,
-                        color=color,
-                        dash_array="10",
-                        opacity=0.6,
-                        tooltip=f"{supplier['ОКВЭД']} → {distance} км (по прямой) - {time_str}"
+        # Карта для экспорта собирается по запросу и отрисовывается один раз;
+        # маршруты - одним слоем GeoJSON, который можно скачать и отдельно
+        compress_map = st.checkbox("Сжать HTML карты (gzip)", key="compress_map")
+        export_key = fingerprint(st.session_state.selected_suppliers, st.session_state.object_coords, compress_map)
+        map_files = st.session_state.map_cache.peek("export", export_key)
+        if map_files is None and st.button("💾 Сохранить карту"):
+            def build_map_files():
+                m_export = build_object_map(st.session_state.object_coords)
+                # Детализация маршрутов для экспорта - с запасом на приближение карты
+                route_tolerance = tolerance_for_zoom(EXPORT_ROUTE_ZOOM, st.session_state.object_coords[0])
+                route_features = []
+
+                # Добавляем выбранных поставщиков и маршруты
+                for i, supplier in enumerate(st.session_state.selected_suppliers):
+                    sup_coords = supplier['Координаты']
+                    idx = i + 1
+                    color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
+
+                    # Маркер с номером
+                    folium.Marker(
+                        sup_coords,
+                        popup=f"№{idx}: {supplier['Название компании']}",
+                        tooltip=f"Поставщик №{idx}",
+                        icon=number_icon(idx, color)
                     ).add_to(m_export)
 
-            # Получаем HTML карты
-            map_html = m_export._repr_html_()
-            href = save_map_screenshot(map_html)
-            if href:
-                st.markdown(href, unsafe_allow_html=True)
-                st.info("Сохраните карту и откройте файл в любом браузере для просмотра интерактивной карты.")
-                st.success("✅ Ссылка для скачивания карты создана!")
-            else:
-                st.error("Не удалось создать ссылку для скачивания карты")
+                    # Маршрут (по дорогам или по прямой)
+                    route_coords = supplier.get('Маршрут')
+                    distance = supplier.get('Расстояние', 0)
+
+                    # Расчет времени в пути (средняя скорость 60 км/ч)
+                    travel_time_hours = distance / 60 if distance > 0 else 0
+                    hours = int(travel_time_hours)
+                    minutes = int((travel_time_hours - hours) * 60)
+
+                    if hours > 0:
+                        time_str = f"{hours}ч {minutes}мин"
+                    else:
+                        time_str = f"{minutes}мин"
+
+                    if route_coords:
+                        route_features.append(route_feature(
+                            simplify_route(route_coords, route_tolerance), color,
+                            f"{supplier['ОКВЭД']} → {distance} км (по дорогам) - {time_str}"
+                        ))
+                    else:
+                        route_features.append(route_feature(
+                            [sup_coords, st.session_state.object_coords], color,
+                            f"{supplier['ОКВЭД']} → {distance} км (оценка по прямой) - {time_str}", straight=True
+                        ))
+
+                routes = routes_geojson(route_features)
+                add_routes_layer(m_export, routes)
+                return map_html_file(m_export, compress_map), geojson_bytes(routes)
+            try:
+                map_files, _ = st.session_state.map_cache.get(
+                    "export", export_key, timed_builder(st.session_state, "Экспорт карты", build_map_files)
+                )
+            except Exception as e:
+                st.error("Не удалось сформировать карту для скачивания")
+                log_error(st.session_state, "Ошибка при формировании карты для скачивания", details=str(e))
+        if map_files is not None:
+            (map_data, map_name, map_mime), routes_data = map_files
+            st.download_button("📥 Скачать HTML карты", data=map_data, file_name=map_name, mime=map_mime)
+            st.download_button("📥 Скачать маршруты (GeoJSON)", data=routes_data,
+                               file_name=ROUTES_FILE_NAME, mime="application/geo+json")
+            st.info("Сохраните карту и откройте файл в любом браузере для просмотра интерактивной карты.")
+
 
     with col2:
         # Очистка выбранных поставщиков
@@ -585,6 +622,8 @@ if st.session_state.delivery_data:
             log_info(st.session_state, "Очистка выбранных поставщиков")
             st.session_state.delivery_data = []
             st.session_state.selected_suppliers = []
+            st.session_state.haul_engine = HaulEngine()
+            st.session_state.map_cache.clear()
             st.rerun()
 
     with col3:
@@ -604,6 +643,11 @@ if st.session_state.delivery_data:
 else:
     st.info("Выберите поставщиков на карте, чтобы сформировать ведомость.")
 
+# --- Длительность этапов: где тратится время перезапуска ---
+st.session_state.timings.record("Перезапуск скрипта", time.perf_counter() - rerun_started)
+with st.expander("⏱️ Длительность этапов (p50 / p95 / p99)"):
+    display_timings(st.session_state)
+
 # --- Функция для отображения интерфейса добавления поставщиков из базы ---
 def display_supplier_gui():
     st.header("📂 Добавление поставщиков из базы")
@@ -612,11 +656,17 @@ def display_supplier_gui():
     if 'delivery_data' not in st.session_state:
         st.session_state.delivery_data = []
 
-    if 'geocode_cache' not in st.session_state:
-        st.session_state.geocode_cache = {}
-
     if 'error_log' not in st.session_state:
-        st.session_state.error_log = []
+        st.session_state.error_log = EventLog()
+
+    # Длительности этапов (перцентили внизу страницы)
+    if 'timings' not in st.session_state:
+        st.session_state.timings = StageTimings()
+    rerun_started = time.perf_counter()
+
+    # Готовый Excel-файл ведомости (формируется по запросу)
+    if 'excel_export' not in st.session_state:
+        st.session_state.excel_export = None
 
     if 'ors_api_key' not in st.session_state:
         st.session_state.ors_api_key = ""
@@ -649,6 +699,11 @@ def display_supplier_gui():
 
     if 'suppliers_df' not in st.session_state:
         st.session_state.suppliers_df = None
+        # Новая сессия сразу получает последний локальный снимок базы, если он есть
+        try:
+            st.session_state.suppliers_df = load_local_snapshot(st.secrets["GOOGLE_DRIVE_SUPPLIERS_URL"])
+        except Exception as e:
+            log_warning(st.session_state, "Не удалось открыть локальный снимок базы поставщиков", str(e))
 
     if 'filtered_suppliers' not in st.session_state:
         st.session_state.filtered_suppliers = None
@@ -656,6 +711,20 @@ def display_supplier_gui():
     if 'selected_okved' not in st.session_state:
         st.session_state.selected_okved = None
 
+    if 'category_distances' not in st.session_state:
+        st.session_state.category_distances = None
+
+    if 'supplier_index' not in st.session_state:
+        st.session_state.supplier_index = None
+
+    # Собранная карта и слои между перезапусками скрипта
+    if 'map_cache' not in st.session_state:
+        st.session_state.map_cache = MapCache()
+
+    # Средняя дальность возки и сводка по материалам (пересчитываются только при изменении строк)
+    if 'haul_engine' not in st.session_state:
+        st.session_state.haul_engine = HaulEngine()
+
     # --- Заголовок страницы ---
     st.title("Модуль программы для работы с базой поставщиков")
 
@@ -672,31 +741,20 @@ def display_supplier_gui():
             
             st.info("📥 Загружаем данные поставщиков с Google Drive...")
             
-            # Читаем CSV файл напрямую с Google Drive
-            df = pd.read_csv(google_drive_url)
-            df = df.fillna('')  # Заполняем пустые значения
-
-            # Извлечение координат
-            df['lat'] = 0.0
-            df['lon'] = 0.0
-
-            # Парсинг координат из столбца "Координаты"
-            for idx, row in df.iterrows():
-                if 'Координаты' in row and row['Координаты'] and isinstance(row['Координаты'], str):
-                    try:
-                        lat, lon = map(float, row['Координаты'].split(','))
-                        df.at[idx, 'lat'] = lat
-                        df.at[idx, 'lon'] = lon
-                    except:
-                        pass
-
-            # Создаем информационное поле
-            df['info'] = df.apply(lambda row: f"{row['Название компании']}\nИНН: {row['ИНН']}\nАдрес: {row['Адрес компании']}", axis=1)
+            # Условное обновление локального снимка базы (по ETag/Last-Modified/хэшу содержимого)
+            with timed(st.session_state, "Загрузка поставщиков"):
+                df, source = load_suppliers_snapshot(google_drive_url)
+            if source == "offline":
+                st.warning("⚠️ Google Drive недоступен, используется последняя сохранённая копия базы")
+                log_warning(st.session_state, "Google Drive недоступен, загружен локальный снимок базы поставщиков")
+            elif source == "unchanged":
+                log_info(st.session_state, "База поставщиков не изменилась, загружен локальный снимок")
+            invalid_count = int((~df['coords_valid']).sum())
+            if invalid_count:
+                log_warning(st.session_state, f"Поставщиков без корректных координат: {invalid_count}")
 
             # Извлечение уникальных ОКВЭД для фильтрации
-            okved_list = df['Главный ОКВЭД (название)'].unique().tolist()
-            okved_list = [x for x in okved_list if x]
-            okved_list.sort()
+            okved_list = get_okved_list(df)
 
             log_info(st.session_state, f"Загружено {len(df)} поставщиков с Google Drive")
             st.success(f"✅ Успешно загружено {len(df)} поставщиков с Google Drive!")
@@ -714,21 +772,11 @@ def display_supplier_gui():
             # Получаем координаты клика
             lat, lon = clicked_point['lat'], clicked_point['lng']
 
-            # Находим ближайшего поставщика из фильтрованного списка
+            # Находим ближайшего поставщика из фильтрованного списка через пространственный индекс
             closest_supplier = None
-            min_distance = float('inf')
-
-            for idx, row in st.session_state.filtered_suppliers.iterrows():
-                supplier_coords = (row['lat'], row['lon'])
-                click_coords = (lat, lon)
-
-                # Расчет расстояния от клика до поставщика
-                distance = geodesic(click_coords, supplier_coords).kilometers
-
-                # Если это ближайший поставщик к клику
-                if distance < min_distance and distance < 10:  # Порог в 10 км
-                    min_distance = distance
-                    closest_supplier = row
+            position, distance = get_supplier_index().nearest(lat, lon, max_km=10)  # Порог в 10 км
+            if position is not None:
+                closest_supplier = st.session_state.filtered_suppliers.iloc[position]
 
             # Если нашли поставщика в радиусе клика
             if closest_supplier is not None:
@@ -745,6 +793,8 @@ def display_supplier_gui():
                         supplier_coords,
                         st.session_state.object_coords
                     )
+                    # В сессии храним упрощённую геометрию, полная остаётся в кэше маршрутов
+                    route_coords = simplify_route(route_coords, SESSION_ROUTE_TOLERANCE_M)
 
                     # Создаем запись для выбранного поставщика
                     # Используем цвет, выбранный пользователем в интерфейсе
@@ -840,6 +890,7 @@ def display_supplier_gui():
             df, okved_list = load_suppliers()
             if df is not None:
                 st.session_state.suppliers_df = df
+                st.session_state.supplier_index = None
                 st.success(f"✅ Загружено {len(df)} поставщиков")
             else:
                 st.error("❌ Ошибка при загрузке данных поставщиков")
@@ -849,9 +900,7 @@ def display_supplier_gui():
             st.header("3.Выберите категорию поставщиков")
 
             # Получение списка уникальных ОКВЭД
-            okved_list = st.session_state.suppliers_df['Главный ОКВЭД (название)'].unique().tolist()
-            okved_list = [x for x in okved_list if x]
-            okved_list.sort()
+            okved_list = get_okved_list(st.session_state.suppliers_df)
 
             # Выбор ОКВЭД
             okved_list.insert(0, "Ничего")  # Добавляем опцию "Ничего" в начало списка
@@ -890,12 +939,46 @@ def display_supplier_gui():
             # Предпросмотр выбранного цвета
             st.markdown(f"<div style='background-color: {selected_color}; width: 100%; height: 20px; border-radius: 5px;'></div>", unsafe_allow_html=True)
 
+        # Расстояния по дорогам для всей категории (пакетный расчёт через Matrix API)
+        if st.session_state.filtered_suppliers is not None and st.session_state.object_coords is not None:
+            st.header("5.Расстояния по дорогам")
+
+            category_distances = st.session_state.category_distances
+            if (category_distances is None
+                    or category_distances["okved"] != st.session_state.selected_okved
+                    or category_distances["object_coords"] != st.session_state.object_coords):
+                # Оценка по прямой с учётом извилистости дорог - сразу, без запросов к API
+                category_distances = {
+                    "okved": st.session_state.selected_okved,
+                    "object_coords": st.session_state.object_coords,
+                    "table": category_distance_table(
+                        st.session_state.filtered_suppliers, st.session_state.object_coords, get_detour_model()
+                    )
+                }
+                st.session_state.category_distances = category_distances
+
+            if st.button("📏 Рассчитать расстояния для всей категории"):
+                table = category_distances["table"]
+                valid = st.session_state.filtered_suppliers.loc[table.index]
+                distances = get_distances_to_object_ors(
+                    st.session_state,
+                    ors_client,
+                    list(zip(valid['lat'], valid['lon'])),
+                    st.session_state.object_coords
+                )
+                table["Расстояние по дорогам, км"] = [np.nan if d is None else d for d in distances]
+                category_distances["table"] = table.sort_values("Расстояние по дорогам, км", na_position="last")
+
+            st.caption("Оценка по дорогам - расстояние по прямой с коэффициентом извилистости дорог, "
+                       "рассчитанным по уже построенным маршрутам")
+            st.dataframe(category_distances["table"], use_container_width=True, hide_index=True)
+
     with col2:
         # Отображение карты
         st.header("Карта поставщиков")
 
         # Проверка наличия API-ключа для построения маршрутов
-        if not st.session_state.ors_api_key:
+        if not st.session_state.ors_api_key and ors_client is None:
             st.warning("⚠️ API-ключ OpenRouteService не установлен. Маршруты будут рассчитаны по прямой линии. Используйте панель 'Ввести временный API-ключ для тестирования'.")
 
         # Если объект не задан, показываем сообщение
@@ -904,100 +987,37 @@ def display_supplier_gui():
         elif st.session_state.filtered_suppliers is None:
             st.warning("⚠️ Загрузите данные поставщиков и выберите ОКВЭД")
         else:
-            # Создаем карту
-            m = folium.Map(location=st.session_state.object_coords, zoom_start=10)
-
-            # Добавляем объект - маленькая красная точка
-            folium.CircleMarker(
-                st.session_state.object_coords,
-                radius=10,  # Маленький радиус
-                color="red",
-                fill=True,
-                fill_opacity=1.0,
-                popup=folium.Popup("Объект", max_width=200),
-                tooltip="Объект"
-
-            ).add_to(m)
-
-            # Добавляем поставщиков из отфильтрованного списка
-            for idx, row in st.session_state.filtered_suppliers.iterrows():
-                # Проверяем, что координаты корректные
-                if row['lat'] != 0 and row['lon'] != 0:
-                    # Создаем всплывающую подсказку с информацией о поставщике
-                    popup_text = f"""<b>{row['Название компании']}</b><br>
-                                    ИНН: {row['ИНН']}<br>
-                                    ОКВЭД: {row['Главный ОКВЭД (название)']}<br>
-                                    Адрес: {row['Адрес компании']}"""
-
-                    # Добавляем маркер поставщика
-                    folium.CircleMarker(
-                        [row['lat'], row['lon']],
-                        popup=folium.Popup(popup_text, max_width=300),
-                        tooltip=row['Название компании'],
-                        radius=5,  # Маленький радиус
-                        color="blue",
-                        fill=True,
-                        fill_opacity=1.0,
-                    ).add_to(m)
-
-            # Добавляем выбранных поставщиков и маршруты
-            for i, supplier in enumerate(st.session_state.selected_suppliers):
-                # Получаем данные поставщика
-                sup_coords = supplier['Координаты']
-                idx = i + 1  # Номер поставщика
-
-                # Выбираем цвет из доступных (для разнообразия)
-                color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
-
-                # Добавляем маркер с номером
-                folium.Marker(
-                    sup_coords,
-                    popup=f"№{idx}: {supplier['Название компании']}",
-                    tooltip=f"Поставщик №{idx}",
-                    icon=folium.DivIcon(html=f"""
-                    <div style="
-                        background: {supplier.get('Цвет', color)};
-                        color: white;
-                        border-radius: 50%;
-                        width: 24px;
-                        height: 24px;
-                        text-align: center;
-                        line-height: 24px;
-                        font-weight: bold;
-                        font-size: 14px;
-                        box-shadow: 1px 1px 3px rgba(0,0,0,0.4);
-                    ">{idx}</div>""")
-                ).add_to(m)
-
-                # Добавляем маршрут
-                route_coords = supplier['Маршрут']
-                if route_coords:
-                    folium.PolyLine(
-                        locations=route_coords,
-                        weight=5,
-                        color=supplier.get('Цвет', color),
-                        opacity=0.8,
-                        tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по дорогам)"
-                    ).add_to(m)
-                else:
-                    # Резерв — прямая линия, если маршрут не определен
-                    folium.PolyLine(
-                        locations=[sup_coords, st.session_state.object_coords],
-                        weight=3,
-                        color=color,
-                        dash_array="10",
-                        opacity=0.6,
-                        tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по прямой)"
-                    ).add_to(m)
-
-            # Отображаем карту с обработкой кликов
-            folium_map = st_folium(
-                m,
-                width="100%",
-                height=600,
-                returned_objects=["last_object_clicked"],
-                key="supplier_map"
+            # Базовая карта (объект и точки поставщиков) пересобирается только при смене данных
+            m, map_rebuilt = st.session_state.map_cache.base_map(
+                fingerprint(st.session_state.object_coords, id(st.session_state.suppliers_df), st.session_state.selected_okved),
+                timed_builder(st.session_state, "Построение карты", lambda: build_supplier_base_map(
+                    st.session_state.object_coords, st.session_state.filtered_suppliers
+                ))
             )
+            # Точки маршрутов, невидимые при данном масштабе, на карту не передаём
+            route_tolerance = tolerance_for_zoom(10 + DISPLAY_ZOOM_MARGIN, st.session_state.object_coords[0])
+
+            # Выбранные поставщики и маршруты - отдельный слой поверх базовой карты
+            selected_layer, _ = st.session_state.map_cache.get(
+                "selected",
+                fingerprint(st.session_state.selected_suppliers, st.session_state.object_coords, route_tolerance),
+                timed_builder(st.session_state, "Построение слоя маршрутов", lambda: build_selected_layer(
+                    st.session_state.selected_suppliers, st.session_state.object_coords, route_tolerance
+                ))
+            )
+
+            # Отображаем карту с обработкой кликов. Для неизменной базовой карты пропускается полная
+            # отрисовка HTML (render=False); JS-код карты streamlit-folium всё равно генерирует при каждом перезапуске
+            with timed(st.session_state, "Отрисовка карты (st_folium)"):
+                folium_map = st_folium(
+                    m,
+                    width="100%",
+                    height=600,
+                    returned_objects=["last_object_clicked"],
+                    key="supplier_map",
+                    feature_group_to_add=selected_layer,
+                    render=map_rebuilt
+                )
 
             # Обрабатываем клик по карте
             if folium_map["last_object_clicked"] is not None:
@@ -1009,6 +1029,7 @@ def display_supplier_gui():
     st.header("📋 Ведомость поставщиков")
 
     if st.session_state.delivery_data:
+        st.session_state.haul_engine.apply(st.session_state.delivery_data)
         df = pd.DataFrame(st.session_state.delivery_data)
         columns_to_show = [
             "№ п/п",
@@ -1026,9 +1047,15 @@ def display_supplier_gui():
         ]
         st.dataframe(df[columns_to_show], use_container_width=True)
 
-        # Кнопка экспорта в Excel
-        excel_href = export_to_excel(df, columns_to_show)
-        st.markdown(excel_href, unsafe_allow_html=True)
+        with st.expander("📐 Сводка по материалам"):
+            st.dataframe(st.session_state.haul_engine.summary_table(), use_container_width=True, hide_index=True)
+
+        # Экспорт в Excel: файл формируется по запросу и хранится, пока ведомость не изменится
+        excel_data = get_excel_export(st.session_state, df, columns_to_show, build=False)
+        if excel_data is None and st.button("📊 Сформировать Excel-файл"):
+            excel_data = get_excel_export(st.session_state, df, columns_to_show)
+        if excel_data is not None:
+            st.download_button("📥 Скачать Excel-файл", data=excel_data, file_name=EXCEL_FILE_NAME, mime=XLSX_MIME)
 
         # --- Легенда материалов ---
         # Создаем уникальный список материалов и их цветов
@@ -1065,76 +1092,74 @@ def display_supplier_gui():
         col1, col2, col3 = st.columns(3)
 
         with col1:
-            if st.button("💾 Сохранить карту"):
-                # Создаем карту для экспорта
-                m_export = folium.Map(location=st.session_state.object_coords, zoom_start=10)
-
-                # Добавляем объект
-                folium.CircleMarker(
-                    st.session_state.object_coords,
-                    radius=5,
-                    color="red",
-                    fill=True,
-                    fill_opacity=1.0,
-                    popup="Место размещения объекта",
-                    tooltip="Объект"
-                ).add_to(m_export)
-
-                # Добавляем выбранных поставщиков и маршруты
-                for i, supplier in enumerate(st.session_state.selected_suppliers):
-                    sup_coords = supplier['Координаты']
-                    idx = i + 1
-                    color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
-
-                    # Маркер с номером
-                    folium.Marker(
-                        sup_coords,
-                        popup=f"№{idx}: {supplier['Название компании']}",
-                        tooltip=f"Поставщик №{idx}",
-                        icon=folium.DivIcon(html=f"""
-                        <div style="
-                            background: {color};
-                            color: white;
-                            border-radius: 50%;
-                            width: 24px;
-                            height: 24px;
-                            text-align: center;
-                            line-height: 24px;
-                            font-weight: bold;
-                            font-size: 14px;
-                            box-shadow: 1px 1px 3px rgba(0,0,0,0.4);
-                        ">{idx}</div>""")
-                    ).add_to(m_export)
-
-                    # Добавляем маршрут (по дорогам или по прямой)
-                    route_coords = supplier.get('Маршрут')
-                    if route_coords:
-                        folium.PolyLine(
-                            locations=route_coords,
-                            weight=5,
-                            color=color,
-                            opacity=0.8,
-                            tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по дорогам)"
-                        ).add_to(m_export)
-                    else:
-                        folium.PolyLine(
-                            locations=[sup_coords, st.session_state.object_coords],
-                            weight=3,
-                            color=color,
-                            dash_array="10",
-                            opacity=0.6,
-                            tooltip=f"{supplier['ОКВЭД']} → {supplier['Расстояние']} км (по прямой)"
+            # Карта для экспорта собирается по запросу и отрисовывается один раз;
+            # маршруты - одним слоем GeoJSON, который можно скачать и отдельно
+            compress_map = st.checkbox("Сжать HTML карты (gzip)", key="compress_map")
+            export_key = fingerprint(st.session_state.selected_suppliers, st.session_state.object_coords, compress_map)
+            map_files = st.session_state.map_cache.peek("export", export_key)
+            if map_files is None and st.button("💾 Сохранить карту"):
+                def build_map_files():
+                    m_export = build_object_map(st.session_state.object_coords)
+                    # Детализация маршрутов для экспорта - с запасом на приближение карты
+                    route_tolerance = tolerance_for_zoom(EXPORT_ROUTE_ZOOM, st.session_state.object_coords[0])
+                    route_features = []
+
+                    # Добавляем выбранных поставщиков и маршруты
+                    for i, supplier in enumerate(st.session_state.selected_suppliers):
+                        sup_coords = supplier['Координаты']
+                        idx = i + 1
+                        color = list(AVAILABLE_COLORS.values())[i % len(AVAILABLE_COLORS)]
+
+                        # Маркер с номером
+                        folium.Marker(
+                            sup_coords,
+                            popup=f"№{idx}: {supplier['Название компании']}",
+                            tooltip=f"Поставщик №{idx}",
+                            icon=number_icon(idx, color)
                         ).add_to(m_export)
 
-                # Получаем HTML карты
-                map_html = m_export._repr_html_()
-                href = save_map_screenshot(map_html)
-                if href:
-                    st.markdown(href, unsafe_allow_html=True)
-                    st.info("Сохраните карту и откройте файл в любом браузере для просмотра интерактивной карты.")
-                    st.success("✅ Ссылка для скачивания карты создана!")
-                else:
-                    st.error("Не удалось создать ссылку для скачивания карты")
+                        # Маршрут (по дорогам или по прямой)
+                        route_coords = supplier.get('Маршрут')
+                        distance = supplier.get('Расстояние', 0)
+
+                        # Расчет времени в пути (средняя скорость 60 км/ч)
+                        travel_time_hours = distance / 60 if distance > 0 else 0
+                        hours = int(travel_time_hours)
+                        minutes = int((travel_time_hours - hours) * 60)
+
+                        if hours > 0:
+                            time_str = f"{hours}ч {minutes}мин"
+                        else:
+                            time_str = f"{minutes}мин"
+
+                        if route_coords:
+                            route_features.append(route_feature(
+                                simplify_route(route_coords, route_tolerance), color,
+                                f"{supplier['ОКВЭД']} → {distance} км (по дорогам) - {time_str}"
+                            ))
+                        else:
+                            route_features.append(route_feature(
+                                [sup_coords, st.session_state.object_coords], color,
+                                f"{supplier['ОКВЭД']} → {distance} км (оценка по прямой) - {time_str}", straight=True
+                            ))
+
+                    routes = routes_geojson(route_features)
+                    add_routes_layer(m_export, routes)
+                    return map_html_file(m_export, compress_map), geojson_bytes(routes)
+                try:
+                    map_files, _ = st.session_state.map_cache.get(
+                        "export", export_key, timed_builder(st.session_state, "Экспорт карты", build_map_files)
+                    )
+                except Exception as e:
+                    st.error("Не удалось сформировать карту для скачивания")
+                    log_error(st.session_state, "Ошибка при формировании карты для скачивания", details=str(e))
+            if map_files is not None:
+                (map_data, map_name, map_mime), routes_data = map_files
+                st.download_button("📥 Скачать HTML карты", data=map_data, file_name=map_name, mime=map_mime)
+                st.download_button("📥 Скачать маршруты (GeoJSON)", data=routes_data,
+                                   file_name=ROUTES_FILE_NAME, mime="application/geo+json")
+                st.info("Сохраните карту и откройте файл в любом браузере для просмотра интерактивной карты.")
+
 
         with col2:
             # Очистка выбранных поставщиков
@@ -1142,6 +1167,8 @@ def display_supplier_gui():
                 log_info(st.session_state, "Очистка выбранных поставщиков")
                 st.session_state.delivery_data = []
                 st.session_state.selected_suppliers = []
+                st.session_state.haul_engine = HaulEngine()
+                st.session_state.map_cache.clear()
                 st.rerun()
 
         with col3:
@@ -1160,3 +1187,8 @@ def display_supplier_gui():
                 log_info(st.session_state, "Отображение карты только с выбранными поставщиками")
     else:
         st.info("Выберите поставщиков на карте, чтобы сформировать ведомость.")
+
+    # --- Длительность этапов: где тратится время перезапуска ---
+    st.session_state.timings.record("Перезапуск скрипта", time.perf_counter() - rerun_started)
+    with st.expander("⏱️ Длительность этапов (p50 / p95 / p99)"):
+        display_timings(st.session_state)
@@ -0,0 +1,200 @@
+import io
+import os
+import json
+import hashlib
+import requests
+import numpy as np
+import pandas as pd
+from cache_utils import CACHE_DIR
+from spatial_utils import haversine_km
+
+# Локальные снимки базы поставщиков (Parquet + метаданные источника)
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "suppliers")
+SNAPSHOT_TIMEOUT = 30
+
+# Точка, дальше которой от «центра» базы координаты считаем подозрительными (км)
+SWAP_CHECK_DISTANCE_KM = 500
+
+
+def parse_coordinates(coords):
+    """
+    Векторный разбор столбца "Координаты" вида "широта, долгота".
+    Возвращает (lat, lon, valid): массивы float64 и маска корректных координат.
+    Перепутанные местами широта и долгота исправляются.
+    """
+    text = coords.astype(str)
+    parts = text.str.split(",", expand=True)
+    if parts.shape[1] < 2:
+        nan = np.full(len(text), np.nan)
+        return nan.copy(), nan.copy(), np.zeros(len(text), dtype=bool)
+
+    lat = pd.to_numeric(parts[0].str.strip(), errors="coerce").to_numpy(dtype=np.float64, copy=True)
+    lon = pd.to_numeric(parts[1].str.strip(), errors="coerce").to_numpy(dtype=np.float64, copy=True)
+    if parts.shape[1] > 2:
+        # Больше одной запятой - формат не распознан
+        extra = parts.iloc[:, 2:].notna().any(axis=1).to_numpy()
+        lat[extra] = np.nan
+        lon[extra] = np.nan
+
+    # Явная перестановка: "широта" вне диапазона, а "долгота" в него укладывается
+    swap = (np.abs(lat) > 90) & (np.abs(lat) <= 180) & (np.abs(lon) <= 90)
+    lat[swap], lon[swap] = lon[swap], lat[swap].copy()
+
+    valid = (
+        np.isfinite(lat) & np.isfinite(lon)
+        & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        & ~((lat == 0) & (lon == 0))
+    )
+
+    # Неявная перестановка: точка далеко от основной массы базы,
+    # а после перестановки оказывается рядом с ней
+    if valid.sum() > 10:
+        center_lat = np.median(lat[valid])
+        center_lon = np.median(lon[valid])
+        suspicious = valid & (np.abs(lon) <= 90)
+        if suspicious.any():
+            idx = np.flatnonzero(suspicious)
+            direct = haversine_km(center_lat, center_lon, lat[idx], lon[idx])
+            swapped = haversine_km(center_lat, center_lon, lon[idx], lat[idx])
+            fix = idx[(direct > SWAP_CHECK_DISTANCE_KM) & (swapped < SWAP_CHECK_DISTANCE_KM)]
+            lat[fix], lon[fix] = lon[fix], lat[fix].copy()
+
+    return lat, lon, valid
+
+
+def prepare_suppliers(df):
+    """
+    Подготовка базы поставщиков после чтения CSV:
+    столбцы lat/lon (0.0 для некорректных), маска coords_valid и поле info.
+    """
+    df = df.fillna('')  # Заполняем пустые значения
+
+    if 'Координаты' in df.columns:
+        lat, lon, valid = parse_coordinates(df['Координаты'])
+    else:
+        lat = lon = np.zeros(len(df))
+        valid = np.zeros(len(df), dtype=bool)
+
+    df['lat'] = np.where(valid, lat, 0.0)
+    df['lon'] = np.where(valid, lon, 0.0)
+    df['coords_valid'] = valid
+
+    # Создаем информационное поле
+    df['info'] = (
+        df['Название компании'].astype(str)
+        + "\nИНН: " + df['ИНН'].astype(str)
+        + "\nАдрес: " + df['Адрес компании'].astype(str)
+    )
+    return df
+
+
+def get_okved_list(df):
+    """Отсортированный список уникальных непустых ОКВЭД"""
+    okved_list = df['Главный ОКВЭД (название)'].unique().tolist()
+    okved_list = [x for x in okved_list if x]
+    okved_list.sort()
+    return okved_list
+
+
+def category_distance_table(suppliers, object_coords, model):
+    """
+    Расстояния от объекта до всех поставщиков категории одной векторной операцией:
+    по прямой и оценка по дорогам (model - модель извилистости дорог), без запросов к API.
+    Столбец расстояний по дорогам заполняется позже. Индекс - индекс строк suppliers.
+    """
+    valid = suppliers[suppliers['coords_valid']]
+    straight, estimate = model.estimate_km(
+        object_coords[0], object_coords[1], valid['lat'].to_numpy(), valid['lon'].to_numpy()
+    )
+    return pd.DataFrame({
+        "Название компании": valid['Название компании'].values,
+        "ИНН": valid['ИНН'].values,
+        "Адрес компании": valid['Адрес компании'].values,
+        "По прямой, км": np.round(straight, 2),
+        "Оценка по дорогам, км": np.round(estimate, 2),
+        "Расстояние по дорогам, км": np.nan
+    }, index=valid.index).sort_values("Оценка по дорогам, км")
+
+
+def _snapshot_paths(url):
+    """Пути к файлу снимка и его метаданным для данного источника"""
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(SNAPSHOT_DIR, name)
+    return base + ".parquet", base + ".json"
+
+
+def _read_snapshot_meta(meta_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_local_snapshot(url):
+    """Загружает последний сохранённый снимок базы (или None, если его нет)"""
+    data_path, meta_path = _snapshot_paths(url)
+    if not os.path.exists(data_path) or _read_snapshot_meta(meta_path) is None:
+        return None
+    return pd.read_parquet(data_path)
+
+
+def _save_snapshot(url, df, meta):
+    """Атомарно записывает снимок и метаданные"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    data_path, meta_path = _snapshot_paths(url)
+    df.to_parquet(data_path + ".tmp", index=False)
+    os.replace(data_path + ".tmp", data_path)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def load_suppliers_snapshot(url):
+    """
+    Загружает базу поставщиков с условным обновлением локального снимка.
+    Возвращает (df, source), где source:
+      "remote"    - файл изменился, скачан и разобран заново;
+      "unchanged" - источник не изменился, использован локальный снимок;
+      "offline"   - источник недоступен, использован локальный снимок.
+    Если источник недоступен и снимка нет - пробрасывает исключение.
+    """
+    data_path, meta_path = _snapshot_paths(url)
+    meta = _read_snapshot_meta(meta_path) if os.path.exists(data_path) else None
+
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = requests.get(url, headers=headers, timeout=SNAPSHOT_TIMEOUT)
+        if response.status_code == 304 and meta:
+            return pd.read_parquet(data_path), "unchanged"
+        response.raise_for_status()
+    except requests.RequestException:
+        if meta:
+            return pd.read_parquet(data_path), "offline"
+        raise
+
+    content = response.content
+    content_hash = hashlib.sha256(content).hexdigest()
+    if meta and meta.get("content_hash") == content_hash:
+        # Сервер не поддерживает ETag, но содержимое то же - повторный разбор не нужен
+        return pd.read_parquet(data_path), "unchanged"
+
+    df = prepare_suppliers(pd.read_csv(io.BytesIO(content)))
+    # После fillna('') в текстовых столбцах бывают смешанные типы - приводим к строкам
+    object_columns = [c for c in df.columns if df[c].dtype == object]
+    df = df.astype({c: str for c in object_columns})
+
+    _save_snapshot(url, df, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+        "rows": len(df)
+    })
+    return df, "remote"
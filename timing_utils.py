@@ -0,0 +1,111 @@
+import time
+import functools
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
+import numpy as np
+
+# Сколько последних замеров каждого этапа учитывается в перцентилях
+TIMING_WINDOW = 500
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimings:
+    """
+    Длительности этапов в скользящих окнах (последние window замеров) и счётчики вызовов API.
+    Потокобезопасен: замеры приходят и из фоновых потоков (пул геокодирования, цикл asyncio).
+    """
+
+    def __init__(self, window=TIMING_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._totals = Counter()
+        self._calls = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, api=None):
+        """Добавляет замер этапа; api - учесть вызов внешнего API"""
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._totals[stage] += 1
+            if api is not None:
+                self._calls[api] += 1
+
+    @contextmanager
+    def span(self, stage, api=None):
+        """Замер длительности блока with (записывается и при исключении)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started, api)
+
+    def summary(self):
+        """Строки для таблицы: этап, всего замеров, перцентили и максимум окна в мс"""
+        with self._lock:
+            stages = [(stage, np.array(samples), self._totals[stage]) for stage, samples in self._samples.items()]
+        rows = []
+        for stage, samples, total in stages:
+            p50, p95, p99 = np.percentile(samples, PERCENTILES) * 1000
+            rows.append({
+                "Этап": stage,
+                "Замеров": total,
+                "p50, мс": round(p50, 1),
+                "p95, мс": round(p95, 1),
+                "p99, мс": round(p99, 1),
+                "Максимум, мс": round(samples.max() * 1000, 1),
+            })
+        return rows
+
+    def calls(self):
+        """Число вызовов по API"""
+        with self._lock:
+            return dict(self._calls)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._calls.clear()
+
+
+@contextmanager
+def timed(session_state, stage):
+    """Замер этапа в журнал длительностей сессии (session_state.timings), если он заведён"""
+    timings = getattr(session_state, "timings", None)
+    if timings is None:
+        yield
+        return
+    with timings.span(stage):
+        yield
+
+
+def timed_stage(stage):
+    """Декоратор: замер функции, первый аргумент которой - session_state"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(session_state, *args, **kwargs):
+            with timed(session_state, stage):
+                return func(session_state, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_builder(session_state, stage, build):
+    """Обёртка построителя для кэшей: замер записывается, только если build() действительно вызван"""
+    def wrapper():
+        with timed(session_state, stage):
+            return build()
+    return wrapper
+
+
+# Вызовы внешних API общие для всех сессий (клиенты и лимиты частоты тоже общие)
+_api_timings = StageTimings()
+
+
+def get_api_timings():
+    """Длительности запросов и ожидания лимитов внешних API (общие для процесса)"""
+    return _api_timings
@@ -0,0 +1,223 @@
+import heapq
+import numpy as np
+from utils import get_distances_to_object_ors, make_delivery_record, log_info, log_warning
+from import_utils import route_rows
+from spatial_utils import simplify_route, SESSION_ROUTE_TOLERANCE_M
+from detour_utils import get_detour_model
+from haul_utils import HaulEngine
+
+# Объёмы меньше этого значения считаются нулевыми
+VOLUME_EPS = 1e-9
+
+
+class TransportProblemError(ValueError):
+    """Распределение невозможно: нет поставщиков материала или их мощности меньше потребности"""
+
+
+def distance_matrix(session_state, ors_client, supplier_coords, site_coords):
+    """
+    Расстояния поставщик × объект по дорогам (км): по одному запросу Matrix API на объект,
+    известные пары - из кэша маршрутов. Для недоступных по дорогам пар расстояние
+    оценивается по прямой с коэффициентом извилистости дорог.
+    Возвращает (матрица S×T, маска пар с оценкой по прямой).
+    """
+    distances = np.full((len(supplier_coords), len(site_coords)), np.nan)
+    for j, site in enumerate(site_coords):
+        column = get_distances_to_object_ors(session_state, ors_client, supplier_coords, site)
+        distances[:, j] = [np.nan if d is None else d for d in column]
+
+    straight = np.isnan(distances)
+    if straight.any():
+        model = get_detour_model()
+        lats = np.array([c[0] for c in supplier_coords])
+        lons = np.array([c[1] for c in supplier_coords])
+        for j, (lat, lon) in enumerate(site_coords):
+            rows = straight[:, j]
+            _, estimate = model.estimate_km(lat, lon, lats[rows], lons[rows])
+            distances[rows, j] = np.round(estimate, 2)
+        log_warning(session_state, f"Пар поставщик-объект без маршрута по дорогам: {int(straight.sum())}, "
+                                   f"расстояние оценено по прямой с учётом извилистости дорог")
+    return distances, straight
+
+
+def _min_cost_flow(costs, supply, demand):
+    """
+    Поток минимальной стоимости источник → поставщики → объекты → сток
+    (последовательные кратчайшие пути, Дейкстра с потенциалами).
+    Возвращает (матрица объёмов S×T, нераспределённый остаток потребности).
+    """
+    n_sup, n_site = costs.shape
+    source, sink = n_sup + n_site, n_sup + n_site + 1
+    graph = [[] for _ in range(n_sup + n_site + 2)]
+
+    # Ребро: [куда, остаточная пропускная способность, стоимость, номер обратного ребра]
+    def add_edge(u, v, capacity, cost):
+        graph[u].append([v, capacity, cost, len(graph[v])])
+        graph[v].append([u, 0.0, -cost, len(graph[u]) - 1])
+
+    total = float(np.sum(demand))
+    for i in range(n_sup):
+        add_edge(source, i, min(supply[i], total), 0.0)
+        for j in range(n_site):
+            if np.isfinite(costs[i, j]):
+                add_edge(i, n_sup + j, total, float(costs[i, j]))
+    for j in range(n_site):
+        add_edge(n_sup + j, sink, float(demand[j]), 0.0)
+
+    potential = [0.0] * len(graph)
+    remaining = total
+    while remaining > VOLUME_EPS:
+        dist = [float("inf")] * len(graph)
+        prev = [None] * len(graph)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e, (v, capacity, cost, _) in enumerate(graph[u]):
+                if capacity <= VOLUME_EPS:
+                    continue
+                nd = d + max(cost + potential[u] - potential[v], 0.0)
+                if nd < dist[v]:
+                    dist[v] = nd
+                    prev[v] = (u, e)
+                    heapq.heappush(heap, (nd, v))
+        if prev[sink] is None:
+            break
+        for v, d in enumerate(dist):
+            if d < float("inf"):
+                potential[v] += d
+
+        push, v = remaining, sink
+        while v != source:
+            u, e = prev[v]
+            push = min(push, graph[u][e][1])
+            v = u
+        v = sink
+        while v != source:
+            u, e = prev[v]
+            edge = graph[u][e]
+            edge[1] -= push
+            graph[v][edge[3]][1] += push
+            v = u
+        remaining -= push
+
+    volumes = np.zeros((n_sup, n_site))
+    for i in range(n_sup):
+        for v, _, _, rev in graph[i]:
+            if n_sup <= v < n_sup + n_site:
+                volumes[i, v - n_sup] = graph[v][rev][1]
+    return volumes, remaining
+
+
+def solve_transport(distances, capacities, demands):
+    """
+    Транспортная задача: объёмы поставок с минимальной транспортной работой (объём × км).
+    distances - матрица S×T (np.inf - перевозка невозможна), capacities - мощности поставщиков
+    (None - без ограничения), demands - потребности объектов. Возвращает матрицу объёмов S×T.
+    """
+    distances = np.asarray(distances, dtype=float)
+    demands = np.asarray(demands, dtype=float)
+    supply = np.array([float("inf") if c is None else float(c) for c in capacities])
+    if supply.sum() + VOLUME_EPS < demands.sum():
+        raise TransportProblemError(
+            f"Суммарная мощность поставщиков ({supply.sum():g}) меньше потребности ({demands.sum():g})"
+        )
+    volumes, remaining = _min_cost_flow(distances, supply, demands)
+    if remaining > VOLUME_EPS:
+        raise TransportProblemError(f"Не удалось распределить {remaining:g}: объекты недоступны для поставщиков")
+    return volumes
+
+
+def assign_suppliers(session_state, ors_client, suppliers, sites, demands):
+    """
+    Распределение поставщиков по объектам отдельно для каждого материала.
+    suppliers: [{"name", "material", "work_type", "address", "coords", "color", "capacity"}]
+    sites: [{"name", "address", "coords"}]
+    demands: {(номер объекта, материал): потребность}
+    Возвращает (план [(номер поставщика, номер объекта, объём)], матрица расстояний, маска «по прямой»).
+    """
+    distances, straight = distance_matrix(
+        session_state, ors_client, [s["coords"] for s in suppliers], [s["coords"] for s in sites]
+    )
+    plan = []
+    materials = list(dict.fromkeys(material for _, material in demands))
+    for material in materials:
+        cols = [j for j in range(len(sites)) if demands.get((j, material), 0) > 0]
+        rows = [i for i, s in enumerate(suppliers) if s["material"] == material]
+        if not cols:
+            continue
+        if not rows:
+            raise TransportProblemError(f"Нет поставщиков материала «{material}»")
+        try:
+            volumes = solve_transport(
+                distances[np.ix_(rows, cols)],
+                [suppliers[i]["capacity"] for i in rows],
+                [demands[(j, material)] for j in cols]
+            )
+        except TransportProblemError as e:
+            raise TransportProblemError(f"{material}: {e}")
+        for a, i in enumerate(rows):
+            for b, j in enumerate(cols):
+                if volumes[a, b] > VOLUME_EPS:
+                    plan.append((i, j, float(volumes[a, b])))
+    log_info(session_state, f"Распределение рассчитано: {len(suppliers)} поставщиков, {len(sites)} объектов, "
+                            f"поставок: {len(plan)}")
+    return plan, distances, straight
+
+
+def plan_routes(session_state, ors_client, plan, suppliers, sites):
+    """Геометрия маршрутов для поставок плана: {(поставщик, объект): route_coords}"""
+    routes = {}
+    for j, site in enumerate(sites):
+        rows = [{"coords": suppliers[i]["coords"], "key": (i, j)} for i, site_j, _ in plan if site_j == j]
+        if rows:
+            route_rows(session_state, ors_client, rows, site["coords"])
+            for row in rows:
+                # В сессии храним упрощённую геометрию, полная остаётся в кэше маршрутов
+                routes[row["key"]] = simplify_route(row.get("route_coords"), SESSION_ROUTE_TOLERANCE_M)
+    return routes
+
+
+def plan_records(plan, suppliers, sites, demands, distances, routes=None):
+    """
+    Строки ведомости по плану: доля поставщика в потребности объекта и
+    средневзвешенная дальность возки материала на объект.
+    """
+    routes = routes or {}
+    records = []
+    for i, j, volume in sorted(plan, key=lambda p: (p[1], suppliers[p[0]]["material"], distances[p[0], p[1]])):
+        supplier, site = suppliers[i], sites[j]
+        demand = demands[(j, supplier["material"])]
+        site_label = f"{site['name']}: {site['address']}" if site.get("name") else site["address"]
+        records.append(make_delivery_record(
+            len(records) + 1, supplier["material"], supplier["work_type"], supplier["name"], supplier["address"],
+            site_label, round(float(distances[i, j]), 2), supplier["color"], supplier["coords"], site["coords"],
+            routes.get((i, j)), share=round(volume / demand * 100, 1)
+        ))
+    return HaulEngine().apply(records)
+
+
+def candidates_from_records(records, existing=()):
+    """
+    Поставщики-кандидаты: ранее заданные (с мощностями) и новые из строк ведомости.
+    Поставщик определяется наименованием, материалом и координатами.
+    """
+    candidates = list(existing)
+    seen = {(c["name"], c["material"], tuple(c["coords"])) for c in candidates}
+    for record in records:
+        key = (record["Наименование поставщика"], record["Наименование материала"], tuple(record["supplier_coords"]))
+        if key in seen:
+            continue
+        seen.add(key)
+        candidates.append({
+            "name": key[0],
+            "material": key[1],
+            "work_type": record["Вид работ"],
+            "address": record["Адрес"],
+            "coords": key[2],
+            "color": record["Цвет"],
+            "capacity": None,
+        })
+    return candidates
@@ -1,41 +1,57 @@
 import time
-import random
-import traceback
 from datetime import datetime
-from geopy.geocoders import Nominatim
-from tenacity import retry, stop_after_attempt, wait_fixed
 import openrouteservice
 from openrouteservice import convert
-from geopy.distance import geodesic
+from cache_utils import get_geocode_cache, get_route_cache
+from detour_utils import get_detour_model
+from event_log import capture_traceback, write_event
+from timing_utils import get_api_timings, timed_stage
+from api_limits import get_api_guard, ApiUnavailableError
+from geocode_utils import get_geocoding_engine
+from offline_routing import get_offline_router, RoutingError
+from ors_async import (
+    get_async_ors_client, iter_routes, ors_error_code, ORSRequestError, ORS_BASE_URL, ORS_DIRECTIONS_PER_MINUTE,
+    ROUTE_WORKERS, UNROUTABLE_CODES
+)
 
 # --- Функции для логирования ---
-def log_error(session_state, message, error_type="ERROR", details=None):
-    """Добавляет ошибку в лог с временной меткой"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    error_entry = {
-        "time": timestamp,
+def log_error(session_state, message, error_type="ERROR", details=None, exc=None, **fields):
+    """
+    Добавляет событие в журнал сессии (кольцевой буфер) и в файловый журнал.
+    exc - снимок трассировки (capture_traceback), fields - структурные поля: api, status, latency_ms и т.п.
+    """
+    created = time.time()
+    entry = {
+        "created": created,
+        "time": datetime.fromtimestamp(created).strftime("%H:%M:%S"),
         "type": error_type,
         "message": message,
-        "details": details if details else ""
+        "details": details if details else "",
+        "fields": {key: value for key, value in fields.items() if value is not None},
+        "traceback": exc
     }
-    session_state.error_log.append(error_entry)
-    # Ограничиваем размер лога (последние 50 записей)
-    if len(session_state.error_log) > 50:
-        session_state.error_log = session_state.error_log[-50:]
+    # Размер журнала ограничен самим буфером (EventLog), старые записи вытесняются без копирования
+    session_state.error_log.append(entry)
+    write_event(entry)
 
-def log_info(session_state, message):
+def log_info(session_state, message, **fields):
     """Добавляет информационное сообщение в лог"""
-    log_error(session_state, message, "INFO")
+    log_error(session_state, message, "INFO", **fields)
 
-def log_warning(session_state, message, details=None):
+def log_warning(session_state, message, details=None, **fields):
     """Добавляет предупреждение в лог"""
-    log_error(session_state, message, "WARNING", details)
+    log_error(session_state, message, "WARNING", details, **fields)
 
-def log_api_error(session_state, api_name, error, details=None):
-    """Специальная функция для логирования ошибок API"""
-    error_message = f"Ошибка API {api_name}: {str(error)}"
-    full_details = f"Подробности: {details}\nТрассировка: {traceback.format_exc()}" if details else traceback.format_exc()
-    log_error(session_state, error_message, "API_ERROR", full_details)
+def log_api_error(session_state, api_name, error, details=None, **fields):
+    """Специальная функция для логирования ошибок API: трассировка форматируется только при просмотре"""
+    status = getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(error, "status_code", None)
+    log_error(
+        session_state, f"Ошибка API {api_name}: {str(error)}", "API_ERROR",
+        f"Подробности: {details}" if details else None, capture_traceback(error),
+        api=api_name, status=status if isinstance(status, int) else None, **fields
+    )
 
 # --- Словари ---
 MATERIAL_COLORS = {
@@ -72,35 +88,101 @@ def normalize_address(addr):
     addr = addr.replace("ул.", "улица")
     return addr
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def geocode_address(session_state, address):
-    user_agent = f"transport_app_{random.randint(1000, 9999)}"
-    geolocator = Nominatim(user_agent=user_agent)
+def _geocode_request(session_state, address):
+    """Возвращает (coords, full_addr, failed); failed=True при ошибке API"""
     try:
         log_info(session_state, f"Запрос геокодирования для адреса: {address}")
-        time.sleep(1.5 + random.uniform(0.5, 1.0))
-        location = geolocator.geocode(address, timeout=10)
-        if location:
-            log_info(session_state, f"Геокодирование успешно: {location.address}")
-            return (location.latitude, location.longitude), location.address
+        started = time.perf_counter()
+        coords, full_addr = get_geocoding_engine().geocode(address)
+        if coords:
+            log_info(session_state, f"Геокодирование успешно: {full_addr}",
+                     latency_ms=(time.perf_counter() - started) * 1000)
+            return coords, full_addr, False
         else:
             log_warning(session_state, f"Геокодирование не дало результатов для адреса: {address}")
-            return None, None
+            return None, None, False
+    except ApiUnavailableError as e:
+        log_warning(session_state, f"{e}. Адрес не геокодирован: {address}")
+        return None, None, True
     except Exception as e:
         log_api_error(session_state, "Nominatim", e, f"Адрес: {address}")
-        return None, None
+        return None, None, True
 
+def geocode_address(session_state, address):
+    coords, full_addr, _ = _geocode_request(session_state, address)
+    return coords, full_addr
+
+@timed_stage("Геокодирование")
 def geocode_address_cached(session_state, address):
     normalized = normalize_address(address)
-    if normalized in session_state.geocode_cache:
+    cache = get_geocode_cache()
+    found, coords, full_addr = cache.get(normalized)
+    if found:
         log_info(session_state, f"Использование кэшированных координат для: {normalized}")
-        return session_state.geocode_cache[normalized]
-    coords, full_addr = geocode_address(session_state, normalized)
-    session_state.geocode_cache[normalized] = (coords, full_addr)
+        return coords, full_addr
+    coords, full_addr, failed = _geocode_request(session_state, normalized)
+    # Ошибки API не кэшируем, "адрес не найден" - кэшируем с коротким TTL
+    if not failed:
+        cache.set(normalized, coords, full_addr)
     return coords, full_addr
 
+def geocode_addresses_cached(session_state, addresses):
+    """
+    Пакетное геокодирование с учётом кэша и лимита частоты Nominatim.
+    Генератор выдаёт (address, coords, full_addr) по мере готовности.
+    """
+    normalized = {}
+    for address in addresses:
+        normalized.setdefault(normalize_address(address), []).append(address)
+
+    log_info(session_state, f"Пакетное геокодирование: {len(addresses)} адресов, уникальных: {len(normalized)}")
+    for norm_address, coords, full_addr, error in get_geocoding_engine().geocode_many(list(normalized)):
+        if isinstance(error, ApiUnavailableError):
+            log_warning(session_state, f"{error}. Адрес не геокодирован: {norm_address}")
+        elif error is not None:
+            log_api_error(session_state, "Nominatim", error, f"Адрес: {norm_address}")
+        elif coords is None:
+            log_warning(session_state, f"Геокодирование не дало результатов для адреса: {norm_address}")
+        for address in normalized[norm_address]:
+            yield address, coords, full_addr
+
+def make_delivery_record(idx, material, work_type, supplier_name, sup_full_addr, obj_full_addr,
+                         road_distance, color, sup_coords, obj_coords, route_coords,
+                         share=100):
+    """
+    Строка ведомости доставки материалов (с координатами и маршрутом для карты).
+    share - доля поставщика в потребности объекта, %. Средняя дальность возки
+    пересчитывается по всем поставщикам материала (haul_utils.HaulEngine).
+    """
+    return {
+        "№ п/п": idx,
+        "Наименование материала": material,
+        "% от общей потребности": share,
+        "Вид работ": work_type,
+        "Наименование поставщика": supplier_name,
+        "Адрес": sup_full_addr,
+        "Вид \"франко\" для данного материала": "-",
+        "Железнодорожные перевозки %": "-",
+        "Станции назначения, на которую прибывает материал": obj_full_addr,
+        "Расстояние перевозки, км": road_distance,
+        "Автомобильные перевозки %": 100,
+        "Средняя дальность возки, км": road_distance,
+        "Цвет": color,
+        "supplier_coords": sup_coords,
+        "object_coords": obj_coords,
+        "route_coords": route_coords
+    }
+
 # --- Инициализация клиента OpenRouteService ---
+_ors_clients = {}
+
 def init_ors_client(session_state, api_key=None):
+    # Локальный граф дорог (OFFLINE_ROUTING_GRAPH) заменяет ORS: без ключа, квот и сети
+    offline_router = get_offline_router()
+    if offline_router is not None:
+        log_info(session_state, "Используется локальная маршрутизация по графу дорог")
+        return offline_router
+
     try:
         # Используем переданный ключ или берем из session_state
         if api_key:
@@ -110,19 +192,129 @@ def init_ors_client(session_state, api_key=None):
         else:
             return None
 
-        ors_client = openrouteservice.Client(key=ors_key)
-        log_info(session_state, "Подключение к OpenRouteService успешно")
+        # Клиент (и его HTTP-сессия) создаётся один раз на ключ, а не при каждом запуске скрипта
+        ors_client = _ors_clients.get(ors_key)
+        if ors_client is None:
+            # Повторы при 429 выключены: ими управляет предохранитель (api_limits), а не ожидание до минуты
+            ors_client = openrouteservice.Client(key=ors_key, base_url=ORS_BASE_URL, retry_over_query_limit=False)
+            _ors_clients[ors_key] = ors_client
+            log_info(session_state, "Подключение к OpenRouteService успешно")
         return ors_client
     except Exception as e:
         log_api_error(session_state, "OpenRouteService", e, "Ошибка инициализации клиента")
         return None
 
+def _is_remote_ors(ors_client):
+    """Клиент обращается к удалённому ORS (квота, предохранитель, отрицательный кэш), а не к локальному графу"""
+    return isinstance(ors_client, openrouteservice.Client)
+
+def _ors_call(ors_client, method, **kwargs):
+    """Запрос к ORS; к удалённому - под защитой суточной квоты и предохранителя"""
+    call = getattr(ors_client, method)
+    if not _is_remote_ors(ors_client):
+        with get_api_timings().span(f"Локальный граф дорог: {method}", api="Локальный граф дорог"):
+            return call(**kwargs)
+    with get_api_timings().span(f"ORS: {method}", api="ORS"):
+        return get_api_guard("ors").call(call, **kwargs)
+
+def _parse_ors_route(result):
+    """Маршрут из ответа ORS (GeoJSON): (список координат (lat, lon), расстояние в км, время в секундах)"""
+    geometry = result['features'][0]['geometry']
+
+    # Проверяем тип геометрии и декодируем соответственно
+    if geometry['type'] == 'LineString':
+        # Обычная LineString геометрия - используем координаты напрямую
+        route_coords = [(point[1], point[0]) for point in geometry['coordinates']]  # (lat, lon)
+    else:
+        # Если геометрия закодирована - декодируем
+        decoded = convert.decode_polyline(geometry)
+        route_coords = [(point[1], point[0]) for point in decoded['coordinates']]  # (lat, lon)
+
+    # Получаем расстояние из свойств маршрута
+    segment = result['features'][0]['properties']['segments'][0]
+    distance_km = round(segment['distance'] / 1000, 2)
+    return route_coords, distance_km, segment.get('duration')
+
+def _straight_line(session_state, origin_coords, destination_coords, reason):
+    """Резервный результат без маршрута: (None, оценка расстояния по дорогам в км по прямой и извилистости)"""
+    try:
+        straight, estimate = get_detour_model().estimate_km(
+            origin_coords[0], origin_coords[1], [destination_coords[0]], [destination_coords[1]]
+        )
+        dist = round(float(estimate[0]), 2)
+        log_warning(session_state, f"Используется оценка по прямой: {dist} км "
+                                   f"(по прямой {float(straight[0]):.2f} км × коэффициент извилистости дорог)", reason)
+        return None, dist
+    except Exception as fallback_error:
+        log_api_error(session_state, "Haversine", fallback_error, "Ошибка при расчёте расстояния по прямой")
+        return None, 0
+
+def _route_fallback(session_state, error, origin_coords, destination_coords):
+    """Логирует ошибку ORS и возвращает резервный результат: (None, расстояние по прямой)"""
+    # Квота исчерпана или ORS недоступен - запрос не выполнялся, трассировка не нужна
+    if isinstance(error, ApiUnavailableError):
+        return _straight_line(session_state, origin_coords, destination_coords, str(error))
+
+    # Локальный граф дорог: точка вне графа или нет пути - это не ошибка API
+    if isinstance(error, RoutingError):
+        log_warning(session_state, f"Локальный граф дорог не построил маршрут от {origin_coords} "
+                                   f"до {destination_coords}", str(error))
+        return _straight_line(session_state, origin_coords, destination_coords, "Маршрут по локальному графу не найден")
+
+    # Маршрут невозможен (точка далеко от дорог и т.п.) - запоминаем пару, чтобы не запрашивать повторно
+    code = ors_error_code(error)
+    if code in UNROUTABLE_CODES:
+        get_route_cache().set_failure(origin_coords, destination_coords, code, str(error), 'driving-car')
+        log_warning(session_state, f"ORS не может построить маршрут от {origin_coords} до {destination_coords} "
+                                   f"(код {code})", str(error))
+        return _straight_line(session_state, origin_coords, destination_coords, f"Код ошибки ORS {code}")
+
+    # Детальное логирование ошибки API
+    error_details = f"От: {origin_coords}, До: {destination_coords}"
+    if isinstance(error, ORSRequestError):
+        error_details += f"\nHTTP статус: {error.status}\nОтвет сервера: {error.body}"
+    elif hasattr(error, 'response') and error.response:
+        error_details += f"\nHTTP статус: {error.response.status_code}"
+        try:
+            error_details += f"\nОтвет сервера: {error.response.json()}"
+        except:
+            error_details += f"\nОтвет сервера: {error.response.text}"
+    elif hasattr(error, 'args') and error.args:
+        error_details += f"\nДетали ошибки: {error.args[0]}"
+
+    log_api_error(session_state, "OpenRouteService", error, error_details)
+
+    # Резерв: расстояние по прямой
+    return _straight_line(session_state, origin_coords, destination_coords, "Ошибка ORS API")
+
+def _cached_failure(session_state, ors_client, origin_coords, destination_coords, profile='driving-car'):
+    """Код ошибки из отрицательного кэша, если удалённый ORS уже не смог построить этот маршрут"""
+    if not _is_remote_ors(ors_client):
+        return None
+    failure = get_route_cache().get_failure(origin_coords, destination_coords, profile)
+    if failure is None:
+        return None
+    log_info(session_state, f"Маршрут от {origin_coords} до {destination_coords} ранее не был построен "
+                            f"(код {failure[0]}), запрос не выполняется")
+    return failure
+
+@timed_stage("Маршрут")
 def get_route_ors(session_state, ors_client, origin_coords, destination_coords):
     """
     origin_coords: (lat, lon)
     destination_coords: (lat, lon)
     Возвращает: маршрут (список координат), расстояние в км
     """
+    # Сначала смотрим в постоянный кэш маршрутов - без обращения к сети
+    route_cache = get_route_cache()
+    cached = route_cache.get(origin_coords, destination_coords, 'driving-car')
+    if cached is not None and cached[0]:
+        route_coords, distance_km, _ = cached
+        log_info(session_state, f"Использование кэшированного маршрута: {distance_km} км, точек: {len(route_coords)}")
+        return route_coords, distance_km
+    if _cached_failure(session_state, ors_client, origin_coords, destination_coords):
+        return _straight_line(session_state, origin_coords, destination_coords, "Маршрут невозможен (кэш ошибок)")
+
     try:
         log_info(session_state, f"Запрос маршрута ORS от {origin_coords} до {destination_coords}")
         coords = [(origin_coords[1], origin_coords[0]), (destination_coords[1], destination_coords[0])]
@@ -131,52 +323,149 @@ def get_route_ors(session_state, ors_client, origin_coords, destination_coords):
         log_info(session_state, f"Параметры запроса ORS: coordinates={coords}, profile='driving-car'")
 
         # Убираем некорректный параметр extra_info
-        result = ors_client.directions(
+        started = time.perf_counter()
+        result = _ors_call(
+            ors_client, 'directions',
             coordinates=coords,
             profile='driving-car',
             format='geojson'
             # Убрали: extra_info=['total_distance'] - этот параметр вызывает ошибку 2003
         )
 
-        log_info(session_state, "Получен успешный ответ от ORS API")
+        log_info(session_state, "Получен успешный ответ от ORS API", api="ORS",
+                 latency_ms=(time.perf_counter() - started) * 1000)
+        route_coords, distance_km, duration = _parse_ors_route(result)
+        route_cache.set(origin_coords, destination_coords, route_coords, distance_km, duration, 'driving-car')
 
-        geometry = result['features'][0]['geometry']
+        log_info(session_state, f"Маршрут построен успешно, расстояние: {distance_km} км, точек: {len(route_coords)}")
+        return route_coords, distance_km
 
-        # Проверяем тип геометрии и декодируем соответственно
-        if geometry['type'] == 'LineString':
-            # Обычная LineString геометрия - используем координаты напрямую
-            route_coords = [(point[1], point[0]) for point in geometry['coordinates']]  # (lat, lon)
+    except Exception as e:
+        return _route_fallback(session_state, e, origin_coords, destination_coords)
+
+def iter_routes_ors(session_state, ors_client, pairs, rate_per_minute=ORS_DIRECTIONS_PER_MINUTE,
+                    concurrency=ROUTE_WORKERS):
+    """
+    Маршруты для списка пар (откуда, куда) - генератор (номер пары, (маршрут, расстояние в км))
+    по мере готовности. Маршруты из кэша выдаются сразу, остальные к удалённому ORS
+    запрашиваются параллельно асинхронным клиентом с пулом соединений и лимитом частоты.
+    """
+    route_cache = get_route_cache()
+    pending = []
+    for i, (origin, destination) in enumerate(pairs):
+        cached = route_cache.get(origin, destination, 'driving-car')
+        if cached is not None and cached[0]:
+            yield i, (cached[0], cached[1])
+        elif _cached_failure(session_state, ors_client, origin, destination):
+            yield i, _straight_line(session_state, origin, destination, "Маршрут невозможен (кэш ошибок)")
         else:
-            # Если геометрия закодирована - декодируем
-            decoded = convert.decode_polyline(geometry)
-            route_coords = [(point[1], point[0]) for point in decoded['coordinates']]  # (lat, lon)
+            pending.append(i)
+    if not pending:
+        return
 
-        # Получаем расстояние из свойств маршрута
-        distance_meters = result['features'][0]['properties']['segments'][0]['distance']
-        distance_km = round(distance_meters / 1000, 2)
+    if not isinstance(ors_client, openrouteservice.Client) or not session_state.ors_api_key:
+        # Локальный граф дорог отвечает без сети, без клиента - расчёт по прямой
+        for i in pending:
+            yield i, get_route_ors(session_state, ors_client, *pairs[i])
+        return
 
+    guard = get_api_guard("ors")
+    if not guard.available():
+        # Не тратим время на заведомо отклоняемые запросы: сразу расчёт по прямой
+        log_warning(session_state, f"ORS недоступен, маршруты не запрашиваются: {len(pending)}", str(guard.status()))
+        for i in pending:
+            yield i, _straight_line(session_state, *pairs[i], "ORS недоступен")
+        return
+
+    log_info(session_state, f"Параллельный запрос маршрутов ORS: {len(pending)}")
+    client = get_async_ors_client(session_state.ors_api_key, rate_per_minute, concurrency)
+    for k, result in iter_routes(client, [pairs[i] for i in pending]):
+        i = pending[k]
+        origin, destination = pairs[i]
+        try:
+            if isinstance(result, Exception):
+                raise result
+            route_coords, distance_km, duration = _parse_ors_route(result)
+        except Exception as e:
+            yield i, _route_fallback(session_state, e, origin, destination)
+            continue
+        route_cache.set(origin, destination, route_coords, distance_km, duration, 'driving-car')
         log_info(session_state, f"Маршрут построен успешно, расстояние: {distance_km} км, точек: {len(route_coords)}")
-        return route_coords, distance_km
+        yield i, (route_coords, distance_km)
 
-    except Exception as e:
-        # Детальное логирование ошибки API
-        error_details = f"От: {origin_coords}, До: {destination_coords}"
-        if hasattr(e, 'response') and e.response:
-            error_details += f"\nHTTP статус: {e.response.status_code}"
-            try:
-                error_details += f"\nОтвет сервера: {e.response.json()}"
-            except:
-                error_details += f"\nОтвет сервера: {e.response.text}"
-        elif hasattr(e, 'args') and e.args:
-            error_details += f"\nДетали ошибки: {e.args[0]}"
-
-        log_api_error(session_state, "OpenRouteService", e, error_details)
-
-        # Резерв: расстояние по прямой
+# Лимит ORS Matrix API: произведение источников и назначений в одном запросе
+ORS_MATRIX_MAX_ROUTES = 3500
+
+@timed_stage("Матрица расстояний")
+def get_distances_to_object_ors(session_state, ors_client, origins, destination_coords, profile='driving-car'):
+    """
+    origins: список координат поставщиков [(lat, lon), ...]
+    destination_coords: (lat, lon) объекта
+    Возвращает: список расстояний по дорогам в км (None, если не удалось), в порядке origins.
+    Геометрия маршрутов не запрашивается - только таблица расстояний через Matrix API.
+    """
+    route_cache = get_route_cache()
+    distances = [None] * len(origins)
+
+    # Уже известные пары берём из кэша, уникальные неизвестные - запрашиваем
+    pending = {}
+    for i, origin in enumerate(origins):
+        cached = route_cache.get(origin, destination_coords, profile)
+        if cached is not None:
+            distances[i] = cached[1]
+        elif _is_remote_ors(ors_client) and route_cache.get_failure(origin, destination_coords, profile):
+            # Маршрут невозможен - расстояние останется неизвестным без запроса к ORS
+            continue
+        else:
+            pending.setdefault((round(origin[0], 5), round(origin[1], 5)), []).append(i)
+
+    if not pending:
+        log_info(session_state, f"Все {len(origins)} расстояний взяты из кэша маршрутов")
+        return distances
+    if ors_client is None:
+        log_warning(session_state, "Клиент ORS не инициализирован, расчёт матрицы расстояний невозможен")
+        return distances
+
+    unique_origins = list(pending.keys())
+    # Один объект-назначение, поэтому в запрос помещается до (лимит - 1) источников
+    chunk_size = ORS_MATRIX_MAX_ROUTES - 1
+    requests_count = 0
+    for start in range(0, len(unique_origins), chunk_size):
+        chunk = unique_origins[start:start + chunk_size]
+        locations = [[lon, lat] for lat, lon in chunk]
+        locations.append([destination_coords[1], destination_coords[0]])
         try:
-            dist = round(geodesic(origin_coords, destination_coords).kilometers, 2)
-            log_warning(session_state, f"Используется расчёт по прямой: {dist} км", "Ошибка ORS API")
-            return None, dist
-        except Exception as fallback_error:
-            log_api_error(session_state, "Geopy", fallback_error, "Ошибка при расчёте расстояния по прямой")
-            return None, 0
+            log_info(session_state, f"Запрос матрицы ORS: {len(chunk)} поставщиков → объект")
+            started = time.perf_counter()
+            result = _ors_call(
+                ors_client, 'distance_matrix',
+                locations=locations,
+                profile=profile,
+                sources=list(range(len(chunk))),
+                destinations=[len(chunk)],
+                metrics=['distance', 'duration']
+            )
+            requests_count += 1
+            log_info(session_state, f"Получена матрица ORS: {len(chunk)} расстояний", api="ORS Matrix",
+                     latency_ms=(time.perf_counter() - started) * 1000)
+        except ApiUnavailableError as e:
+            log_warning(session_state, f"{e}. Матрица расстояний не рассчитана")
+            break
+        except Exception as e:
+            log_api_error(session_state, "OpenRouteService Matrix", e, f"Поставщиков в запросе: {len(chunk)}")
+            continue
+
+        durations = result.get('durations') or [[None]] * len(chunk)
+        for origin, row, duration_row in zip(chunk, result['distances'], durations):
+            if row[0] is None:
+                if _is_remote_ors(ors_client):
+                    route_cache.set_failure(origin, destination_coords, None, "Matrix API: маршрут не найден", profile)
+                continue
+            distance_km = round(row[0] / 1000, 2)
+            # Сохраняем только расстояние, геометрия будет запрошена при выборе поставщика
+            route_cache.set(origin, destination_coords, None, distance_km, duration_row[0], profile)
+            for i in pending[origin]:
+                distances[i] = distance_km
+
+    log_info(session_state, f"Матрица расстояний рассчитана: {len(origins)} поставщиков, запросов ORS: {requests_count}")
+    return distances